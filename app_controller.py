@@ -1,14 +1,12 @@
 # Đường dẫn: excel_toolkit/app_controller.py
-# Phiên bản 1.0 - Tách logic xử lý ra khỏi main.py
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 1.9 - Thêm tác vụ đóng gói lại file (bước gói cuối của batch)
+# Ngày cập nhật: 2026-10-17
 
 import tkinter.filedialog as filedialog
 import threading
 import logging
-import shutil
-import tempfile
 import os
-from excel_controller import ExcelController
+import batch_runner
 from ui import AppUI, TaskSelectionDialog
 from ui_notifier import StatusNotifier
 from localization import translator
@@ -21,7 +19,9 @@ from processes import (
     set_print_settings,
     clear_excess_cell_formatting,
     compress_all_images,
-    refresh_and_clean_pivot_caches
+    refresh_and_clean_pivot_caches,
+    compact_shared_strings,
+    repack
 )
 
 class AppController:
@@ -30,6 +30,7 @@ class AppController:
         self.ui = AppUI(root, self)
         self.notifier = StatusNotifier(root)
         self.file_paths = []
+        self.max_workers = batch_runner.DEFAULT_MAX_WORKERS
         
         self.task_map = {
             "add_label": (translator.get_text("task_add_label"), set_label.run),
@@ -39,7 +40,23 @@ class AppController:
             "set_print_settings": (translator.get_text("task_set_print_settings"), set_print_settings.run),
             "clear_excess_cell_formatting": (translator.get_text("task_clear_excess_cell_formatting"), clear_excess_cell_formatting.run),
             "compress_all_images": (translator.get_text("task_compress_all_images"), compress_all_images.run),
-            "refresh_and_clean_pivot_caches": (translator.get_text("task_refresh_and_clean_pivot_caches"), refresh_and_clean_pivot_caches.run)
+            "refresh_and_clean_pivot_caches": (translator.get_text("task_refresh_and_clean_pivot_caches"), refresh_and_clean_pivot_caches.run),
+            "compact_shared_strings": (translator.get_text("task_compact_shared_strings"), compact_shared_strings.run),
+            "repack": (translator.get_text("task_repack"), repack.run)
+        }
+        # Cách mỗi tác vụ tham gia kế hoạch gộp; tác vụ không có ở đây chạy riêng trên workbook.
+        # Nếu không có bước nào cần Excel, batch sửa trực tiếp các file mà không mở Excel.
+        self.stage_factories = {
+            "add_label": set_label.fusion_stage,
+            "delete_hidden_sheets": delete_hidden_sheets.fusion_stage,
+            "delete_external_links": delete_external_links.fusion_stage,
+            "delete_defined_names": delete_defined_names.fusion_stage,
+            "set_print_settings": set_print_settings.fusion_stage,
+            "clear_excess_cell_formatting": clear_excess_cell_formatting.fusion_stage,
+            "compress_all_images": compress_all_images.fusion_stage,
+            "refresh_and_clean_pivot_caches": refresh_and_clean_pivot_caches.fusion_stage,
+            "compact_shared_strings": compact_shared_strings.fusion_stage,
+            "repack": repack.fusion_stage,
         }
 
     def open_folder(self, folder_path):
@@ -111,9 +128,10 @@ class AppController:
             return
             
         save_mode_text = self.ui.save_option_menu.get()
-        save_details = {}
+        save_details = {'mode': batch_runner.SAVE_OVERWRITE}
         
         if save_mode_text == translator.get_text("save_rename"):
+            save_details['mode'] = batch_runner.SAVE_RENAME
             affix_type = self.ui.rename_type_var.get()
             affix_text = self.ui.affix_entry.get()
             if not affix_text:
@@ -126,89 +144,49 @@ class AppController:
             if not folder or not os.path.isdir(folder): 
                 self.log_message("Vui lòng chọn thư mục đích hợp lệ.", style="error")
                 return
+            save_details['mode'] = batch_runner.SAVE_OUTPUT_FOLDER
             save_details['folder'] = folder
 
         dialog = TaskSelectionDialog(self.root)
-        selected_tasks, selected_engine_text, quality_param, selected_label_text = dialog.get_selected_tasks()
+        selected_tasks, selected_engine_text, quality_param, selected_label_text, use_excel = dialog.get_selected_tasks()
         
         engine = None
         if selected_engine_text == translator.get_text("engine_pil"):
             engine = "pil"
         elif selected_engine_text == translator.get_text("engine_spire"):
             engine = "spire"
+        elif selected_engine_text == translator.get_text("engine_ooxml"):
+            engine = "ooxml"
 
         if not selected_tasks: 
             self.log_message("Cancelled.", style="info", duration=0)
             return
             
         save_details['text'] = save_mode_text
-        self.process_files(selected_files, selected_tasks, engine, quality_param, selected_label_text, save_details)
+        self.process_files(selected_files, selected_tasks, engine, quality_param, selected_label_text, save_details, use_excel)
 
-    def process_files(self, files, tasks, engine, quality_param, label_text, save_details):
-        processing_thread = threading.Thread(target=self._run_batch_thread, args=(files, tasks, self.task_map, engine, quality_param, label_text, save_details))
+    def process_files(self, files, tasks, engine, quality_param, label_text, save_details, use_excel=False):
+        processing_thread = threading.Thread(target=self._run_batch_thread, args=(files, tasks, self.task_map, engine, quality_param, label_text, save_details, use_excel))
         processing_thread.start()
 
-    def _run_batch_thread(self, files, tasks, task_map, engine, quality_param, label_text, save_details):
-        total_files, temp_dir = len(files), tempfile.mkdtemp()
-        try:
-            self.log_message(f"Processing {total_files} files...", style="process", duration=0)
-            for i, original_path in enumerate(files):
-                file_name = os.path.basename(original_path)
-                temp_path = os.path.join(temp_dir, file_name)
-                shutil.copy2(original_path, temp_path)
-                
-                is_file_processed_successfully = True
-                
-                with ExcelController(visible=False, optimize_performance=True) as controller:
-                    try:
-                        if not controller.open_workbook(temp_path):
-                            raise Exception(f"Could not open workbook: {file_name}")
-
-                        for task_id in tasks:
-                            task_name, task_func = task_map[task_id]
-                            self.log_message(f"File {i+1}/{total_files}\nRunning '{task_name}' on: {file_name}", style="info", duration=0)
-                            
-                            if task_id == "compress_all_images":
-                                quality_value = int(quality_param) if quality_param and quality_param.isdigit() else 70
-                                task_func(controller, temp_path, engine, quality_value)
-                            elif task_id == "add_label":
-                                task_func(controller, temp_path, label_text=label_text)
-                            else:
-                                task_func(controller, temp_path)
-                        
-                        controller.save_workbook()
-
-                    except Exception as e:
-                        self.log_message(f"ERROR processing file: {file_name}\nDetails: {e}", style="error", duration=8)
-                        logging.exception(f"An exception occurred while processing {file_name}")
-                        is_file_processed_successfully = False
-                
-                if is_file_processed_successfully:
-                    try:
-                        mode = save_details['text']
-                        if mode == translator.get_text("save_overwrite"):
-                            shutil.move(temp_path, original_path)
-                            self.log_message(f"Overwrote file: {file_name}", style="success")
-                        
-                        elif mode == translator.get_text("save_rename"):
-                            base, ext = os.path.splitext(original_path)
-                            dir_name = os.path.dirname(original_path)
-                            affix_text = save_details['affix_text']
-                            if save_details['affix_type'] == 'prefix':
-                                new_path = os.path.join(dir_name, f"{affix_text}{os.path.basename(base)}{ext}")
-                            else: # Suffix
-                                new_path = f"{base}{affix_text}{ext}"
-                            shutil.move(temp_path, new_path)
-                            self.log_message(f"Saved new file: {os.path.basename(new_path)}", style="success")
-
-                        elif mode == translator.get_text("save_output_folder"):
-                            dest_path = os.path.join(save_details['folder'], file_name)
-                            if not os.path.exists(save_details['folder']): os.makedirs(save_details['folder'])
-                            shutil.move(temp_path, dest_path)
-                            self.log_message(f"Saved to destination: {file_name}", style="success")
-                    except Exception as e:
-                        self.log_message(f"Error saving file {file_name}: {e}", style="error", duration=8)
-                        logging.exception(f"An exception occurred while saving {file_name}")
-            self.log_message(f"Completed! Processed {total_files} files.", style="success", duration=5)
-        finally:
-            shutil.rmtree(temp_dir)
+    def _run_batch_thread(self, files, tasks, task_map, engine, quality_param, label_text, save_details, use_excel=False):
+        total_files = len(files)
+        self.log_message(f"Processing {total_files} files...", style="process", duration=0)
+        options = {
+            'engine': engine,
+            'quality': int(quality_param) if quality_param and quality_param.isdigit() else 70,
+            'label_text': label_text,
+            'use_excel': use_excel,
+        }
+        # Sự kiện tiến độ từ các worker được đưa về đây rồi chuyển cho notifier.
+        on_event = lambda event: self.log_message(event['message'], style=event['style'], duration=event['duration'])
+        summary = batch_runner.run_batch(files, tasks, task_map, options, save_details, on_event=on_event,
+                                         max_workers=self.max_workers, stage_factories=self.stage_factories,
+                                         skip_noop_tasks=True)
+        cache_note = ""
+        if summary['cache_hits'] or summary['cache_misses']:
+            cache_note = f" Image cache: {summary['cache_hits']} hits / {summary['cache_misses']} misses."
+        if summary['failed']:
+            self.log_message(f"Completed! Processed {total_files} files ({summary['failed']} failed).{cache_note}", style="warning", duration=5)
+        else:
+            self.log_message(f"Completed! Processed {total_files} files.{cache_note}", style="success", duration=5)
@@ -0,0 +1,344 @@
+# Đường dẫn: excel_toolkit/batch_runner.py
+# Phiên bản 1.8 - Bước gói cuối kế hoạch chạy sau khi Excel đã lưu và đóng workbook
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from utils.app_pool import ExcelAppPool
+from utils import image_encoder, size_profiler, task_fusion
+
+# --- Các chế độ lưu (độc lập với ngôn ngữ giao diện) ---
+SAVE_OVERWRITE = "overwrite"
+SAVE_RENAME = "rename"
+SAVE_OUTPUT_FOLDER = "output_folder"
+
+# Mỗi worker giữ một instance Excel riêng nên không nên mở quá nhiều cùng lúc.
+DEFAULT_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# Số workbook tối đa một instance Excel xử lý trước khi được thay mới.
+DEFAULT_APP_MAX_USES = 50
+# Tác vụ offline chỉ sửa file zip (không có Excel) nên có thể dùng mọi nhân CPU.
+DEFAULT_OFFLINE_WORKERS = max(1, os.cpu_count() or 1)
+
+_event_queue = None
+_app_pool = None
+
+# ======================================================================
+# --- Nhóm 1: Phía worker ---
+# ======================================================================
+
+def _init_worker(event_queue, log_level, app_max_uses=DEFAULT_APP_MAX_USES, encode_workers=None):
+    """
+    Khởi tạo cho mỗi tiến trình worker: ghi nhớ hàng đợi sự kiện, chuyển
+    toàn bộ log của worker về tiến trình chính qua cùng hàng đợi đó và tạo
+    một pool Excel riêng (1 instance) dùng lại cho mọi file của worker.
+    `encode_workers`: phần CPU dành cho việc nén ảnh của worker này.
+    """
+    global _event_queue, _app_pool
+    _event_queue = event_queue
+    image_encoder.configure_encode_workers(encode_workers)
+    _app_pool = ExcelAppPool(size=1, max_uses=app_max_uses, optimize_performance=True)
+    # atexit không chạy trong tiến trình con của multiprocessing; Finalize thì có.
+    multiprocessing.util.Finalize(None, _app_pool.close, exitpriority=10)
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(logging.handlers.QueueHandler(event_queue))
+    root_logger.setLevel(log_level)
+
+def _emit(message, style="info", duration=0):
+    """Gửi một sự kiện tiến độ về tiến trình chính."""
+    if _event_queue is not None:
+        _event_queue.put({'message': message, 'style': style, 'duration': duration})
+
+def _run_task(controller, temp_path, job, task_id):
+    """Chạy một tác vụ workbook (hàm run của process) trên workbook đang mở."""
+    options = job['options']
+    task_func = job['task_map'][task_id][1]
+    if task_id == "compress_all_images":
+        extra = {'target_dpi': options['target_dpi']} if 'target_dpi' in options else {}
+        engine = options.get('engine')
+        if engine == 'ooxml' and not zipfile.is_zipfile(temp_path):
+            logging.warning(f"Engine OOXML không đọc được file .xls, dùng engine Pillow cho: {os.path.basename(temp_path)}")
+            engine = 'pil'
+        task_func(controller, temp_path, engine, options.get('quality', 70), **extra)
+    elif task_id == "add_label":
+        task_func(controller, temp_path, label_text=options.get('label_text'))
+    else:
+        task_func(controller, temp_path)
+
+def _run_step(controller, temp_path, job, step):
+    """Chạy một bước của kế hoạch gộp (xem utils.task_fusion.plan)."""
+    file_name = os.path.basename(job['original_path'])
+    task_names = ", ".join(job['task_map'][task_id][0] for task_id in step['tasks'])
+    _emit(f"File {job['index'] + 1}/{job['total']}\nRunning '{task_names}' on: {file_name}", style="info")
+    stages, options = job['stages'], job['options']
+
+    if step['kind'] == task_fusion.KIND_PACKAGE:
+        if controller is not None and controller.workbook is not None:
+            # Workbook đang mở: lưu, đóng, sửa gói rồi mở lại
+            controller.run_offline(temp_path, task_fusion.apply_package_step, step['tasks'], stages, options)
+        else:
+            task_fusion.apply_package_step(temp_path, step['tasks'], stages, options)
+    elif step['kind'] == task_fusion.KIND_SHEETS:
+        task_fusion.run_sheet_step(controller, step['tasks'], stages, options)
+    else:
+        _run_task(controller, temp_path, job, step['tasks'][0])
+
+def _prune_plan(temp_path, job):
+    """
+    Bỏ khỏi kế hoạch các tác vụ mà size_profiler xác định chắc chắn không có gì để làm
+    trên file này (không có ảnh, pivot cache, liên kết ngoài, name, sheet ẩn...).
+    """
+    skipped = size_profiler.noop_tasks(size_profiler.profile_package(temp_path, include_parts=False), job['tasks'])
+    if not skipped:
+        return job['plan']
+    logging.info(f"Bỏ qua tác vụ không có gì để làm trên {os.path.basename(temp_path)}: {', '.join(skipped)}")
+    return task_fusion.plan([task_id for task_id in job['tasks'] if task_id not in skipped], job['stages'])
+
+def _file_plan(temp_path, job):
+    """
+    Kế hoạch cho một file. File không phải gói OOXML (.xls) không sửa gói được: mọi tác vụ chạy
+    bằng hàm run qua Excel như trước, tác vụ chỉ dành cho .xlsx/.xlsm bị bỏ qua.
+    """
+    if zipfile.is_zipfile(temp_path):
+        return _prune_plan(temp_path, job) if job.get('skip_noop_tasks') else job['plan']
+    stages = job['stages']
+    skipped = [task_id for task_id in job['tasks'] if stages[task_id].requires_ooxml]
+    if skipped:
+        logging.warning(f"Bỏ qua tác vụ chỉ áp dụng cho .xlsx/.xlsm trên {os.path.basename(temp_path)}: {', '.join(skipped)}")
+    steps = task_fusion.plan([task_id for task_id in job['tasks'] if task_id not in skipped], stages, package=False)
+    logging.info(f"File không phải gói OOXML, chạy qua Excel: {task_fusion.describe(steps)}")
+    return steps
+
+def _run_plan(temp_path, job, steps):
+    """
+    Chạy kế hoạch `steps` của job. Excel chỉ được dùng khi kế hoạch có bước COM, và workbook
+    chỉ được mở khi tới bước COM đầu tiên (các bước gói trước đó sửa thẳng file). Bước gói cuối
+    cùng (vd. đóng gói lại) chạy sau khi workbook đã được lưu và đóng để Excel không ghi đè lên gói.
+    """
+    if not steps:
+        return
+    if not task_fusion.needs_excel(steps):
+        for step in steps:
+            _run_step(None, temp_path, job, step)
+        return
+
+    # Import muộn: kế hoạch chỉ gồm bước gói không cần xlwings/Excel trong worker.
+    from excel_controller import ExcelController
+    with ExcelController(visible=False, optimize_performance=True, app_pool=_app_pool) as controller:
+        for index, step in enumerate(steps):
+            if step['kind'] != task_fusion.KIND_PACKAGE and controller.workbook is None:
+                if not controller.open_workbook(temp_path):
+                    raise Exception(f"Could not open workbook: {os.path.basename(temp_path)}")
+            elif (step['kind'] == task_fusion.KIND_PACKAGE and index == len(steps) - 1
+                  and controller.workbook is not None):
+                if not controller.close_workbook(save=True):
+                    raise Exception(f"Could not save workbook: {os.path.basename(temp_path)}")
+            _run_step(controller, temp_path, job, step)
+        if controller.workbook is not None:
+            controller.save_workbook()
+
+def _save_result(temp_path, original_path, save_details):
+    """
+    Di chuyển file đã xử lý về vị trí đích theo chế độ lưu.
+    Trả về (đường dẫn đích, thông báo).
+    """
+    file_name = os.path.basename(original_path)
+    mode = save_details['mode']
+
+    if mode == SAVE_OVERWRITE:
+        shutil.move(temp_path, original_path)
+        return original_path, f"Overwrote file: {file_name}"
+
+    if mode == SAVE_RENAME:
+        base, ext = os.path.splitext(original_path)
+        dir_name = os.path.dirname(original_path)
+        affix_text = save_details['affix_text']
+        if save_details['affix_type'] == 'prefix':
+            new_path = os.path.join(dir_name, f"{affix_text}{os.path.basename(base)}{ext}")
+        else: # Suffix
+            new_path = f"{base}{affix_text}{ext}"
+        shutil.move(temp_path, new_path)
+        return new_path, f"Saved new file: {os.path.basename(new_path)}"
+
+    if mode == SAVE_OUTPUT_FOLDER:
+        dest_path = os.path.join(save_details['folder'], file_name)
+        if not os.path.exists(save_details['folder']): os.makedirs(save_details['folder'], exist_ok=True)
+        shutil.move(temp_path, dest_path)
+        return dest_path, f"Saved to destination: {file_name}"
+
+    raise ValueError(f"Chế độ lưu không hợp lệ: {mode}")
+
+def process_file(job):
+    """
+    Xử lý trọn vẹn một file: sao chép vào thư mục tạm, chạy kế hoạch gộp tác vụ
+    (sửa trực tiếp gói và/hoặc mở bằng ExcelController riêng của worker), lưu và
+    di chuyển kết quả.
+    Trả về dict kết quả để tiến trình chính tổng hợp.
+    """
+    original_path = job['original_path']
+    file_name = os.path.basename(original_path)
+    result = {'file': original_path, 'ok': False, 'saved_path': None, 'error': None, 'cache_hits': 0, 'cache_misses': 0}
+    cache_before = image_encoder.image_cache_stats()
+
+    # Mỗi file một thư mục con để tránh trùng tên giữa các thư mục con khác nhau.
+    file_temp_dir = os.path.join(job['temp_dir'], str(job['index']))
+    os.makedirs(file_temp_dir, exist_ok=True)
+    temp_path = os.path.join(file_temp_dir, file_name)
+    try:
+        shutil.copy2(original_path, temp_path)
+
+        try:
+            _run_plan(temp_path, job, _file_plan(temp_path, job))
+        except Exception as e:
+            _emit(f"ERROR processing file: {file_name}\nDetails: {e}", style="error", duration=8)
+            logging.exception(f"An exception occurred while processing {file_name}")
+            result['error'] = str(e)
+            return result
+
+        try:
+            saved_path, message = _save_result(temp_path, original_path, job['save_details'])
+            _emit(message, style="success")
+            result['ok'], result['saved_path'] = True, saved_path
+        except Exception as e:
+            _emit(f"Error saving file {file_name}: {e}", style="error", duration=8)
+            logging.exception(f"An exception occurred while saving {file_name}")
+            result['error'] = str(e)
+        return result
+    except Exception as e:
+        _emit(f"ERROR processing file: {file_name}\nDetails: {e}", style="error", duration=8)
+        logging.exception(f"An exception occurred while processing {file_name}")
+        result['error'] = str(e)
+        return result
+    finally:
+        cache_after = image_encoder.image_cache_stats()
+        result['cache_hits'] = cache_after['hits'] - cache_before['hits']
+        result['cache_misses'] = cache_after['misses'] - cache_before['misses']
+        shutil.rmtree(file_temp_dir, ignore_errors=True)
+
+# ======================================================================
+# --- Nhóm 2: Phía tiến trình chính ---
+# ======================================================================
+
+def _drain_events(event_queue, on_event):
+    """Chuyển toàn bộ sự kiện/log đang chờ trong hàng đợi cho tiến trình chính."""
+    while True:
+        try:
+            item = event_queue.get_nowait()
+        except queue.Empty:
+            return
+        if isinstance(item, logging.LogRecord):
+            logging.getLogger(item.name).handle(item)
+        elif on_event:
+            on_event(item)
+
+def run_batch(files, tasks, task_map, options, save_details, on_event=None, max_workers=None, app_max_uses=DEFAULT_APP_MAX_USES,
+              stage_factories=None, offline_max_workers=None, skip_noop_tasks=False):
+    """
+    Chạy các tác vụ trên danh sách file bằng một pool tiến trình worker.
+
+    Tham số:
+        files (list): Danh sách đường dẫn file gốc.
+        tasks (list): Danh sách task_id theo thứ tự chạy.
+        task_map (dict): task_id -> (tên hiển thị, hàm run của process).
+        options (dict): Tham số cho tác vụ ('engine', 'quality', 'target_dpi', 'label_text', 'use_excel').
+        save_details (dict): Chế độ lưu ('mode') và thông tin kèm theo.
+        on_event (callable, tùy chọn): Nhận dict {'message', 'style', 'duration'}.
+        max_workers (int, tùy chọn): Số tiến trình worker. <= 1 để chạy tuần tự.
+        app_max_uses (int, tùy chọn): Số workbook mỗi instance Excel xử lý trước khi được thay mới.
+        stage_factories (dict, tùy chọn): task_id -> hàm fusion_stage(options) của process, dùng để
+            gộp các tác vụ (utils.task_fusion); tác vụ được sắp theo pha, thứ tự đã chọn chỉ giữ trong
+            cùng pha. Nếu kế hoạch không có bước COM và mọi file là .xlsx/.xlsm, batch chạy không cần Excel;
+            file .xls luôn chạy các tác vụ qua Excel.
+        offline_max_workers (int, tùy chọn): Số tiến trình worker khi chạy không cần Excel.
+        skip_noop_tasks (bool, tùy chọn): Phân tích nhanh từng file (utils.size_profiler) và bỏ qua
+            các tác vụ chắc chắn không có gì để làm; file không còn tác vụ nào được lưu nguyên trạng.
+
+    Trả về dict tổng kết {'total', 'succeeded', 'failed', 'cache_hits', 'cache_misses', 'results'}.
+    """
+    global _event_queue, _app_pool
+    stages = task_fusion.build_stages(tasks, stage_factories, options)
+    steps = task_fusion.plan(tasks, stages)
+    logging.info(f"Kế hoạch tác vụ: {task_fusion.describe(steps)}")
+    if task_fusion.planned_tasks(steps) != list(tasks):
+        logging.info("Các tác vụ được sắp lại theo pha (xóa sheet -> sửa gói -> từng sheet -> workbook), "
+                     "thứ tự đã chọn chỉ được giữ trong cùng pha.")
+    # File .xls không sửa gói được và luôn cần Excel (xem _file_plan)
+    offline = not task_fusion.needs_excel(steps) and all(zipfile.is_zipfile(path) for path in files)
+    if offline:
+        logging.info("Mọi tác vụ đã chọn đều chạy được offline: xử lý trực tiếp file, không cần Excel.")
+        max_workers = offline_max_workers or DEFAULT_OFFLINE_WORKERS
+    else:
+        max_workers = max_workers or DEFAULT_MAX_WORKERS
+    total_files = len(files)
+    selected_task_map = {task_id: task_map[task_id] for task_id in tasks}
+    temp_dir = tempfile.mkdtemp()
+    results = []
+
+    def make_job(index, path):
+        return {
+            'index': index, 'total': total_files, 'original_path': path, 'temp_dir': temp_dir,
+            'tasks': list(tasks), 'task_map': selected_task_map,
+            'options': options, 'save_details': save_details,
+            'stages': stages, 'plan': steps, 'skip_noop_tasks': skip_noop_tasks,
+        }
+
+    try:
+        if max_workers <= 1 or total_files <= 1:
+            # Chạy ngay trong luồng hiện tại, vẫn dùng chung cơ chế sự kiện.
+            local_queue = queue.Queue()
+            previous_queue, _event_queue = _event_queue, local_queue
+            previous_pool, _app_pool = _app_pool, ExcelAppPool(size=1, max_uses=app_max_uses, optimize_performance=True)
+            try:
+                for i, path in enumerate(files):
+                    results.append(process_file(make_job(i, path)))
+                    _drain_events(local_queue, on_event)
+            finally:
+                _app_pool.close()
+                _event_queue, _app_pool = previous_queue, previous_pool
+        else:
+            with multiprocessing.Manager() as manager:
+                event_queue = manager.Queue()
+                worker_count = min(max_workers, total_files)
+                # Chia CPU cho các worker để pool nén ảnh bên trong không nhân lên worker_count lần
+                encode_workers = max(1, (os.cpu_count() or 1) // worker_count)
+                logging.info(f"Khởi tạo {worker_count} tiến trình worker cho {total_files} file.")
+                with ProcessPoolExecutor(max_workers=worker_count, initializer=_init_worker,
+                                         initargs=(event_queue, logging.getLogger().level, app_max_uses,
+                                                   encode_workers)) as executor:
+                    pending = {executor.submit(process_file, make_job(i, path)): path for i, path in enumerate(files)}
+                    while pending:
+                        done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                        _drain_events(event_queue, on_event)
+                        for future in done:
+                            path = pending.pop(future)
+                            try:
+                                results.append(future.result())
+                            except Exception as e:
+                                # Worker bị chết (ví dụ Excel crash) - vẫn báo lỗi theo từng file.
+                                file_name = os.path.basename(path)
+                                logging.error(f"Worker gặp lỗi khi xử lý {file_name}: {e}")
+                                if on_event:
+                                    on_event({'message': f"ERROR processing file: {file_name}\nDetails: {e}", 'style': "error", 'duration': 8})
+                                results.append({'file': path, 'ok': False, 'saved_path': None, 'error': str(e),
+                                                'cache_hits': 0, 'cache_misses': 0})
+                    _drain_events(event_queue, on_event)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    succeeded = sum(1 for r in results if r['ok'])
+    return {
+        'total': total_files, 'succeeded': succeeded, 'failed': total_files - succeeded,
+        'cache_hits': sum(r.get('cache_hits', 0) for r in results),
+        'cache_misses': sum(r.get('cache_misses', 0) for r in results),
+        'results': results,
+    }
@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/excel_controller.py
-# Phiên bản: 4.9 - Sửa lỗi logic gọi engine Spire
-# Ngày cập nhật: 2025-09-15
+# Phiên bản: 5.7 - Đặt lại calculation của ứng dụng mượn từ pool sau khi mở workbook
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import xlwings as xw
@@ -9,21 +9,35 @@ import os
 from utils import (
     app_ops, cleanup_ops, convert_ops, data_ops, file_system_ops,
     print_ops, range_ops, shape_ops, worksheet_ops, 
-    compressor_engine_pil, compressor_engine_spire
+    compressor_engine_pil, compressor_engine_spire, compressor_engine_ooxml,
+    image_encoder
 )
 
 class ExcelController:
     """
     Lớp điều khiển trung tâm (Facade) cho framework Excel Toolkit.
+
+    Nếu truyền `app_pool` (utils.app_pool.ExcelAppPool), ứng dụng Excel được mượn
+    từ pool khi vào context và trả lại khi thoát thay vì khởi tạo/thoát mỗi lần.
     """
-    def __init__(self, visible=False, optimize_performance=False):
+    def __init__(self, visible=False, optimize_performance=False, app_pool=None):
         self.app = None
         self.workbook = None
         self.visible = visible
         self.optimize_performance = optimize_performance
+        self.app_pool = app_pool
         self.last_error = None
         
     def __enter__(self):
+        if self.app_pool is not None:
+            try:
+                self.app = self.app_pool.lease(visible=self.visible)
+                logging.info("Đã mượn ứng dụng Excel từ pool.")
+            except Exception as e:
+                self.last_error = f"Lỗi khi mượn ứng dụng Excel từ pool: {e}"
+                logging.error(self.last_error)
+                self.app = None
+            return self
         try:
             self.app = xw.App(visible=self.visible)
             if self.optimize_performance:
@@ -42,8 +56,12 @@ class ExcelController:
                 self.workbook.close()
             except Exception as e:
                 logging.warning(f"Lỗi khi đóng workbook: {e}")
-        
-        if self.app:
+            self.workbook = None
+
+        if self.app and self.app_pool is not None:
+            self.app_pool.release(self.app)
+            self.app = None
+        elif self.app:
             try:
                 if self.optimize_performance:
                     self.app.display_alerts = True
@@ -69,6 +87,8 @@ class ExcelController:
                 file_path, read_only=read_only, password=password,
                 ignore_read_only_recommended=ignore_read_only_recommended
             )
+            if self.app_pool is not None:
+                self.app_pool.prepare_workbook(self.app)
             logging.info(f"Đã mở workbook thành công: '{os.path.basename(file_path)}'.")
             return True
         except Exception as e:
@@ -80,6 +100,8 @@ class ExcelController:
             logging.error("Lỗi: Ứng dụng Excel chưa được khởi tạo."); return False
         try:
             self.workbook = self.app.books.add()
+            if self.app_pool is not None:
+                self.app_pool.prepare_workbook(self.app)
             if file_path:
                 self.workbook.save(file_path)
                 logging.info(f"Đã tạo và lưu workbook mới thành công tại '{file_path}'.")
@@ -102,6 +124,21 @@ class ExcelController:
             self.last_error = f"Lỗi khi lưu workbook: {e}"
             logging.error(self.last_error); return False
             
+    def run_offline(self, file_path, func, *args, **kwargs):
+        """
+        Chạy một thao tác offline (sửa trực tiếp file trên đĩa). Nếu workbook đang mở,
+        nó được lưu và đóng trước, rồi mở lại sau khi thao tác hoàn tất.
+        """
+        reopen = self.workbook is not None
+        if reopen:
+            self.save_workbook()
+            self.close_workbook(save=False)
+        try:
+            return func(file_path, *args, **kwargs)
+        finally:
+            if reopen:
+                self.open_workbook(file_path)
+
     def close_workbook(self, save=True):
         if not self.workbook:
             logging.warning("Không có workbook nào đang hoạt động để đóng."); return False
@@ -179,6 +216,8 @@ class ExcelController:
         return range_ops.set_range_values(self.workbook, sheet_name, start_cell, values)
     def get_last_row(self, sheet_name, column='A'):
         return range_ops.get_last_row(self.workbook, sheet_name, column)
+    def freeze_formulas(self, sheet_name, addresses):
+        return range_ops.freeze_formulas(self.workbook, sheet_name, addresses)
     def format_range(self, sheet_name, range_address, format_properties):
         return range_ops.format_range(self.workbook, sheet_name, range_address, format_properties)
     def autofit_columns(self, sheet_name, range_address=None):
@@ -206,18 +245,23 @@ class ExcelController:
         return shape_ops.delete_shape(self.workbook, sheet_name, shape_name)
     
     # Hàm nén ảnh tổng hợp, cho phép chọn engine
-    def compress_all_images(self, file_path, engine='pil', quality=70):
+    def compress_all_images(self, file_path, engine='pil', quality=70, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
+        # target_dpi: ảnh được thu nhỏ về kích thước hiển thị x target_dpi (None để tắt)
         if engine == 'pil':
             logging.info("Sử dụng engine 'Pillow' để nén ảnh.")
             # Pillow engine cần workbook object
-            return compressor_engine_pil.compress_images(self.workbook, quality=quality)
+            return compressor_engine_pil.compress_images(self.workbook, quality=quality, target_dpi=target_dpi)
         elif engine == 'spire':
             logging.info("Sử dụng engine 'Spire' để nén ảnh.")
             # Spire engine cần đường dẫn file
             # SỬA LỖI: Chỉ truyền một tham số đường dẫn
-            return compressor_engine_spire.compress_images(file_path, max_size_kb=quality)
+            return compressor_engine_spire.compress_images(file_path, max_size_kb=quality, target_dpi=target_dpi)
+        elif engine == 'ooxml':
+            logging.info("Sử dụng engine 'OOXML' để nén ảnh (không cần Excel).")
+            # OOXML engine sửa trực tiếp file zip nên workbook phải được lưu & đóng trước
+            return self.run_offline(file_path, compressor_engine_ooxml.compress_images, quality=quality, target_dpi=target_dpi)
         else:
-            logging.error(f"Engine nén ảnh '{engine}' không hợp lệ. Vui lòng chọn 'pil' hoặc 'spire'.")
+            logging.error(f"Engine nén ảnh '{engine}' không hợp lệ. Vui lòng chọn 'pil', 'spire' hoặc 'ooxml'.")
             return False
             
     # ======================================================================
@@ -226,12 +270,14 @@ class ExcelController:
 
     def delete_external_links(self):
         return cleanup_ops.delete_external_links(self.workbook)
-    def delete_defined_names(self):
-        return cleanup_ops.delete_defined_names(self.workbook)
+    def delete_defined_names(self, keep=None):
+        return cleanup_ops.delete_defined_names(self.workbook, keep)
     def remove_personal_info(self):
         return cleanup_ops.remove_personal_info(self.workbook)
     def clear_excess_cell_formatting(self):
         return cleanup_ops.clear_excess_cell_formatting(self.workbook)
+    def clear_sheet_excess_formatting(self, sheet_name):
+        return cleanup_ops.clear_sheet_excess_formatting(self.workbook, sheet_name)
     def refresh_and_clean_pivot_caches(self):
         return cleanup_ops.refresh_and_clean_pivot_caches(self.workbook)
 
@@ -249,6 +295,8 @@ class ExcelController:
         return print_ops.set_fit_to_page(self.workbook, sheet_name, fit_to_wide, fit_to_tall)
     def set_smart_print_settings(self):
         return print_ops.set_smart_print_settings(self.workbook)
+    def apply_smart_print_settings(self, sheet_name):
+        return print_ops.apply_smart_print_settings(self.workbook, sheet_name)
         
     # ======================================================================
     # --- 7. Convert Operations ---
@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/localization.py
-# Phiên bản 3.0 - Cập nhật văn bản cho nút hành động chính
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 3.4 - Thêm văn bản cho tác vụ đóng gói lại file
+# Ngày cập nhật: 2026-10-17
 
 class Translator:
     def __init__(self):
@@ -34,8 +34,12 @@ class Translator:
                 "task_compress_all_images_engine_label": "Engine nén ảnh:",
                 "engine_pil": "Pillow (Chất lượng cao)",
                 "engine_spire": "Spire.Xls (Ổn định)",
+                "engine_ooxml": "OOXML (Không cần Excel)",
                 "image_max_size_kb": "Kích thước tối đa (KB)",
                 "task_refresh_and_clean_pivot_caches": "Dọn dẹp Pivot Table caches",
+                "task_compact_shared_strings": "Thu gọn bảng chuỗi dùng chung (Shared Strings)",
+                "task_repack": "Đóng gói lại file (nén ở mức cao nhất)",
+                "option_use_excel": "Dùng Excel cho Pivot/định dạng thừa (làm mới pivot từ nguồn, chậm hơn)",
                 "run_button_dialog": "Chạy",
                 "cancel_button_dialog": "Hủy",
                 "log_level_label": "Mức độ Log:",
@@ -77,8 +81,12 @@ class Translator:
                 "task_compress_all_images_engine_label": "Image compression engine:",
                 "engine_pil": "Pillow (High Quality)",
                 "engine_spire": "Spire.Xls (Stable)",
+                "engine_ooxml": "OOXML (No Excel required)",
                 "image_max_size_kb": "Max Size (KB)",
                 "task_refresh_and_clean_pivot_caches": "Clean Pivot Table Caches",
+                "task_compact_shared_strings": "Compact Shared Strings Table",
+                "task_repack": "Repack File (maximum compression)",
+                "option_use_excel": "Use Excel for pivots/excess formatting (refreshes pivots from source, slower)",
                 "run_button_dialog": "Run",
                 "cancel_button_dialog": "Cancel",
                 "log_level_label": "Log Level:",
@@ -120,8 +128,12 @@ class Translator:
                 "task_compress_all_images_engine_label": "画像圧縮エンジン:",
                 "engine_pil": "Pillow (高品質)",
                 "engine_spire": "Spire.Xls (安定)",
+                "engine_ooxml": "OOXML (Excel不要)",
                 "image_max_size_kb": "最大サイズ (KB)",
                 "task_refresh_and_clean_pivot_caches": "ピボットテーブルキャッシュを整理",
+                "task_compact_shared_strings": "共有文字列テーブルを圧縮",
+                "task_repack": "ファイルを再パック (最大圧縮)",
+                "option_use_excel": "ピボット/余分な書式にExcelを使用 (ソースから更新、低速)",
                 "run_button_dialog": "実行",
                 "cancel_button_dialog": "キャンセル",
                 "log_level_label": "ログレベル:",
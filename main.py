@@ -1,9 +1,10 @@
 # Đường dẫn: excel_toolkit/main.py
-# Phiên bản 31.0 - Tái cấu trúc, tách UI và logic
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 31.1 - Hỗ trợ tiến trình worker khi đóng gói
+# Ngày cập nhật: 2026-10-17
 
 import customtkinter
 import logging
+import multiprocessing
 from datetime import datetime
 import os
 from app_controller import AppController
@@ -38,6 +39,8 @@ def configure_logging(level=logging.INFO):
     logging.info(f"Hệ thống ghi log đã được khởi tạo. Mức độ: {logging.getLevelName(level)}. File: {LOG_FILENAME}")
 
 if __name__ == "__main__":
+    # Cần cho các tiến trình worker của batch_runner khi đóng gói bằng PyInstaller.
+    multiprocessing.freeze_support()
     configure_logging(logging.INFO)
     
     customtkinter.set_appearance_mode("dark")
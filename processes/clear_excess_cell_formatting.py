@@ -1,10 +1,10 @@
 # Đường dẫn: excel_toolkit/processes/clear_excess_cell_formatting.py
-# Phiên bản 1.0 - Quy trình dọn dẹp định dạng ô thừa
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 2.1 - Tùy chọn use_excel: dọn định dạng thừa qua Excel thay vì trên gói
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-from excel_controller import ExcelController
+from utils import offline_style_ops, task_fusion
 
 def run(controller, file_path):
     """
@@ -17,3 +17,27 @@ def run(controller, file_path):
     except Exception as e:
         logging.error(f"Lỗi khi dọn dẹp định dạng ô thừa cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def run_offline(file_path):
+    """
+    Dọn dẹp định dạng thừa trực tiếp trên file (không cần Excel): bỏ ô/hàng/cột chỉ có định dạng
+    nằm ngoài vùng dữ liệu thật, ghi lại <dimension>, gộp style trùng và bỏ style không dùng.
+    """
+    logging.info(f"Bắt đầu dọn dẹp định dạng ô thừa (offline) cho file: {os.path.basename(file_path)}")
+    if not offline_style_ops.optimize_styles(file_path):
+        raise Exception(f"Không thể dọn dẹp định dạng ô thừa (offline) cho file: {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất dọn dẹp định dạng ô thừa (offline) cho file: {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    stats = offline_style_ops.plan_optimize_styles(zf, edits)
+    offline_style_ops.log_style_stats(stats)
+    return True
+
+def fusion_stage(options):
+    """
+    Bước gộp: tối ưu định dạng trong cùng lần ghi gói với các tác vụ offline khác.
+    Với options['use_excel'], chạy hàm run qua Excel như trước.
+    """
+    if options.get('use_excel'):
+        return task_fusion.TaskStage("clear_excess_cell_formatting", task_fusion.PHASE_WORKBOOK)
+    return task_fusion.TaskStage("clear_excess_cell_formatting", task_fusion.PHASE_PACKAGE, plan_package=_plan_package)
@@ -0,0 +1,38 @@
+# Đường dẫn: excel_toolkit/processes/compact_shared_strings.py
+# Phiên bản 1.1 - Đánh dấu tác vụ chỉ áp dụng cho gói .xlsx/.xlsm
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import os
+from utils import offline_shared_strings_ops, task_fusion
+
+def run(controller, file_path):
+    """
+    Thu gọn bảng shared strings. Thao tác sửa trực tiếp gói nên workbook đang mở
+    được lưu, đóng và mở lại quanh thao tác.
+    """
+    logging.info(f"Bắt đầu thu gọn shared strings cho file: {os.path.basename(file_path)}")
+    try:
+        if not controller.run_offline(file_path, offline_shared_strings_ops.compact_shared_strings):
+            raise Exception(f"Không thể thu gọn shared strings cho file: {os.path.basename(file_path)}")
+        logging.info(f"Hoàn tất thu gọn shared strings cho file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi thu gọn shared strings cho file '{file_path}': {e}", exc_info=True)
+        raise
+
+def run_offline(file_path):
+    """Thu gọn bảng shared strings trực tiếp trên file (không cần Excel)."""
+    logging.info(f"Bắt đầu thu gọn shared strings (offline) cho file: {os.path.basename(file_path)}")
+    if not offline_shared_strings_ops.compact_shared_strings(file_path):
+        raise Exception(f"Không thể thu gọn shared strings (offline) cho file: {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất thu gọn shared strings (offline) cho file: {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    stats = offline_shared_strings_ops.plan_compact_shared_strings(zf, edits)
+    offline_shared_strings_ops.log_shared_strings_stats(stats)
+    return bool(stats) and stats['after'] < stats['before']
+
+def fusion_stage(options):
+    """Bước gộp: thu gọn shared strings trong cùng lần ghi gói với các tác vụ offline khác."""
+    return task_fusion.TaskStage("compact_shared_strings", task_fusion.PHASE_PACKAGE, plan_package=_plan_package,
+                                requires_ooxml=True)
@@ -1,19 +1,39 @@
 # Đường dẫn: excel_toolkit/processes/compress_all_images.py
-# Phiên bản 3.0 - Cập nhật để tương thích với cấu trúc engine mới
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.2 - Engine OOXML tham gia kế hoạch gộp tác vụ (ghi chung một lần gói)
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-from excel_controller import ExcelController
+from utils import image_encoder, compressor_engine_ooxml, task_fusion
 
-def run(controller, file_path, engine='pil', quality=70):
+def run(controller, file_path, engine='pil', quality=70, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
     """
-    Quy trình nén tất cả hình ảnh trong workbook, cho phép chọn engine và thông số chất lượng.
+    Quy trình nén tất cả hình ảnh trong workbook, cho phép chọn engine, thông số chất lượng
+    và DPI mục tiêu (ảnh được thu nhỏ về kích thước hiển thị x DPI).
     """
     logging.info(f"Bắt đầu nén tất cả hình ảnh cho file: {os.path.basename(file_path)} với engine '{engine}' và chất lượng '{quality}'")
     try:
-        controller.compress_all_images(file_path, engine=engine, quality=quality)
+        controller.compress_all_images(file_path, engine=engine, quality=quality, target_dpi=target_dpi)
         logging.info(f"Hoàn tất nén tất cả hình ảnh cho file: {os.path.basename(file_path)}")
     except Exception as e:
         logging.error(f"Lỗi khi nén hình ảnh cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def _plan_package(zf, edits, file_path, options):
+    stats = compressor_engine_ooxml.plan_compress_images(
+        zf, edits, quality=options.get('quality', 70),
+        target_dpi=options.get('target_dpi', image_encoder.DEFAULT_TARGET_DPI))
+    if not stats['total'] and not stats['duplicates']:
+        logging.info("Không tìm thấy ảnh nào trong gói.")
+        return False
+    compressor_engine_ooxml.log_compress_stats(stats)
+    return stats['compressed'] > 0 or stats['duplicates'] > 0
+
+def fusion_stage(options):
+    """
+    Engine OOXML sửa trực tiếp gói nên được ghi chung một lần với các tác vụ offline khác;
+    engine Pillow/Spire chạy như tác vụ workbook.
+    """
+    if options.get('engine') == 'ooxml':
+        return task_fusion.TaskStage("compress_all_images", task_fusion.PHASE_PACKAGE, plan_package=_plan_package)
+    return task_fusion.TaskStage("compress_all_images", task_fusion.PHASE_WORKBOOK)
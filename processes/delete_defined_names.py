@@ -1,20 +1,50 @@
 # Đường dẫn: excel_toolkit/processes/delete_defined_names.py
-# Phiên bản 3.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.3 - Tham gia kế hoạch gộp tác vụ (ghi chung một lần gói OOXML)
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-from excel_controller import ExcelController
+from utils import reference_graph, offline_cleanup_ops, task_fusion
+
+def _used_names(file_path):
+    """Hàm nội bộ: Các name (casefold) còn được tham chiếu; None nếu không phân tích được file."""
+    try:
+        keep = reference_graph.build_reference_graph(file_path).used_names()
+        logging.info(f"Có {len(keep)} name đang được dùng sẽ được giữ lại.")
+        return keep
+    except Exception as e:
+        logging.warning(f"Không thể phân tích tham chiếu của file, sẽ xóa mọi name như trước: {e}")
+        return None
 
 def run(controller, file_path):
     """
-    Xóa Defined Name trong workbook (an toàn, không xóa thiết lập in).
+    Xóa Defined Name không còn được dùng trong workbook (an toàn, không xóa thiết lập in).
+    Name còn được công thức, chart, validation, định dạng có điều kiện hoặc pivot tham chiếu
+    (trực tiếp hay qua name khác) được giữ lại để không sinh lỗi #NAME?.
     """
     logging.info(f"Bắt đầu xóa Defined Name cho file: {os.path.basename(file_path)}")
     try:
-        controller.delete_defined_names()
+        controller.delete_defined_names(_used_names(file_path))
 
         logging.info(f"Hoàn tất xóa Defined Name cho file: {os.path.basename(file_path)}")
     except Exception as e:
         logging.error(f"Lỗi khi xóa Defined Name cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def run_offline(file_path):
+    """
+    Xóa Defined Name không còn được dùng trực tiếp trên file (không cần Excel).
+    """
+    logging.info(f"Bắt đầu xóa Defined Name (offline) cho file: {os.path.basename(file_path)}")
+    if not offline_cleanup_ops.delete_defined_names(file_path, keep=_used_names(file_path)):
+        raise Exception(f"Không thể xóa Defined Name (offline) cho file: {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất xóa Defined Name (offline) cho file: {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    deleted, kept = offline_cleanup_ops.defined_name_edits(zf, edits, keep=_used_names(file_path))
+    logging.info(f"Defined Names: sẽ xóa {deleted}, giữ lại {kept}.")
+    return deleted > 0
+
+def fusion_stage(options):
+    """Bước gộp: xóa Defined Name trong cùng lần ghi gói với các tác vụ offline khác."""
+    return task_fusion.TaskStage("delete_defined_names", task_fusion.PHASE_PACKAGE, plan_package=_plan_package)
@@ -1,10 +1,10 @@
 # Đường dẫn: excel_toolkit/processes/delete_external_links.py
-# Phiên bản 3.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.2 - Tham gia kế hoạch gộp tác vụ (ghi chung một lần gói OOXML)
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-from excel_controller import ExcelController
+from utils import offline_cleanup_ops, task_fusion
 
 def run(controller, file_path):
     """
@@ -18,3 +18,22 @@ def run(controller, file_path):
     except Exception as e:
         logging.error(f"Lỗi khi xóa liên kết ngoài cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def run_offline(file_path):
+    """
+    Xóa các liên kết ngoài trực tiếp trên file (không cần Excel); công thức tham chiếu
+    ra ngoài được thay bằng giá trị cache như khi ngắt liên kết trong Excel.
+    """
+    logging.info(f"Bắt đầu xóa liên kết ngoài (offline) cho file: {os.path.basename(file_path)}")
+    if not offline_cleanup_ops.delete_external_links(file_path):
+        raise Exception(f"Không thể xóa liên kết ngoài (offline) cho file: {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất xóa liên kết ngoài (offline) cho file: {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    count = offline_cleanup_ops.external_link_edits(zf, edits)
+    logging.info(f"Đã tìm thấy {count} liên kết ngoài." if count else "Không tìm thấy liên kết ngoài nào trong workbook.")
+    return count > 0
+
+def fusion_stage(options):
+    """Bước gộp: bỏ liên kết ngoài trong cùng lần ghi gói với các tác vụ offline khác."""
+    return task_fusion.TaskStage("delete_external_links", task_fusion.PHASE_PACKAGE, plan_package=_plan_package)
@@ -1,50 +1,50 @@
 # Đường dẫn: excel_toolkit/processes/delete_hidden_sheets.py
-# Phiên bản 4.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 4.5 - File không phải gói OOXML (.xls): bỏ qua phân tích tham chiếu thay vì báo lỗi
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-import openpyxl
+import zipfile
 from excel_controller import ExcelController
+from utils import reference_graph, task_fusion
 
-def _find_dependencies(file_path, visible_sheets, hidden_sheets):
+_KIND_LABELS = {
+    reference_graph.KIND_CHART: "chart",
+    reference_graph.KIND_VALIDATION: "data validation",
+    reference_graph.KIND_CONDITIONAL_FORMAT: "định dạng có điều kiện",
+    reference_graph.KIND_PIVOT_CACHE: "nguồn pivot",
+}
+
+def _plan_deletion(graph, hidden_sheets):
     """
-    Hàm nội bộ: Sử dụng openpyxl để tìm các công thức phụ thuộc vào sheet ẩn.
+    Hàm nội bộ: Chia các sheet ẩn thành (xóa được, phải giữ lại) và gom các ô công thức cần cố định.
+    Một sheet ẩn phải giữ lại nếu chart, validation, định dạng có điều kiện hoặc pivot nằm trên
+    sheet còn tồn tại tham chiếu tới nó (trực tiếp hoặc qua defined name), vì không thể
+    "cố định" các đối tượng này như công thức ô.
     """
-    logging.info("Bắt đầu tìm kiếm các công thức phụ thuộc vào sheet ẩn...")
+    deletable = {name.casefold(): name for name in hidden_sheets}
+    blockers = {}
+    changed = True
+    while changed:
+        # Lặp vì giữ lại một sheet ẩn có thể biến tham chiếu của nó thành tham chiếu "sống"
+        changed = False
+        for key, name in list(deletable.items()):
+            for ref in graph.indirect_dependents_of_sheet(name):
+                host = ref['sheet']
+                if ref['kind'] == reference_graph.KIND_CELL or (host is not None and host.casefold() in deletable):
+                    continue
+                blockers[name] = ref
+                del deletable[key]
+                changed = True
+                break
+
     dependencies = {}
-    try:
-        opx_wb = openpyxl.load_workbook(file_path, data_only=False)
-        
-        for sheet_name in visible_sheets:
-            if sheet_name not in opx_wb.sheetnames:
-                continue
-            
-            ws = opx_wb[sheet_name]
-            dependent_cells = []
-            
-            for row in ws.iter_rows():
-                for cell in row:
-                    if cell.data_type == 'f' and cell.value:
-                        formula = str(cell.value)
-                        for hidden_sheet_name in hidden_sheets:
-                            if f"'{hidden_sheet_name}'!" in formula or f"{hidden_sheet_name}!" in formula:
-                                dependent_cells.append(cell.coordinate)
-                                logging.debug(f"  -> Tìm thấy tham chiếu đến '{hidden_sheet_name}' trong ô {cell.coordinate} của sheet '{sheet_name}'")
-                                break
-            
-            if dependent_cells:
-                dependencies[sheet_name] = dependent_cells
-                
-    except Exception as e:
-        logging.error(f"Lỗi khi tìm kiếm công thức phụ thuộc bằng openpyxl: {e}")
-    
-    if dependencies:
-        logging.info(f"Đã tìm thấy {sum(len(v) for v in dependencies.values())} ô có công thức phụ thuộc.")
-    else:
-        logging.info("Không tìm thấy công thức nào phụ thuộc vào sheet ẩn.")
-        
-    return dependencies
+    for name in deletable.values():
+        for ref in graph.indirect_dependents_of_sheet(name):
+            if ref['kind'] == reference_graph.KIND_CELL and ref['sheet'].casefold() not in deletable:
+                dependencies.setdefault(ref['sheet'], set()).update(ref['ref'])
+    dependencies = {sheet: sorted(cells) for sheet, cells in dependencies.items()}
+    return list(deletable.values()), blockers, dependencies
 
 def run(controller, file_path):
     """
@@ -54,35 +54,48 @@ def run(controller, file_path):
     try:
         # Lấy danh sách sheet trực tiếp từ controller
         visible_sheets, hidden_sheets = controller.get_sheets_visibility()
-        
+
         if not hidden_sheets:
             logging.info("Không có sheet ẩn nào để xóa. Kết thúc quy trình.")
             return
 
-        # Bước 1: Tìm các ô có công thức phụ thuộc
-        dependencies = _find_dependencies(file_path, visible_sheets, hidden_sheets)
-        
+        # Bước 1: Lập đồ thị tham chiếu và xác định các ô cần cố định / sheet phải giữ lại
+        if zipfile.is_zipfile(file_path):
+            logging.info("Bắt đầu phân tích các tham chiếu tới sheet ẩn...")
+            graph = reference_graph.build_reference_graph(file_path)
+            to_delete, blockers, dependencies = _plan_deletion(graph, hidden_sheets)
+        else:
+            # Đồ thị tham chiếu chỉ đọc được gói OOXML; với .xls xóa như trước, không cố định công thức
+            logging.warning("File không phải định dạng .xlsx/.xlsm: bỏ qua phân tích tham chiếu tới sheet ẩn.")
+            to_delete, blockers, dependencies = list(hidden_sheets), {}, {}
+        for sheet_name, ref in blockers.items():
+            host = f" trên sheet '{ref['sheet']}'" if ref['sheet'] else ""
+            logging.warning(f"Giữ lại sheet ẩn '{sheet_name}': đang được dùng bởi "
+                            f"{_KIND_LABELS.get(ref['kind'], ref['kind'])} '{ref['ref']}'{host}.")
+        if dependencies:
+            logging.info(f"Đã tìm thấy {sum(len(v) for v in dependencies.values())} ô có công thức phụ thuộc.")
+        else:
+            logging.info("Không tìm thấy công thức nào phụ thuộc vào sheet ẩn.")
+
         # Bước 2: Thay thế công thức bằng giá trị, sử dụng controller
         if dependencies:
             logging.info("Bắt đầu thay thế công thức bằng giá trị...")
             for sheet_name, cell_addresses in dependencies.items():
-                for address in cell_addresses:
-                    try:
-                        # Lấy giá trị và ghi lại bằng các phương thức của controller
-                        current_value = controller.get_cell_value(sheet_name, address)
-                        controller.set_cell_value(sheet_name, address, current_value)
-                        logging.info(f"  -> Đã thay thế công thức trong ô {address} của sheet '{sheet_name}' bằng giá trị.")
-                    except Exception as e:
-                        logging.error(f"Lỗi khi thay thế công thức tại ô {address}: {e}")
+                if not controller.freeze_formulas(sheet_name, cell_addresses):
+                    logging.error(f"Lỗi khi thay thế công thức trên sheet '{sheet_name}'.")
             logging.info("Hoàn tất việc thay thế công thức.")
 
         # Bước 3: Xóa các sheet ẩn sau khi đã xử lý an toàn
         logging.info("Bắt đầu xóa các sheet ẩn...")
-        for sheet_name in hidden_sheets:
+        for sheet_name in to_delete:
             controller.delete_sheet(sheet_name)
-        
+
         logging.info(f"Hoàn tất quy trình xóa sheet ẩn cho file: {os.path.basename(file_path)}")
-        
+
     except Exception as e:
         logging.error(f"Lỗi trong quy trình xóa sheet ẩn cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def fusion_stage(options):
+    """Xóa sheet làm thay đổi cấu trúc workbook nên phải chạy trước các tác vụ khác."""
+    return task_fusion.TaskStage("delete_hidden_sheets", task_fusion.PHASE_STRUCTURE)
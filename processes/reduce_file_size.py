@@ -1,40 +1,49 @@
 # Đường dẫn: excel_toolkit/processes/reduce_file_size.py
-# Phiên bản 1.0 - Quy trình tối ưu hóa và giảm dung lượng file
-# Ngày cập nhật: 2025-09-12
+# Phiên bản 1.2 - Truyền đường dẫn file và engine cho bước nén ảnh
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
 from excel_controller import ExcelController
+from utils import offline_repack_ops
 
-def reduce_file_size(file_path):
+def reduce_file_size(file_path, repack=True, drop_patterns=offline_repack_ops.DEFAULT_DROP_PATTERNS, engine='pil', quality=70):
     """
     Thực hiện một chuỗi các tác vụ để tối ưu và giảm dung lượng file Excel.
 
     Bao gồm các bước:
     1. Dọn dẹp định dạng ô thừa.
-    2. Nén tất cả hình ảnh.
+    2. Nén tất cả hình ảnh bằng `engine` ('pil', 'spire' hoặc 'ooxml') với `quality`.
     3. Làm mới và dọn dẹp cache của Pivot Table.
+    4. (repack=True) Đóng gói lại sau khi đóng Excel: bỏ các part khớp `drop_patterns`
+       và nén lại mọi part ở mức cao nhất (xem offline_repack_ops.repack).
     """
     logging.info(f"Bắt đầu quy trình giảm dung lượng file cho: {os.path.basename(file_path)}")
+    total_steps = 4 if repack else 3
     try:
         with ExcelController(visible=False, optimize_performance=True) as controller:
             if not controller.open_workbook(file_path):
                 logging.error(f"Không thể mở file, bỏ qua: {os.path.basename(file_path)}")
                 return
 
-            logging.info("  -> Bước 1/3: Dọn dẹp định dạng ô thừa...")
+            logging.info(f"  -> Bước 1/{total_steps}: Dọn dẹp định dạng ô thừa...")
             controller.clear_excess_cell_formatting()
 
-            logging.info("  -> Bước 2/3: Nén tất cả hình ảnh...")
-            controller.compress_all_images()
+            logging.info(f"  -> Bước 2/{total_steps}: Nén tất cả hình ảnh...")
+            controller.compress_all_images(file_path, engine=engine, quality=quality)
 
-            logging.info("  -> Bước 3/3: Dọn dẹp Pivot Table caches...")
+            logging.info(f"  -> Bước 3/{total_steps}: Dọn dẹp Pivot Table caches...")
             controller.refresh_and_clean_pivot_caches()
             
             controller.save_workbook()
-            logging.info(f"Hoàn tất quy trình giảm dung lượng file cho: {os.path.basename(file_path)}")
+
+        # Excel phải đóng file trước khi ghi lại gói zip
+        if repack:
+            logging.info(f"  -> Bước 4/{total_steps}: Đóng gói lại file...")
+            if not offline_repack_ops.repack(file_path, drop_patterns):
+                logging.warning("Không thể đóng gói lại, giữ nguyên file đã lưu từ Excel.")
+        logging.info(f"Hoàn tất quy trình giảm dung lượng file cho: {os.path.basename(file_path)}")
 
     except Exception as e:
         logging.error(f"Lỗi nghiêm trọng trong quy trình giảm dung lượng file '{file_path}': {e}", exc_info=True)
         raise
-
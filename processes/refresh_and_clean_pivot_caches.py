@@ -1,10 +1,10 @@
 # Đường dẫn: excel_toolkit/processes/refresh_and_clean_pivot_caches.py
-# Phiên bản 1.0 - Quy trình dọn dẹp Pivot Table caches
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 2.1 - Tùy chọn use_excel: làm mới pivot từ nguồn qua Excel thay vì dọn trên gói
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
-from excel_controller import ExcelController
+from utils import offline_pivot_ops, task_fusion
 
 def run(controller, file_path):
     """
@@ -17,3 +17,27 @@ def run(controller, file_path):
     except Exception as e:
         logging.error(f"Lỗi khi dọn dẹp Pivot Table caches cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def run_offline(file_path):
+    """
+    Dọn dẹp Pivot Table caches trực tiếp trên file (không cần Excel, không làm mới từ nguồn):
+    bỏ bản ghi cache, bật làm mới khi mở file và gộp các cache có cùng nguồn.
+    """
+    logging.info(f"Bắt đầu dọn dẹp Pivot Table caches (offline) cho file: {os.path.basename(file_path)}")
+    if not offline_pivot_ops.clean_pivot_caches(file_path):
+        raise Exception(f"Không thể dọn dẹp Pivot Table caches (offline) cho file: {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất dọn dẹp Pivot Table caches (offline) cho file: {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    report = offline_pivot_ops.plan_pivot_caches(zf, edits)
+    offline_pivot_ops.log_pivot_report(report)
+    return bool(report)
+
+def fusion_stage(options):
+    """
+    Bước gộp: dọn pivot cache trong cùng lần ghi gói với các tác vụ offline khác.
+    Với options['use_excel'], chạy hàm run qua Excel để làm mới pivot từ dữ liệu nguồn.
+    """
+    if options.get('use_excel'):
+        return task_fusion.TaskStage("refresh_and_clean_pivot_caches", task_fusion.PHASE_WORKBOOK)
+    return task_fusion.TaskStage("refresh_and_clean_pivot_caches", task_fusion.PHASE_PACKAGE, plan_package=_plan_package)
@@ -0,0 +1,44 @@
+# Đường dẫn: excel_toolkit/processes/repack.py
+# Phiên bản 1.0 - Đóng gói lại file (bỏ part tái tạo được, nén lại ở mức cao nhất) như bước cuối của batch
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import os
+from utils import offline_repack_ops, task_fusion
+
+def run(controller, file_path):
+    """
+    Đóng gói lại file: bỏ các part Excel tự tạo lại được và nén lại mọi part ở mức cao nhất.
+    Thao tác sửa trực tiếp gói nên workbook đang mở được lưu, đóng và mở lại quanh thao tác.
+    """
+    logging.info(f"Bắt đầu đóng gói lại file: {os.path.basename(file_path)}")
+    try:
+        if not controller.run_offline(file_path, offline_repack_ops.repack):
+            raise Exception(f"Không thể đóng gói lại file: {os.path.basename(file_path)}")
+        logging.info(f"Hoàn tất đóng gói lại file: {os.path.basename(file_path)}")
+    except Exception as e:
+        logging.error(f"Lỗi khi đóng gói lại file '{file_path}': {e}", exc_info=True)
+        raise
+
+def run_offline(file_path):
+    """Đóng gói lại file trực tiếp trên đĩa (không cần Excel)."""
+    logging.info(f"Bắt đầu đóng gói lại file (offline): {os.path.basename(file_path)}")
+    if not offline_repack_ops.repack(file_path):
+        raise Exception(f"Không thể đóng gói lại file (offline): {os.path.basename(file_path)}")
+    logging.info(f"Hoàn tất đóng gói lại file (offline): {os.path.basename(file_path)}")
+
+def _plan_package(zf, edits, file_path, options):
+    dropped = offline_repack_ops.plan_repack(zf, edits)
+    logging.info(f"Đóng gói lại: bỏ {len(dropped)} part tái tạo được, nén lại ở mức cao nhất.")
+    return True
+
+def _verify(path, original_path):
+    return offline_repack_ops.verify_package(path, original_path=original_path)
+
+def fusion_stage(options):
+    """
+    Bước gộp ở pha cuối: chạy sau mọi bước Excel (Excel lưu lại file sẽ tạo lại calcChain và nén
+    ở mức mặc định), ghi chung lần ghi gói cuối cùng ở mức nén cao nhất và kiểm tra trước khi thay file.
+    """
+    return task_fusion.TaskStage("repack", task_fusion.PHASE_FINAL, plan_package=_plan_package, requires_ooxml=True,
+                                 compresslevel=offline_repack_ops.BEST_COMPRESSLEVEL, verify=_verify)
@@ -1,50 +1,64 @@
 # Đường dẫn: excel_toolkit/processes/set_label.py
-# Phiên bản 4.0 - Nhận nội dung nhãn dán làm tham số
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 4.1 - Chạy theo từng sheet trong kế hoạch gộp tác vụ
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
 from excel_controller import ExcelController
+from utils import task_fusion
+
+SHAPE_NAME = 'Alliance_Labeling'
+
+def _label_sheet(controller, sheet_name, label_text):
+    """
+    Hàm nội bộ: Thêm nhãn vào một sheet nếu nhãn chưa tồn tại.
+    """
+    logging.debug(f"Đang xử lý sheet: '{sheet_name}'")
+
+    # Kiểm tra sự tồn tại của shape trực tiếp từ controller
+    if not controller.is_shape_exist(sheet_name, SHAPE_NAME):
+        logging.info(f"Label '{SHAPE_NAME}' chưa tồn tại, tiến hành tạo mới.")
+        # Gọi đến phương thức add_textbox mạnh mẽ của controller
+        format_props = {
+            'name': SHAPE_NAME,
+            'font_name': "Verdana",
+            'font_size': 10,
+            'auto_size': True,
+            'word_wrap': False,
+            'line_visible': True,
+            'line_weight': 1,
+            'line_color': (0, 0, 0)
+        }
+        controller.add_textbox(
+            sheet_name=sheet_name, text=label_text,
+            top=1, left=1, width=150, height=20,
+            format_properties=format_props
+        )
+    else:
+        logging.info(f"Label '{SHAPE_NAME}' đã tồn tại. Bỏ qua.")
 
 def run(controller, file_path, label_text='Nissan Confidential C'):
     """
     Quy trình chính: Thêm một nhãn tùy chỉnh vào tất cả các sheet đang
     hiển thị nếu nhãn đó chưa tồn tại.
     """
-    shape_name = 'Alliance_Labeling'
-    
     logging.info(f"Bắt đầu quy trình dán nhãn '{label_text}' cho file: {os.path.basename(file_path)}")
     try:
         # Lấy danh sách sheet hiển thị trực tiếp từ controller
         visible_sheets, _ = controller.get_sheets_visibility()
         
         for sheet_name in visible_sheets:
-            logging.debug(f"Đang xử lý sheet: '{sheet_name}'")
-            
-            # Kiểm tra sự tồn tại của shape trực tiếp từ controller
-            if not controller.is_shape_exist(sheet_name, shape_name):
-                logging.info(f"Label '{shape_name}' chưa tồn tại, tiến hành tạo mới.")
-                # Gọi đến phương thức add_textbox mạnh mẽ của controller
-                format_props = {
-                    'name': shape_name,
-                    'font_name': "Verdana",
-                    'font_size': 10,
-                    'auto_size': True,
-                    'word_wrap': False,
-                    'line_visible': True,
-                    'line_weight': 1,
-                    'line_color': (0, 0, 0)
-                }
-                controller.add_textbox(
-                    sheet_name=sheet_name, text=label_text,
-                    top=1, left=1, width=150, height=20,
-                    format_properties=format_props
-                )
-            else:
-                logging.info(f"Label '{shape_name}' đã tồn tại. Bỏ qua.")
+            _label_sheet(controller, sheet_name, label_text)
 
         logging.info(f"Hoàn tất quy trình dán nhãn cho file: {os.path.basename(file_path)}")
 
     except Exception as e:
         logging.error(f"Lỗi nghiêm trọng trong quy trình dán nhãn cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def _run_sheet(controller, sheet_name, options):
+    _label_sheet(controller, sheet_name, options.get('label_text'))
+
+def fusion_stage(options):
+    """Bước gộp: dán nhãn trong cùng một vòng qua các sheet với các tác vụ COM khác."""
+    return task_fusion.TaskStage("add_label", task_fusion.PHASE_SHEETS, run_sheet=_run_sheet)
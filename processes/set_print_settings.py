@@ -1,10 +1,11 @@
 # Đường dẫn: excel_toolkit/processes/set_print_settings.py
-# Phiên bản 3.0 - Cập nhật để hoạt động với ExcelController đã mở sẵn
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 3.1 - Chạy theo từng sheet trong kế hoạch gộp tác vụ
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import os
 from excel_controller import ExcelController
+from utils import task_fusion
 
 def run(controller, file_path):
     """
@@ -18,3 +19,10 @@ def run(controller, file_path):
     except Exception as e:
         logging.error(f"Lỗi khi thiết lập trang in cho file '{file_path}': {e}", exc_info=True)
         raise
+
+def _run_sheet(controller, sheet_name, options):
+    controller.apply_smart_print_settings(sheet_name)
+
+def fusion_stage(options):
+    """Bước gộp: thiết lập trang in trong cùng một vòng qua các sheet với các tác vụ COM khác."""
+    return task_fusion.TaskStage("set_print_settings", task_fusion.PHASE_SHEETS, run_sheet=_run_sheet)
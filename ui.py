@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/ui.py
-# Phiên bản 1.3 - Sửa lỗi khoảng trống layout trong giao diện chính
-# Ngày cập nhật: 2025-09-16
+# Phiên bản 1.7 - Thêm tác vụ đóng gói lại file
+# Ngày cập nhật: 2026-10-17
 
 import customtkinter
 import tkinter as tk
@@ -42,6 +42,7 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
         self.transient(parent); self.grab_set()
         self.tasks_vars, self.result = {}, []
         self.engine_var, self.quality_var, self.label_text_var = None, None, None
+        self.use_excel_var = None
         
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -119,7 +120,7 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
             compress_option_label.pack(side="left", padx=(10, 5))
             
             self.engine_var = customtkinter.StringVar(value=translator.get_text("engine_pil"))
-            self.engine_menu = customtkinter.CTkOptionMenu(compress_frame, values=[translator.get_text("engine_pil"), translator.get_text("engine_spire")], variable=self.engine_var, command=self.update_compression_options)
+            self.engine_menu = customtkinter.CTkOptionMenu(compress_frame, values=[translator.get_text("engine_pil"), translator.get_text("engine_spire"), translator.get_text("engine_ooxml")], variable=self.engine_var, command=self.update_compression_options)
             self.engine_menu.pack(side="left")
 
             self.quality_label = customtkinter.CTkLabel(compress_frame, text="", font=customtkinter.CTkFont(weight="bold"))
@@ -129,9 +130,19 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
             self.quality_entry.pack(side="left")
 
             self.update_compression_options(self.engine_var.get())
-        
+
+        if any(self.tasks_vars.get(task_id, customtkinter.StringVar()).get() == "on"
+               for task_id in ("refresh_and_clean_pivot_caches", "clear_excess_cell_formatting")):
+            # Mặc định sửa trực tiếp gói (không cần Excel); bật để chạy bản COM như trước
+            self.use_excel_var = customtkinter.StringVar(value="off")
+            use_excel_checkbox = customtkinter.CTkCheckBox(self.options_frame, text=translator.get_text("option_use_excel"),
+                                                           variable=self.use_excel_var, onvalue="on", offvalue="off")
+            use_excel_checkbox.pack(anchor="w", padx=10, pady=(5, 0))
+        else:
+            self.use_excel_var = None
+
     def update_compression_options(self, choice):
-        if choice == translator.get_text("engine_pil"):
+        if choice in (translator.get_text("engine_pil"), translator.get_text("engine_ooxml")):
             self.quality_label.configure(text="Chất lượng (1-95):")
             self.quality_entry.configure(placeholder_text="70")
             self.quality_var.set("70")
@@ -155,6 +166,8 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
                 "clear_excess_cell_formatting": translator.get_text("task_clear_excess_cell_formatting"),
                 "compress_all_images": translator.get_text("task_compress_all_images"),
                 "refresh_and_clean_pivot_caches": translator.get_text("task_refresh_and_clean_pivot_caches"),
+                "compact_shared_strings": translator.get_text("task_compact_shared_strings"),
+                "repack": translator.get_text("task_repack"),
             },
             "category_utilities": {
                 "add_label": translator.get_text("task_add_label"),
@@ -202,6 +215,8 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
         else:
             self.label_text_var = None
 
+        self.use_excel_var = self.use_excel_var is not None and self.use_excel_var.get() == "on"
+
         self.destroy()
 
     def on_cancel(self): 
@@ -210,7 +225,7 @@ class TaskSelectionDialog(customtkinter.CTkToplevel):
 
     def get_selected_tasks(self): 
         self.master.wait_window(self)
-        return self.result, self.engine_var, self.quality_var, self.label_text_var
+        return self.result, self.engine_var, self.quality_var, self.label_text_var, self.use_excel_var
 
 class AppUI:
     def __init__(self, root, controller):
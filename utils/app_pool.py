@@ -0,0 +1,259 @@
+# Đường dẫn: excel_toolkit/utils/app_pool.py
+# Phiên bản 1.2 - Đặt lại calculation khi workbook đầu tiên của lượt mượn được mở
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import threading
+from contextlib import contextmanager
+
+# ======================================================================
+# --- Nhóm 1: Backend tạo ứng dụng ---
+# ======================================================================
+
+class XlwingsAppBackend:
+    """
+    Backend mặc định: tạo và điều khiển các instance xw.App thật.
+    """
+    def __init__(self, visible=False):
+        self.visible = visible
+
+    def create(self):
+        import xlwings as xw
+        return xw.App(visible=self.visible, add_book=False)
+
+    def is_healthy(self, app):
+        try:
+            app.books.count
+            return bool(app.api.Ready)
+        except Exception:
+            return False
+
+    def close_books(self, app):
+        for book in list(app.books):
+            book.close()
+
+    def apply_state(self, app, optimize_performance, visible=None):
+        if visible is not None:
+            app.visible = visible
+        app.display_alerts = not optimize_performance
+        app.screen_updating = not optimize_performance
+
+    def reset_calculation(self, app):
+        # Excel báo lỗi COM khi đặt Calculation lúc chưa mở workbook nào (app tạo với add_book=False),
+        # nên pool chỉ gọi hàm này sau khi workbook đã được mở (xem ExcelAppPool.prepare_workbook)
+        app.calculation = 'automatic'
+
+    def quit(self, app):
+        try:
+            app.quit()
+        except Exception:
+            app.kill()
+
+class FakeExcelApp:
+    """Ứng dụng giả lập trong tiến trình, dùng cho kiểm thử không cần Excel."""
+    def __init__(self):
+        self.books = []
+        self.visible = False
+        self.display_alerts = True
+        self.screen_updating = True
+        self.calculation = 'automatic'
+        self.healthy = True
+        self.quit_called = False
+
+class FakeAppBackend:
+    """
+    Backend giả lập có cùng giao diện với XlwingsAppBackend.
+    """
+    def __init__(self):
+        self.created = []
+
+    def create(self):
+        app = FakeExcelApp()
+        self.created.append(app)
+        return app
+
+    def is_healthy(self, app):
+        return app.healthy and not app.quit_called
+
+    def close_books(self, app):
+        app.books.clear()
+
+    def apply_state(self, app, optimize_performance, visible=None):
+        if visible is not None:
+            app.visible = visible
+        app.display_alerts = not optimize_performance
+        app.screen_updating = not optimize_performance
+
+    def reset_calculation(self, app):
+        if not app.books:
+            raise RuntimeError("Không đặt được Calculation khi chưa mở workbook nào.")
+        app.calculation = 'automatic'
+
+    def open_book(self, app, name):
+        """Giả lập việc mở một workbook trên `app`."""
+        app.books.append(name)
+        return name
+
+    def quit(self, app):
+        app.quit_called = True
+
+# ======================================================================
+# --- Nhóm 2: Pool ---
+# ======================================================================
+
+class ExcelAppPool:
+    """
+    Giữ tối đa `size` instance Excel "nóng", cho mượn từng instance theo workbook.
+
+    - Trạng thái (visible, alerts, screen updating) được đặt lại mỗi lần cho mượn; nếu đặt trạng
+      thái thất bại, instance bị thoát và trả chỗ lại cho pool.
+    - Calculation chỉ đặt được khi đã có workbook mở, nên được đặt lại về 'automatic' ở lần
+      `prepare_workbook` đầu tiên của mỗi lượt mượn (ExcelController gọi sau khi mở workbook).
+    - Instance được thay mới sau `max_uses` workbook hoặc khi kiểm tra sức khỏe thất bại.
+    """
+    def __init__(self, size=1, max_uses=50, backend=None, optimize_performance=True, prewarm=False):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.backend = backend or XlwingsAppBackend()
+        self.optimize_performance = optimize_performance
+        self._idle = []       # [(app, số lần đã dùng)]
+        self._uses = {}       # id(app) -> số lần đã dùng, cho các app đang được mượn
+        self._pending_calc = set()  # id(app) đang được mượn nhưng chưa đặt lại calculation
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        if prewarm:
+            for _ in range(self.size):
+                self._idle.append((self._create_app(), 0))
+                self._created += 1
+
+    def _create_app(self):
+        app = self.backend.create()
+        logging.info("Đã khởi tạo ứng dụng Excel mới cho pool.")
+        return app
+
+    def _discard(self, app, reason):
+        logging.info(f"Thay mới ứng dụng Excel trong pool: {reason}.")
+        try:
+            self.backend.quit(app)
+        except Exception as e:
+            logging.warning(f"Lỗi khi thoát ứng dụng Excel của pool: {e}")
+        with self._lock:
+            self._created -= 1
+            self._lock.notify()
+
+    def lease(self, visible=None):
+        """
+        Mượn một ứng dụng Excel đã sẵn sàng, chờ nếu pool đã hết chỗ.
+        `visible` (nếu khác None) được áp dụng cho instance trước khi cho mượn.
+        """
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Pool ứng dụng Excel đã đóng.")
+                while not self._idle and self._created >= self.size:
+                    self._lock.wait()
+                if self._idle:
+                    app, uses = self._idle.pop()
+                else:
+                    app, uses = None, 0
+                    self._created += 1
+            if app is None:
+                try:
+                    app = self._create_app()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                        self._lock.notify()
+                    raise
+            elif not self.backend.is_healthy(app):
+                self._discard(app, "kiểm tra sức khỏe thất bại")
+                continue
+
+            try:
+                self.backend.apply_state(app, self.optimize_performance, visible)
+            except Exception as e:
+                self._discard(app, f"không đặt được trạng thái ({e})")
+                raise
+            with self._lock:
+                self._uses[id(app)] = uses
+                self._pending_calc.add(id(app))
+            return app
+
+    def prepare_workbook(self, app):
+        """
+        Gọi sau khi mở workbook trên app đang mượn: lần đầu trong lượt mượn, đặt lại calculation
+        về 'automatic' (lượt mượn trước có thể đã để 'manual'). Các lần mở lại sau đó (vd. quanh
+        thao tác offline) giữ nguyên chế độ mà tác vụ đang dùng.
+        """
+        with self._lock:
+            if id(app) not in self._pending_calc:
+                return
+            self._pending_calc.discard(id(app))
+        try:
+            self.backend.reset_calculation(app)
+        except Exception as e:
+            logging.warning(f"Không đặt lại được chế độ tính toán của ứng dụng Excel: {e}")
+
+    def release(self, app):
+        """Trả ứng dụng về pool: đóng workbook còn sót và quyết định có tái sử dụng không."""
+        with self._lock:
+            uses = self._uses.pop(id(app), 0) + 1
+            self._pending_calc.discard(id(app))
+        try:
+            self.backend.close_books(app)
+        except Exception as e:
+            logging.warning(f"Lỗi khi đóng workbook còn sót trong pool: {e}")
+
+        if self._closed:
+            self._discard(app, "pool đã đóng")
+        elif self.max_uses and uses >= self.max_uses:
+            self._discard(app, f"đã xử lý {uses} workbook")
+        elif not self.backend.is_healthy(app):
+            self._discard(app, "kiểm tra sức khỏe thất bại")
+        else:
+            with self._lock:
+                self._idle.append((app, uses))
+                self._lock.notify()
+
+    @contextmanager
+    def leased(self):
+        app = self.lease()
+        try:
+            yield app
+        finally:
+            self.release(app)
+
+    def close(self):
+        """Thoát toàn bộ ứng dụng đang nhàn rỗi; app đang mượn sẽ thoát khi được trả."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for app, _ in idle:
+            self._discard(app, "pool đã đóng")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("--- Kiểm tra pool với FakeAppBackend ---")
+    backend = FakeAppBackend()
+    with ExcelAppPool(size=1, backend=backend) as pool:
+        app = pool.lease()
+        backend.open_book(app, "a.xlsx")
+        pool.prepare_workbook(app)
+        app.calculation = 'manual'      # tác vụ để lại chế độ thủ công
+        pool.release(app)
+
+        app = pool.lease()
+        print(f"Tái sử dụng cùng instance: {app is backend.created[0]}")
+        backend.open_book(app, "b.xlsx")
+        pool.prepare_workbook(app)
+        print(f"Calculation sau khi mở workbook: {app.calculation}")
+        pool.release(app)
@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/utils/cleanup_ops.py
-# Phiên bản 2.2 - Khắc phục lỗi `xlwings.utils.col_str`
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 2.4 - Tách clear_sheet_excess_formatting để chạy theo từng sheet
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import xlwings as xw
@@ -41,9 +41,13 @@ def delete_external_links(wb):
         logging.error(f"Lỗi khi xóa liên kết ngoài: {e}")
         return False
 
-def delete_defined_names(wb):
+def delete_defined_names(wb, keep=None):
     """
-    Xóa tất cả các 'Defined Names' trong workbook, bỏ qua thiết lập in.
+    Xóa các 'Defined Names' trong workbook, bỏ qua thiết lập in.
+
+    Tham số:
+        keep (set, tùy chọn): Tên name (casefold, không kèm tiền tố sheet) cần giữ lại,
+            ví dụ các name còn được công thức/chart/validation dùng (reference_graph.used_names()).
     """
     logging.debug(f"Bắt đầu xóa 'Defined Names' cho workbook '{wb.name}'.")
     deleted_count, skipped_count = 0, 0
@@ -55,6 +59,10 @@ def delete_defined_names(wb):
                 logging.debug(f"  -> Bỏ qua name thiết lập in: '{name_text}'")
                 skipped_count += 1
                 continue
+            if keep and name_text.rpartition('!')[2].casefold() in keep:
+                logging.debug(f"  -> Giữ lại name đang được dùng: '{name_text}'")
+                skipped_count += 1
+                continue
             try:
                 name.Delete()
                 logging.debug(f"  -> Đã xóa name: '{name_text}'")
@@ -84,6 +92,30 @@ def remove_personal_info(wb):
         logging.error(f"Lỗi khi xóa thông tin cá nhân: {e}")
         return False
 
+def clear_sheet_excess_formatting(wb, sheet_name):
+    """
+    Xóa định dạng ô nằm ngoài vùng dữ liệu đã sử dụng (used_range) của một sheet.
+    """
+    try:
+        sheet = wb.sheets[sheet_name]
+        logging.debug(f"  -> Đang xử lý sheet: '{sheet.name}'")
+        used_range = sheet.used_range
+        last_row, last_col = used_range.last_cell.row, used_range.last_cell.column
+        if last_row < sheet.api.Rows.Count:
+            range_to_clear_rows = sheet.range((last_row + 1, 1), (sheet.api.Rows.Count, last_col))
+            range_to_clear_rows.clear_formats()
+            logging.debug(f"    -> Đã xóa định dạng từ hàng {last_row + 1} trở xuống.")
+        if last_col < sheet.api.Columns.Count:
+            range_to_clear_cols = sheet.range((1, last_col + 1), (sheet.api.Rows.Count, sheet.api.Columns.Count))
+            range_to_clear_cols.clear_formats()
+            # Sử dụng hàm trợ giúp mới
+            col_letter = _col_to_str(last_col + 1)
+            logging.debug(f"    -> Đã xóa định dạng từ cột {col_letter} trở đi.")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi xóa định dạng ô thừa trên sheet '{sheet_name}': {e}")
+        return False
+
 def clear_excess_cell_formatting(wb):
     """
     Xóa các định dạng ô không cần thiết nằm ngoài vùng dữ liệu đã sử dụng (used_range).
@@ -91,20 +123,8 @@ def clear_excess_cell_formatting(wb):
     logging.debug(f"Bắt đầu xóa định dạng ô thừa cho workbook '{wb.name}'.")
     try:
         for sheet in wb.sheets:
-            if sheet.api.Visible == -1:
-                logging.debug(f"  -> Đang xử lý sheet: '{sheet.name}'")
-                used_range = sheet.used_range
-                last_row, last_col = used_range.last_cell.row, used_range.last_cell.column
-                if last_row < sheet.api.Rows.Count:
-                    range_to_clear_rows = sheet.range((last_row + 1, 1), (sheet.api.Rows.Count, last_col))
-                    range_to_clear_rows.clear_formats()
-                    logging.debug(f"    -> Đã xóa định dạng từ hàng {last_row + 1} trở xuống.")
-                if last_col < sheet.api.Columns.Count:
-                    range_to_clear_cols = sheet.range((1, last_col + 1), (sheet.api.Rows.Count, sheet.api.Columns.Count))
-                    range_to_clear_cols.clear_formats()
-                    # Sử dụng hàm trợ giúp mới
-                    col_letter = _col_to_str(last_col + 1)
-                    logging.debug(f"    -> Đã xóa định dạng từ cột {col_letter} trở đi.")
+            if sheet.api.Visible == -1 and not clear_sheet_excess_formatting(wb, sheet.name):
+                return False
         logging.info("Hoàn tất việc xóa định dạng ô thừa.")
         return True
     except Exception as e:
@@ -0,0 +1,273 @@
+# Đường dẫn: excel_toolkit/utils/compressor_engine_ooxml.py
+# Phiên bản 1.4 - Tách plan_compress_images để gộp chung một lần ghi gói với các tác vụ khác
+# Ngày cập nhật: 2026-10-17
+
+import io
+import logging
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from utils import ooxml_package, image_encoder
+from utils.disk_cache import content_hash
+
+MEDIA_PREFIX = "xl/media/"
+# Chỉ nén lại các định dạng raster; EMF/WMF/SVG giữ nguyên.
+_COMPRESSIBLE_EXTENSIONS = {'png', 'jpeg', 'jpg', 'bmp', 'tif', 'tiff'}
+
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+REL_TYPE_IMAGE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+_ANCHOR_TAGS = {f"{{{NS_XDR}}}twoCellAnchor", f"{{{NS_XDR}}}oneCellAnchor", f"{{{NS_XDR}}}absoluteAnchor"}
+_UNKNOWN_SIZE = "unknown"
+
+def _picture_extent(pic, anchor):
+    """
+    Lấy kích thước hiển thị (EMU) của một <xdr:pic>, đã bù phần ảnh bị crop (a:srcRect).
+    Trả về (cx, cy) hoặc None nếu không xác định được.
+    """
+    ext = pic.find(f"{{{NS_XDR}}}spPr/{{{NS_A}}}xfrm/{{{NS_A}}}ext")
+    if ext is None:
+        ext = anchor.find(f"{{{NS_XDR}}}ext")
+    if ext is None:
+        return None
+    cx, cy = int(ext.get('cx', 0)), int(ext.get('cy', 0))
+    if not cx or not cy:
+        return None
+
+    src_rect = pic.find(f"{{{NS_XDR}}}blipFill/{{{NS_A}}}srcRect")
+    if src_rect is not None:
+        # Đơn vị 1/1000 phần trăm; phần hiển thị chỉ là một phần của ảnh gốc.
+        visible_x = 1 - (int(src_rect.get('l', 0)) + int(src_rect.get('r', 0))) / 100000
+        visible_y = 1 - (int(src_rect.get('t', 0)) + int(src_rect.get('b', 0))) / 100000
+        if visible_x <= 0 or visible_y <= 0:
+            return None
+        cx, cy = int(cx / visible_x), int(cy / visible_y)
+    return cx, cy
+
+def _collect_rendered_sizes(zf, names):
+    """
+    Duyệt mọi quan hệ kiểu ảnh trong gói và tính kích thước hiển thị lớn nhất (EMU)
+    của từng part ảnh. Ảnh được tham chiếu ở nơi không xác định được kích thước
+    (nền sheet, VML header/footer, ảnh trong group, biểu đồ...) được đánh dấu "unknown"
+    để không bị thu nhỏ.
+    """
+    sizes = {}
+    for rels_name in (n for n in names if n.endswith('.rels')):
+        source = ooxml_package.source_part_name(rels_name)
+        image_rels = {rel['id']: ooxml_package.resolve_target(source, rel['target'])
+                      for rel in ooxml_package.parse_relationships(zf.read(rels_name))
+                      if rel['type'] == REL_TYPE_IMAGE and not rel['external']}
+        if not image_rels:
+            continue
+
+        extents = {}
+        if source.startswith("xl/drawings/") and source.endswith(".xml") and source in zf.NameToInfo:
+            root = ET.fromstring(zf.read(source))
+            for anchor in root:
+                if anchor.tag not in _ANCHOR_TAGS:
+                    continue
+                pic = anchor.find(f"{{{NS_XDR}}}pic")
+                if pic is None:
+                    continue
+                blip = pic.find(f"{{{NS_XDR}}}blipFill/{{{NS_A}}}blip")
+                rid = blip.get(f"{{{ooxml_package.NS_REL}}}embed") if blip is not None else None
+                if not rid:
+                    continue
+                extent = _picture_extent(pic, anchor)
+                if extent is None:
+                    extents[rid] = _UNKNOWN_SIZE
+                elif extents.get(rid) != _UNKNOWN_SIZE:
+                    extents[rid] = image_encoder.merge_target_sizes(extents.get(rid), extent)
+
+        for rid, media_name in image_rels.items():
+            extent = extents.get(rid, _UNKNOWN_SIZE)
+            if extent == _UNKNOWN_SIZE or sizes.get(media_name) == _UNKNOWN_SIZE:
+                sizes[media_name] = _UNKNOWN_SIZE
+            else:
+                sizes[media_name] = image_encoder.merge_target_sizes(sizes.get(media_name), extent)
+    return sizes
+
+def _encode_image(data, quality=70, mode='auto', target_size=None):
+    """
+    Nén lại một ảnh bằng Pillow, thu nhỏ trước về `target_size` (pixel) nếu có.
+    Trả về (bytes mới, phần mở rộng mới) hoặc (None, None) nếu không đọc được.
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return image_encoder.encode_image(img, quality=quality, mode=mode, keep_dpi=None, target_size=target_size)
+
+def _find_duplicate_media(zf, media_names):
+    """
+    Băm nội dung các part ảnh; trả về dict part trùng -> part gốc (part xuất hiện đầu tiên).
+    """
+    first_by_hash, duplicates = {}, {}
+    for name in media_names:
+        digest = content_hash(zf.read(name))
+        if digest in first_by_hash:
+            duplicates[name] = first_by_hash[digest]
+        else:
+            first_by_hash[digest] = name
+    return duplicates
+
+def _merge_rendered_size(sizes, target, source):
+    """Gộp kích thước hiển thị của part `source` vào part `target` (unknown luôn thắng)."""
+    current, extra = sizes.get(target), sizes.get(source)
+    if current == _UNKNOWN_SIZE or extra == _UNKNOWN_SIZE:
+        sizes[target] = _UNKNOWN_SIZE
+    elif extra:
+        sizes[target] = image_encoder.merge_target_sizes(current, extra)
+
+def _unique_part_name(stem, extension, taken):
+    candidate = f"{stem}.{extension}"
+    counter = 1
+    while candidate in taken:
+        candidate = f"{stem}_{counter}.{extension}"
+        counter += 1
+    return candidate
+
+def plan_compress_images(zf, edits, quality=70, mode='auto', target_dpi=image_encoder.DEFAULT_TARGET_DPI):
+    """
+    Thêm vào `edits` (định dạng của ooxml_package.rewrite_package) các thao tác nén ảnh
+    trong xl/media/ của gói đang mở `zf`, để có thể ghi chung một lần với các tác vụ khác.
+
+    - Ảnh được thu nhỏ về kích thước hiển thị lớn nhất trong các drawing x `target_dpi`
+      (đặt target_dpi=None để tắt), sau đó nén lại bằng Pillow.
+    - Các part ảnh trùng nội dung được gộp về một part dùng chung; mỗi ảnh khác
+      nhau chỉ được nén một lần và kết quả nén được lưu trong cache ảnh trên đĩa
+      để các file sau trong batch dùng lại.
+    - Chỉ thay thế khi bản nén nhỏ hơn bản gốc.
+    - Khi định dạng ảnh thay đổi (ví dụ PNG -> JPEG), part được đổi tên và các
+      file .rels cùng [Content_Types].xml được cập nhật tương ứng.
+
+    Trả về dict thống kê {'total', 'compressed', 'duplicates', 'bytes_before', 'bytes_after'}.
+    """
+    names = zf.namelist()
+    media_names = [n for n in names if n.startswith(MEDIA_PREFIX)]
+    stats = {'total': 0, 'compressed': 0, 'duplicates': 0, 'bytes_before': 0, 'bytes_after': 0}
+    if not media_names:
+        return stats
+
+    rendered_sizes = _collect_rendered_sizes(zf, names) if target_dpi else {}
+    renamed = {}
+    taken = set(names)
+
+    # Gộp ảnh trùng: part trùng bị xóa, quan hệ trỏ về part gốc
+    duplicates = _find_duplicate_media(zf, media_names)
+    for duplicate, original in duplicates.items():
+        _merge_rendered_size(rendered_sizes, original, duplicate)
+        edits[duplicate] = None
+        stats['bytes_before'] += zf.getinfo(duplicate).file_size
+    stats['duplicates'] = len(duplicates)
+
+    for name in (n for n in media_names if n not in duplicates):
+        stem, ext = posixpath.splitext(name)
+        ext = ext.lstrip('.').lower()
+        if ext not in _COMPRESSIBLE_EXTENSIONS:
+            logging.debug(f"  -> Bỏ qua '{name}' (định dạng không hỗ trợ nén lại).")
+            continue
+        stats['total'] += 1
+        data = zf.read(name)
+        extent = rendered_sizes.get(name)
+        target_size = None
+        if extent and extent != _UNKNOWN_SIZE:
+            target_size = image_encoder.target_size_from_emu(extent[0], extent[1], target_dpi)
+        settings = {'quality': quality, 'mode': mode, 'target_size': target_size}
+        try:
+            new_data, new_ext = image_encoder.cached_encode(
+                data, settings, lambda: _encode_image(data, quality=quality, mode=mode, target_size=target_size))
+        except Exception as e:
+            logging.warning(f"Không thể nén ảnh '{name}': {e}")
+            continue
+
+        if new_data is None or len(new_data) >= len(data):
+            logging.debug(f"  -> Giữ nguyên '{name}' vì bản nén không nhỏ hơn.")
+            continue
+
+        stats['compressed'] += 1
+        stats['bytes_before'] += len(data)
+        stats['bytes_after'] += len(new_data)
+        same_format = new_ext == ext or (new_ext == 'jpeg' and ext == 'jpg')
+        if same_format:
+            edits[name] = new_data
+        else:
+            new_name = _unique_part_name(stem, new_ext, taken)
+            taken.add(new_name)
+            renamed[name] = new_name
+            edits[name] = None
+            edits[new_name] = new_data
+        logging.debug(f"  -> '{name}': {len(data) / 1024:.1f}KB -> {len(new_data) / 1024:.1f}KB")
+
+    # Part cũ -> part mới: ảnh đổi định dạng và ảnh trùng trỏ về ảnh gốc (đã đổi tên nếu có)
+    mapping = dict(renamed)
+    for duplicate, original in duplicates.items():
+        mapping[duplicate] = renamed.get(original, original)
+    if not mapping:
+        return stats
+
+    for rels_name in (n for n in names if n.endswith('.rels')):
+        ooxml_package.chain_edit(edits, rels_name, lambda data, rels_name=rels_name:
+                                 ooxml_package.rewrite_relationship_targets(data, rels_name, mapping))
+
+    def update_content_types(ct_data):
+        for duplicate in duplicates:
+            ct_data = ooxml_package.remove_override(ct_data, duplicate)
+        for old_name, new_name in renamed.items():
+            ct_data = ooxml_package.remove_override(ct_data, old_name)
+            new_ext = posixpath.splitext(new_name)[1].lstrip('.')
+            ct_data = ooxml_package.ensure_default_content_type(ct_data, new_ext, ooxml_package.IMAGE_CONTENT_TYPES[new_ext])
+        return ct_data
+    ooxml_package.chain_edit(edits, ooxml_package.CONTENT_TYPES_PART, update_content_types)
+    return stats
+
+def compress_images(file_path, quality=70, mode='auto', output_path=None, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
+    """
+    Nén tất cả ảnh trong xl/media/ của gói .xlsx/.xlsm mà không cần Excel
+    (xem plan_compress_images). Các part khác được chép nguyên vẹn sang gói mới.
+    """
+    file_name = os.path.basename(file_path)
+    logging.info(f"Bắt đầu nén ảnh bằng engine OOXML cho file: {file_name}")
+    try:
+        edits = {}
+        with zipfile.ZipFile(file_path, 'r') as zf:
+            stats = plan_compress_images(zf, edits, quality=quality, mode=mode, target_dpi=target_dpi)
+        if not stats['total'] and not stats['duplicates']:
+            logging.info("Không tìm thấy ảnh nào trong gói.")
+            return True
+        if not edits:
+            logging.info(f"Không có ảnh nào nhỏ hơn sau khi nén ({stats['total']} ảnh).")
+            return True
+
+        ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        log_compress_stats(stats)
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi nén ảnh bằng engine OOXML cho file '{file_path}': {e}")
+        return False
+
+def log_compress_stats(stats):
+    """Ghi log tổng kết của plan_compress_images."""
+    cache_stats = image_encoder.image_cache_stats()
+    logging.info(f"Hoàn tất nén ảnh bằng engine OOXML. Đã nén {stats['compressed']}/{stats['total']} ảnh, "
+                 f"gộp {stats['duplicates']} ảnh trùng: "
+                 f"{stats['bytes_before'] / 1024:.1f}KB -> {stats['bytes_after'] / 1024:.1f}KB "
+                 f"(cache: {cache_stats['hits']} trúng / {cache_stats['misses']} trượt).")
+
+def compress_files(file_paths, quality=70, mode='auto', max_workers=None, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
+    """
+    Nén ảnh song song cho nhiều file (mỗi file một tiến trình).
+    Trả về dict đường dẫn -> True/False.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(compress_images, path, quality, mode, None, target_dpi): path for path in file_paths}
+        for future, path in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                logging.error(f"Lỗi khi nén ảnh cho file '{path}': {e}")
+                results[path] = False
+    return results
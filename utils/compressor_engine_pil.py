@@ -1,13 +1,13 @@
 # Đường dẫn: excel_toolkit/utils/compressor_engine_pil.py
-# Phiên bản 1.8 - Vô hiệu hóa kiểm tra xoay/khóa tỉ lệ theo yêu cầu
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 2.5 - Số tiến trình nén theo image_encoder.encode_worker_count(), nén tuần tự khi chạy trong worker của batch
+# Ngày cập nhật: 2026-10-17
 
-import os
 import time
-import uuid
 import logging
 import pythoncom
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageGrab
+from utils import image_encoder, scratch_space
 
 # --- Hằng số Office/Excel ---
 xlScreen = 1
@@ -162,61 +162,110 @@ def _apply_props_to_picture(pic, props):
     except Exception as e:
         logging.warning(f"    -> Lỗi khi áp dụng hyperlink: {e}")
 
-def _export_and_replace(shape, sheet, quality=70, mode='auto', keep_dpi=96):
+# ======================================================================
+# --- Pipeline: trích xuất -> nén -> thay thế ---
+# ======================================================================
+
+def _extract_pictures(sheet):
     """
-    Trích xuất shape -> nén -> xoá shape cũ -> chèn lại ảnh -> khôi phục props.
+    Giai đoạn 1 (luồng COM): chụp thuộc tính và bitmap của mọi ảnh trên sheet.
+    Trả về (số ảnh tìm thấy, danh sách job {'name', 'props', 'raw': (mode, size, bytes)}).
     """
-    logging.debug("    -> Lấy thuộc tính của shape để khôi phục...")
-    props = _snapshot_shape_props(shape)
-
-    img = _copy_shape_to_image(shape)
-    if img is None:
-        logging.warning(f"Clipboard không trả ảnh cho '{props['name']}'. Bỏ qua.")
-        return None
+    found, jobs = 0, []
+    for nm in [s.name for s in sheet.shapes]:
+        try:
+            shp = sheet.shapes[nm]
+            t = getattr(shp.api, 'Type', None)
+        except Exception:
+            continue
 
-    logging.debug("    -> Bắt đầu xử lý và lưu ảnh tạm thời...")
+        if t not in (msoPicture, msoLinkedPicture):
+            logging.debug(f"Bỏ qua shape '{nm}' (loại: {t}) vì không phải ảnh.")
+            continue
 
-    # Quyết định định dạng nén
-    fmt = 'JPEG'
-    if mode == 'png' or (mode == 'auto' and (img.mode in ('RGBA', 'LA'))):
-        fmt = 'PNG'
-    elif mode == 'jpeg' or mode == 'auto':
-        if img.mode in ('RGBA', 'LA'):
-            img = img.convert('RGB')
+        found += 1
+        logging.info(f"Đang trích xuất ảnh '{nm}' trên sheet '{sheet.name}'...")
+        try:
+            props = _snapshot_shape_props(shp)
+            img = _copy_shape_to_image(shp)
+        except Exception as e:
+            logging.warning(f"Lỗi khi trích xuất ảnh '{nm}' ở sheet '{sheet.name}': {e}")
+            continue
+        if img is None:
+            logging.warning(f"Clipboard không trả ảnh cho '{nm}'. Bỏ qua.")
+            continue
 
-    tmp_dir = os.path.join(os.getcwd(), "_tmp_excel_img")
-    os.makedirs(tmp_dir, exist_ok=True)
-    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.{fmt.lower()}")
+        # Chuyển về pixel thô để truyền sang tiến trình nén (ảnh palette được mở rộng trước)
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA' if 'transparency' in img.info or img.mode == 'PA' else 'RGB')
+        jobs.append({'name': nm, 'props': props, 'raw': (img.mode, img.size, img.tobytes())})
+        _doevents_pulse()
+    return found, jobs
 
-    try:
-        if fmt == 'JPEG':
-            logging.debug(f"    -> Lưu ảnh tạm thời ở định dạng JPEG tại '{tmp_path}'...")
-            img.save(tmp_path, format='JPEG', quality=quality, optimize=True, dpi=(keep_dpi, keep_dpi))
-        else:
-            logging.debug(f"    -> Lưu ảnh tạm thời ở định dạng PNG tại '{tmp_path}'...")
+def _encode_pictures(jobs, get_executor, quality=70, mode='auto', keep_dpi=96, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
+    """
+    Giai đoạn 2: nén các bitmap đã trích xuất. Ảnh đã có trong cache được lấy ra ngay,
+    phần còn lại được nén song song trong ProcessPoolExecutor (hoặc tại chỗ nếu ít ảnh hoặc
+    get_executor trả về None).
+    Gán job['encoded'] = (bytes, ext) hoặc None nếu lỗi.
+    """
+    pending = []
+    for job in jobs:
+        img_mode, size, raw = job['raw']
+        target_size = image_encoder.target_size_from_points(job['props']['width'], job['props']['height'], target_dpi)
+        job['encode_args'] = (img_mode, size, raw, quality, mode, keep_dpi, target_size)
+        settings = {'quality': quality, 'mode': mode, 'keep_dpi': keep_dpi, 'size': size,
+                    'img_mode': img_mode, 'target_size': target_size}
+        # Logo/banner dán trên nhiều sheet cho cùng pixel -> chỉ nén một lần
+        job['cache_key'] = image_encoder.image_cache_key(raw, settings)
+        job['encoded'] = image_encoder.cache_get(job['cache_key'])
+        if job['encoded'] is None:
+            pending.append(job)
+
+    executor = get_executor() if len(pending) >= image_encoder.MIN_PARALLEL_ENCODES else None
+    if executor is not None:
+        futures = [(job, executor.submit(image_encoder.encode_raw_image, *job['encode_args'])) for job in pending]
+        for job, future in futures:
             try:
-                img_q = img.convert('P', palette=Image.ADAPTIVE, colors=256)
-                img_q.save(tmp_path, format='PNG', optimize=True, dpi=(keep_dpi, keep_dpi))
-            except Exception:
-                img.save(tmp_path, format='PNG', optimize=True, dpi=(keep_dpi, keep_dpi))
-        logging.debug("    -> Đã lưu ảnh tạm thời thành công.")
-    except Exception as e:
-        logging.error(f"    -> Lỗi khi lưu ảnh tạm thời: {e}")
-        return None
-    
-    logging.debug("    -> Bắt đầu xóa shape cũ...")
-    # Xoá shape cũ
-    try:
-        shape.delete()
-        logging.debug("    -> Đã xóa shape cũ thành công.")
-    except Exception as e:
-        logging.warning(f"Không xoá được shape cũ '{props['name']}': {e}")
-        return None
+                job['encoded'] = future.result()
+            except Exception as e:
+                logging.warning(f"Lỗi khi nén ảnh '{job['name']}': {e}")
+    else:
+        for job in pending:
+            try:
+                job['encoded'] = image_encoder.encode_raw_image(*job['encode_args'])
+            except Exception as e:
+                logging.warning(f"Lỗi khi nén ảnh '{job['name']}': {e}")
+
+    for job in pending:
+        if job['encoded'] is not None:
+            image_encoder.cache_put(job['cache_key'], *job['encoded'])
+        # Giải phóng pixel thô ngay khi không còn cần
+        job.pop('raw', None)
+        job.pop('encode_args', None)
+
+def _replace_picture(sheet, job):
+    """
+    Giai đoạn 3 (luồng COM): xoá shape cũ -> chèn ảnh đã nén -> khôi phục props.
+    Trả về tên shape mới hoặc None nếu không thay được.
+    """
+    props = job['props']
+    data, ext = job['encoded']
 
-    logging.debug("    -> Bắt đầu chèn ảnh mới...")
-    # Chèn ảnh mới
-    pic = sheet.pictures.add(tmp_path, left=props['left'], top=props['top'])
-    logging.debug(f"    -> Đã chèn ảnh mới thành công với tên '{pic.name}'.")
+    # pictures.add chỉ nhận đường dẫn: ghi tạm vào thư mục tạm của worker (trước khi xoá shape cũ,
+    # nên lỗi ghi file không làm mất ảnh gốc), xóa ngay sau khi chèn
+    with scratch_space.spill(data, ext) as tmp_path:
+        logging.debug("    -> Bắt đầu xóa shape cũ...")
+        try:
+            sheet.shapes[job['name']].delete()
+            logging.debug("    -> Đã xóa shape cũ thành công.")
+        except Exception as e:
+            logging.warning(f"Không xoá được shape cũ '{props['name']}': {e}")
+            return None
+
+        logging.debug("    -> Bắt đầu chèn ảnh mới...")
+        pic = sheet.pictures.add(tmp_path, left=props['left'], top=props['top'])
+        logging.debug(f"    -> Đã chèn ảnh mới thành công với tên '{pic.name}'.")
 
     # Cố gắng giữ nguyên kích thước (tránh scale theo DPI)
     try:
@@ -225,38 +274,63 @@ def _export_and_replace(shape, sheet, quality=70, mode='auto', keep_dpi=96):
     except Exception:
         pass
 
-    logging.debug("    -> Bắt đầu áp dụng lại thuộc tính...")
-    # Áp thuộc tính lại
     _apply_props_to_picture(pic, props)
     logging.debug("    -> Đã áp dụng lại thuộc tính thành công.")
 
-    # Xóa file tạm
-    try:
-        os.remove(tmp_path)
-        logging.debug("    -> Đã xóa file ảnh tạm thời.")
-    except Exception as e:
-        logging.warning(f"Không thể xóa file ảnh tạm thời '{tmp_path}': {e}")
-
     # Trả về tên shape mới (tên có thể đổi nếu trùng)
     return pic.name
-    
-def _reorder_zorder_exact(sheet, saved_order_back_to_front):
+
+def _plan_zorder_moves(current_order, target_order):
+    """
+    Tính các lệnh ZOrder tối thiểu để đưa current_order về target_order (cả hai xếp từ sau ra trước).
+
+    COM chỉ có lệnh tương đối (BringToFront/SendToBack, hoặc lên/xuống một bậc), không đặt được
+    vị trí tuyệt đối. Shape không bị di chuyển giữ nguyên thứ tự tương đối, nên chúng phải tạo thành
+    một đoạn liên tiếp của target_order. Chọn đoạn liên tiếp dài nhất đang đúng thứ tự trong
+    current_order; phần phía sau đoạn đó được SendToBack (duyệt ngược), phần phía trước được BringToFront.
+    Với một ảnh thay ở vị trí p trong n shape: min(p + 1, n - p - 1) lệnh thay vì n.
+    Trả về danh sách (tên shape, lệnh ZOrder).
+    """
+    position = {nm: i for i, nm in enumerate(current_order)}
+    target = [nm for nm in target_order if nm in position]
+    if not target:
+        return []
+
+    best_start, best_len, run_start = 0, 1, 0
+    for i in range(1, len(target)):
+        if position[target[i]] < position[target[i - 1]]:
+            run_start = i
+        if i - run_start + 1 > best_len:
+            best_start, best_len = run_start, i - run_start + 1
+
+    moves = [(nm, msoSendToBack) for nm in reversed(target[:best_start])]
+    moves += [(nm, msoBringToFront) for nm in target[best_start + best_len:]]
+    return moves
+
+def _reorder_zorder_exact(sheet, current_order, saved_order_back_to_front):
     """
-    Khôi phục thứ tự chồng lớp chính xác.
-    Cách làm: duyệt theo thứ tự từ “phía sau” -> “phía trước”, mỗi shape gọi BringToFront.
-    Kết quả: các shape sẽ xếp đúng như saved_order_back_to_front.
+    Khôi phục thứ tự chồng lớp chính xác bằng các lệnh từ _plan_zorder_moves.
+    Trả về số lệnh ZOrder đã gọi.
     """
-    for nm in saved_order_back_to_front:
+    moves = _plan_zorder_moves(current_order, saved_order_back_to_front)
+    for nm, command in moves:
         try:
-            shp = sheet.shapes[nm]
-            shp.api.ZOrder(msoBringToFront)
+            sheet.shapes[nm].api.ZOrder(command)
         except Exception:
             # Có thể tên bị đổi sau khi chèn lại; bỏ qua nếu không còn tồn tại.
             pass
+    return len(moves)
 
-def compress_images(wb, quality=70, mode='auto', keep_dpi=96):
+def compress_images(wb, quality=70, mode='auto', keep_dpi=96, target_dpi=image_encoder.DEFAULT_TARGET_DPI, encode_workers=None):
     """
-    Nén tất cả ảnh (msoPicture/msoLinkedPicture) trong workbook:
+    Nén tất cả ảnh (msoPicture/msoLinkedPicture) trong workbook theo pipeline 3 giai đoạn cho mỗi sheet:
+    1. Trích xuất bitmap + thuộc tính của mọi ảnh (luồng COM).
+    2. Nén đồng thời trong ProcessPoolExecutor (`encode_workers` tiến trình, mặc định theo
+       image_encoder.encode_worker_count(); 1 tiến trình thì nén tuần tự tại chỗ).
+    3. Xoá/chèn/khôi phục thuộc tính trong một lượt (luồng COM).
+    - Thu nhỏ mỗi ảnh về kích thước hiển thị x `target_dpi` (None để tắt).
+    - `quality` là mức trần: mỗi ảnh được hạ quality tới mức thấp nhất còn đạt ngưỡng SSIM,
+      định dạng JPEG/PNG được chọn riêng cho từng ảnh (xem image_encoder.encode_adaptive).
     - Bảo toàn vị trí, kích thước, xoay, tỉ lệ, placement, tên, visible, alt text, hyperlink.
     - Khôi phục z-order để textbox/shape khác vẫn đè đúng.
     - Bỏ qua nhóm (msoGroup) để tránh phá vỡ group.
@@ -274,70 +348,77 @@ def compress_images(wb, quality=70, mode='auto', keep_dpi=96):
 
     total = 0
     compressed = 0
-    
-    # Duyệt qua từng sheet hiển thị
-    for sheet in wb.sheets:
-        if getattr(sheet.api, 'Visible', -1) != -1:
-            continue
+    zorder_calls, zorder_baseline = 0, 0
+    executor = None
+
+    def get_executor():
+        # Chỉ khởi tạo pool khi thật sự có nhiều ảnh cần nén; dùng lại cho mọi sheet.
+        nonlocal executor
+        workers = encode_workers or image_encoder.encode_worker_count()
+        if workers <= 1:
+            return None
+        if executor is None:
+            logging.info(f"Khởi tạo {workers} tiến trình nén ảnh.")
+            executor = ProcessPoolExecutor(max_workers=workers)
+        return executor
 
-        # Lấy z-order của tất cả các shapes trên sheet
-        try:
-            shapes_with_z = []
-            for s in sheet.shapes:
-                try:
-                    z = getattr(s.api, 'ZOrderPosition', None)
-                    if z is not None:
-                        shapes_with_z.append((z, s.name))
-                except Exception:
-                    pass
-            shapes_with_z.sort(key=lambda x: x[0])  # Sắp xếp từ sau ra trước
-            z_order_names = [nm for _, nm in shapes_with_z]
-        except Exception:
-            z_order_names = [s.name for s in sheet.shapes]
+    try:
+        # Duyệt qua từng sheet hiển thị
+        for sheet in wb.sheets:
+            if getattr(sheet.api, 'Visible', -1) != -1:
+                continue
 
-        shape_names = [s.name for s in sheet.shapes]
-        new_names_map = {}
+            found, jobs = _extract_pictures(sheet)
+            total += found
+            if not jobs:
+                continue
 
-        for nm in shape_names:
+            # Lấy z-order của tất cả các shapes trên sheet
             try:
-                shp = sheet.shapes[nm]
-                t = getattr(shp.api, 'Type', None)
+                shapes_with_z = []
+                for s in sheet.shapes:
+                    try:
+                        z = getattr(s.api, 'ZOrderPosition', None)
+                        if z is not None:
+                            shapes_with_z.append((z, s.name))
+                    except Exception:
+                        pass
+                shapes_with_z.sort(key=lambda x: x[0])  # Sắp xếp từ sau ra trước
+                z_order_names = [nm for _, nm in shapes_with_z]
             except Exception:
-                continue
+                z_order_names = [s.name for s in sheet.shapes]
+
+            _encode_pictures(jobs, get_executor, quality=quality, mode=mode, keep_dpi=keep_dpi, target_dpi=target_dpi)
 
-            if t in (msoPicture, msoLinkedPicture):
-                total += 1
-                
-                # # SỬA LỖI: Kiểm tra các thuộc tính không ổn định trước khi nén
-                # # Tạm thời vô hiệu hóa theo yêu cầu để nén tất cả ảnh
-                # try:
-                #     rotation = getattr(shp.api, 'Rotation', 0)
-                #     is_locked = getattr(shp.api, 'LockAspectRatio', False)
-
-                #     if rotation != 0 or is_locked:
-                #         logging.warning(f"Bỏ qua ảnh '{nm}' trên sheet '{sheet.name}' do có góc xoay hoặc bị khóa tỉ lệ.")
-                #         continue # Bỏ qua và chuyển sang shape tiếp theo
-                # except Exception as prop_err:
-                #     logging.warning(f"Không thể kiểm tra thuộc tính của ảnh '{nm}'. Lỗi: {prop_err}")
-
-                logging.info(f"Đang nén ảnh '{nm}' trên sheet '{sheet.name}'...")
+            new_names_map = {}
+            for job in jobs:
+                if job['encoded'] is None:
+                    continue
+                logging.info(f"Đang thay ảnh '{job['name']}' trên sheet '{sheet.name}'...")
                 try:
-                    new_nm = _export_and_replace(shp, sheet, quality=quality, mode=mode, keep_dpi=keep_dpi)
+                    new_nm = _replace_picture(sheet, job)
                     if new_nm:
                         compressed += 1
-                        new_names_map[nm] = new_nm
+                        new_names_map[job['name']] = new_nm
                 except Exception as e:
-                    logging.warning(f"Lỗi khi nén ảnh '{nm}' ở sheet '{sheet.name}': {e}")
-            else:
-                logging.debug(f"Bỏ qua shape '{nm}' (loại: {t}) vì không phải ảnh.")
-                pass
-            
-            _doevents_pulse()
-
-        z_order_names_updated = [new_names_map.get(nm, nm) for nm in z_order_names]
-        _reorder_zorder_exact(sheet, z_order_names_updated)
-
-    logging.info(f"Hoàn tất nén ảnh. Đã nén {compressed}/{total} ảnh.")
+                    logging.warning(f"Lỗi khi thay ảnh '{job['name']}' ở sheet '{sheet.name}': {e}")
+                _doevents_pulse()
+
+            if new_names_map:
+                # Ảnh chèn lại luôn nằm trên cùng theo thứ tự chèn; các shape khác giữ thứ tự cũ.
+                current_order = [nm for nm in z_order_names if nm not in new_names_map] + list(new_names_map.values())
+                z_order_names_updated = [new_names_map.get(nm, nm) for nm in z_order_names]
+                zorder_calls += _reorder_zorder_exact(sheet, current_order, z_order_names_updated)
+            # Cách cũ gọi BringToFront cho từng shape của mọi sheet có ảnh
+            zorder_baseline += len(z_order_names)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    cache_stats = image_encoder.image_cache_stats()
+    logging.info(f"Hoàn tất nén ảnh. Đã nén {compressed}/{total} ảnh "
+                 f"(cache: {cache_stats['hits']} trúng / {cache_stats['misses']} trượt).")
+    logging.info(f"Khôi phục z-order: {zorder_calls} lệnh ZOrder, tiết kiệm {zorder_baseline - zorder_calls} lệnh COM.")
     
     excel.ScreenUpdating = prev_screen
     excel.DisplayAlerts = prev_alerts
@@ -347,4 +428,3 @@ def compress_images(wb, quality=70, mode='auto', keep_dpi=96):
         pass
     
     return True
-
@@ -1,62 +1,128 @@
 # Đường dẫn: excel_toolkit/utils/compressor_engine_spire.py
 # Tên cũ: image_compressor_spire_api.py
-# Phiên bản 1.2 - Sửa lỗi "same file" và tối ưu hóa logic
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 1.9 - Xác nhận ghép ảnh theo thứ tự bằng toạ độ; đếm đúng số lượt đọc thuộc tính COM
+# Ngày cập nhật: 2026-10-17
 
 from spire.xls import *
 from spire.xls.common import *
 import os
 from PIL import Image
 import io
-import tempfile
-import shutil
-import uuid
 import win32com.client
 import pythoncom
 import logging
+from utils import image_encoder, scratch_space
 
-def _optimize_image(input_path, output_path, max_size_kb=300):
+def _encode_optimized(input_data, max_size_kb=300, target_size=None):
     """
-    Tối ưu hóa kích thước hình ảnh, đảm bảo không vượt quá kích thước chỉ định.
+    Nén dữ liệu ảnh gốc; trả về (bytes, 'png' | 'jpeg').
+    `target_size` (pixel) là kích thước hiển thị x DPI mục tiêu; khi không xác định
+    được thì dùng giới hạn 800x600 như trước.
     """
-    try:
-        with Image.open(input_path) as img:
+    with Image.open(io.BytesIO(input_data)) as img:
+        if target_size:
+            img = image_encoder.downscale_to_target(img, target_size)
+        else:
             max_width = 800
             max_height = 600
             width, height = img.size
-            
             if width > max_width or height > max_height:
                 ratio = min(max_width/width, max_height/height)
                 new_size = (int(width*ratio), int(height*ratio))
                 img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            quality = 70
-            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                img.save(output_path, format='PNG', optimize=True, compression_level=9)
-            else:
-                img = img.convert('RGB')
-                while quality > 10:
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
-                    if buffer.tell() <= max_size_kb * 1024 or quality <= 10:
-                        img.save(output_path, format='JPEG', quality=quality, optimize=True, progressive=True)
-                        break
-                    quality -= 10
-            
-            return True
+
+        # Tìm nhị phân quality để vừa ngân sách max_size_kb thay vì hạ dần 10 mỗi lần
+        data, ext = image_encoder.encode_adaptive(img, max_bytes=max_size_kb * 1024, max_quality=70)
+        if len(data) > max_size_kb * 1024:
+            # Ngưỡng SSIM được ưu tiên hơn ngân sách: không ép ảnh xuống chất lượng thấp hơn nữa
+            logging.warning(f"    -> Ảnh sau nén {len(data) / 1024:.1f}KB vẫn vượt ngân sách {max_size_kb}KB "
+                            f"(giữ chất lượng tối thiểu theo SSIM).")
+        return data, ext
+
+def _optimize_image(input_data, max_size_kb=300, target_size=None):
+    """
+    Tối ưu hóa kích thước hình ảnh (bytes -> bytes), cố gắng không vượt quá `max_size_kb`.
+    Ngưỡng SSIM của image_encoder được ưu tiên hơn ngân sách, nên ảnh khó nén có thể vẫn lớn hơn
+    (khi đó có cảnh báo trong log).
+    Ảnh có cùng nội dung và cùng thông số chỉ được nén một lần (cache theo nội dung).
+    Trả về (bytes, phần mở rộng) hoặc None nếu lỗi.
+    """
+    try:
+        settings = {'engine': 'spire', 'max_size_kb': max_size_kb, 'target_size': target_size}
+        return image_encoder.cached_encode(
+            input_data, settings, lambda: _encode_optimized(input_data, max_size_kb, target_size))
     except Exception as e:
         logging.error(f"Lỗi khi tối ưu hóa hình ảnh: {str(e)}")
-        return False
+        return None
+
+def _extract_picture_bytes(pic):
+    """
+    Lấy dữ liệu ảnh gốc của một ExcelPicture trong bộ nhớ (Stream.ToArray);
+    chỉ khi không được mới lưu qua file trong thư mục tạm của tiến trình.
+    """
+    try:
+        data = pic.Picture.ToArray()
+        if data:
+            return bytes(data)
+    except Exception as e:
+        logging.debug(f"    -> Không đọc được ảnh trong bộ nhớ ({e}), chuyển sang lưu file tạm.")
+    with scratch_space.scratch_path("png") as img_path:
+        pic.Picture.Save(img_path)
+        if not os.path.exists(img_path):
+            return None
+        with open(img_path, 'rb') as f:
+            return f.read()
 
-def compress_images(file_path, max_size_kb=300):
+def _index_sheet_pictures(sheet, stats):
+    """
+    Duyệt sheet.Shapes đúng một lần, trả về (tên -> danh sách ảnh, danh sách ảnh theo thứ tự).
+    Thứ tự ảnh thường khớp với chỉ số sheet.Pictures[i] của Spire, nhưng không chắc chắn
+    (ảnh liên kết, shape khác có chứa ảnh) nên _match_picture luôn xác nhận lại bằng toạ độ.
+    Mỗi lượt đọc thuộc tính COM được cộng vào stats['lookups'].
+    """
+    by_name, pictures = {}, []
+    for shape in sheet.Shapes:
+        stats['lookups'] += 1
+        if shape.Type != 13:  # msoPicture
+            continue
+        entry = {'shape': shape, 'name': shape.Name}
+        stats['lookups'] += 1
+        pictures.append(entry)
+        by_name.setdefault(entry['name'], []).append(entry)
+    return by_name, pictures
+
+def _is_near(entry, img_info, stats):
+    """Toạ độ shape COM lệch ảnh Spire không quá 5 point (Left/Top chỉ đọc qua COM một lần)."""
+    if 'left' not in entry:
+        entry['left'], entry['top'] = entry['shape'].Left, entry['shape'].Top
+        stats['lookups'] += 2
+    return abs(entry['left'] - img_info['left']) < 5 and abs(entry['top'] - img_info['top']) < 5
+
+def _match_picture(img_info, by_name, pictures, matched, stats):
+    """
+    Tìm shape gốc của một ảnh. Tên duy nhất trong sheet được nhận ngay; tên trùng (ảnh copy-paste)
+    hoặc không có tên thì thử ảnh cùng thứ tự, rồi các ảnh cùng tên, rồi mọi ảnh còn lại, nhưng chỉ
+    nhận khi toạ độ khớp (trong 5 point). Mỗi shape chỉ được ghép một lần.
+    """
+    named = by_name.get(img_info['name'], [])
+    entry = named[0] if len(named) == 1 and id(named[0]) not in matched else None
+    if entry is None:
+        index = img_info['index']
+        ordered = [pictures[index]] if index < len(pictures) else []
+        entry = next((candidate for candidate in ordered + named + pictures
+                      if id(candidate) not in matched and _is_near(candidate, img_info, stats)), None)
+    if entry is None:
+        return None
+    matched.add(id(entry))
+    return entry['shape']
+
+def compress_images(file_path, max_size_kb=300, target_dpi=image_encoder.DEFAULT_TARGET_DPI):
     """
     Nén file Excel bằng cách trích xuất và tối ưu hóa hình ảnh với thư viện Spire.Xls.
     Hàm này hoạt động trực tiếp trên file được cung cấp (in-place).
+    Mỗi ảnh được thu nhỏ về kích thước hiển thị x `target_dpi` trước khi nén.
     """
     logging.info("Bắt đầu nén ảnh bằng engine Spire.Xls...")
-    temp_dir = tempfile.mkdtemp()
-    compressed_dir = os.path.join(temp_dir, "compressed")
-    os.makedirs(compressed_dir, exist_ok=True)
     
     try:
         workbook = Workbook()
@@ -74,18 +140,19 @@ def compress_images(file_path, max_size_kb=300):
             for i in range(pic_count):
                 try:
                     pic = sheet.Pictures[i]
-                    temp_filename = f"excel_img_{uuid.uuid4()}"
-                    img_path = os.path.join(temp_dir, f"{temp_filename}.png")
+                    original_data = _extract_picture_bytes(pic)
                     
-                    pic.Picture.Save(img_path)
-                    
-                    if os.path.exists(img_path) and os.path.getsize(img_path) > 0:
-                        output_path = os.path.join(compressed_dir, f"compressed_{temp_filename}.png")
-                        
-                        if _optimize_image(img_path, output_path, max_size_kb):
+                    if original_data:
+                        target_size = image_encoder.target_size_from_points(pic.Width, pic.Height, target_dpi)
+                        optimized = _optimize_image(original_data, max_size_kb, target_size)
+                        if optimized:
+                            data, ext = optimized
                             image_info = {
-                                'compressed_path': output_path,
+                                'data': data,
+                                'ext': ext,
                                 'sheet_name': sheet.Name,
+                                'name': pic.Name,
+                                'index': i,
                                 'left': pic.Left,
                                 'top': pic.Top,
                                 'width': pic.Width,
@@ -93,9 +160,7 @@ def compress_images(file_path, max_size_kb=300):
                             }
                             images_to_replace.append(image_info)
                             
-                            original_size_kb = os.path.getsize(img_path) / 1024
-                            compressed_size_kb = os.path.getsize(output_path) / 1024
-                            logging.info(f"    -> Đã nén ảnh thành công: {original_size_kb:.1f}KB -> {compressed_size_kb:.1f}KB")
+                            logging.info(f"    -> Đã nén ảnh thành công: {len(original_data) / 1024:.1f}KB -> {len(data) / 1024:.1f}KB")
                             
                 except Exception as e:
                     logging.warning(f"Lỗi khi xử lý ảnh trong sheet '{sheet.Name}': {str(e)}")
@@ -114,31 +179,47 @@ def compress_images(file_path, max_size_kb=300):
                 
                 workbook_win32 = excel.Workbooks.Open(os.path.abspath(file_path))
                 
+                # Gom theo sheet để mỗi sheet chỉ dựng chỉ mục shape một lần
+                images_by_sheet = {}
                 for img_info in images_to_replace:
-                    sheet_name = img_info['sheet_name']
+                    images_by_sheet.setdefault(img_info['sheet_name'], []).append(img_info)
+
+                stats = {'lookups': 0}
+                for sheet_name, sheet_images in images_by_sheet.items():
                     sheet = workbook_win32.Sheets(sheet_name)
-                    
-                    try:
-                        for shape in sheet.Shapes:
-                            if (abs(shape.Left - img_info['left']) < 5 and 
-                                abs(shape.Top - img_info['top']) < 5 and 
-                                shape.Type == 13): # msoPicture
-                                shape.Delete()
-                                logging.debug(f"    -> Đã xóa ảnh gốc trên sheet '{sheet_name}'.")
-                                break
-                    except Exception as e:
-                        logging.warning(f"Không thể xóa ảnh gốc: {str(e)}")
-                    
-                    sheet.Shapes.AddPicture(
-                        Filename=img_info['compressed_path'],
-                        LinkToFile=False,
-                        SaveWithDocument=True,
-                        Left=img_info['left'],
-                        Top=img_info['top'],
-                        Width=img_info['width'],
-                        Height=img_info['height']
-                    )
-                    logging.debug(f"    -> Đã chèn ảnh đã nén vào sheet '{sheet_name}'.")
+                    by_name, pictures = _index_sheet_pictures(sheet, stats)
+                    matched = set()
+
+                    for img_info in sheet_images:
+                        shape = _match_picture(img_info, by_name, pictures, matched, stats)
+                        if shape is None:
+                            logging.warning(f"Không tìm thấy ảnh gốc '{img_info['name']}' trên sheet '{sheet_name}'. Bỏ qua.")
+                            continue
+                        try:
+                            shape.Delete()
+                            logging.debug(f"    -> Đã xóa ảnh gốc '{img_info['name']}' trên sheet '{sheet_name}'.")
+                        except Exception as e:
+                            logging.warning(f"Không thể xóa ảnh gốc: {str(e)}")
+                            continue
+                        
+                        # AddPicture chỉ nhận đường dẫn: ghi tạm rồi xóa ngay sau khi chèn
+                        with scratch_space.spill(img_info['data'], img_info['ext']) as compressed_path:
+                            new_shape = sheet.Shapes.AddPicture(
+                                Filename=compressed_path,
+                                LinkToFile=False,
+                                SaveWithDocument=True,
+                                Left=img_info['left'],
+                                Top=img_info['top'],
+                                Width=img_info['width'],
+                                Height=img_info['height']
+                            )
+                        try:
+                            # Giữ tên cũ để các tham chiếu theo tên (macro, lần chạy sau) vẫn đúng
+                            new_shape.Name = img_info['name']
+                        except Exception:
+                            pass
+                        logging.debug(f"    -> Đã chèn ảnh đã nén vào sheet '{sheet_name}'.")
+                logging.debug(f"  -> Đã ghép {len(images_to_replace)} ảnh với {stats['lookups']} lượt đọc thuộc tính COM.")
 
                 workbook_win32.Save()
                 workbook_win32.Close()
@@ -154,10 +235,4 @@ def compress_images(file_path, max_size_kb=300):
     except Exception as e:
         logging.error(f"Lỗi nghiêm trọng trong quá trình nén ảnh với Spire.Xls: {str(e)}")
         return False
-    finally:
-        try:
-            shutil.rmtree(temp_dir)
-            logging.debug("Đã xóa thư mục tạm thời.")
-        except:
-            logging.warning("Không thể xóa thư mục tạm thời.")
 
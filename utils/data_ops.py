@@ -1,77 +1,82 @@
 # Đường dẫn: excel_toolkit/utils/data_ops.py
-# Phiên bản 2.1 - Khôi phục đầy đủ tính năng cho hàm df_read
-# Ngày cập nhật: 2025-09-12
+# Phiên bản 2.8 - iter_excel_chunks: đánh số tên cột trùng trên toàn bộ hàng tiêu đề như pd.read_excel
+# Ngày cập nhật: 2026-10-17
 
 import logging
+import re
+import numpy as np
 import pandas as pd
 import openpyxl as opx
 import xlwings as xw
 import os
 import csv
+import zipfile
+from utils import sheet_cache, xlsx_reader
 
 # ======================================================================
 # --- Nhóm 1: Đọc dữ liệu cấp cao bằng Pandas (Đầy đủ tính năng) ---
 # ======================================================================
 
-def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, output=None, chunksize=None):
+def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, output=None, chunksize=None, dtype_backend=None,
+            cache=False):
     """
     Đọc dữ liệu từ nhiều định dạng file khác nhau và trả về dưới dạng DataFrame.
-    Hàm này hỗ trợ đọc từ file Excel, CSV, và cả DataFrame đã có.
+    Hàm này hỗ trợ đọc từ file Excel, CSV, Parquet, Feather và cả DataFrame đã có.
     Nó cũng cho phép tùy chỉnh các tham số như hàng tiêu đề, sheet, cột, 
     bộ lọc, định dạng đầu ra và đọc file theo chunk.
+
+    `flt` là danh sách (cột, giá trị, toán tử) hoặc bộ lọc đã biên dịch bằng compile_filter.
+    `output`: None (DataFrame), "list", "dict", "numpy" (mảng NumPy, không sao chép khi mọi cột
+    cùng kiểu) hoặc đường dẫn file .csv/.xlsx/.parquet/.feather.
+    `dtype_backend`: None, "numpy_nullable" hoặc "pyarrow" (cột kiểu Arrow, cần thư viện pyarrow).
+    Khi có chunksize (file CSV, Excel, Parquet hoặc Feather), file được đọc theo từng phần
+    `chunksize` hàng và bộ lọc được áp dụng trên từng chunk:
+        - output None/"list"/"dict"/"numpy": trả về generator, mỗi phần tử là một chunk đã lọc;
+        - output là đường dẫn file: ghi nối tiếp từng chunk rồi trả về đường dẫn đó.
+    `cache=True`: dữ liệu đã phân tích (trước khi lọc) được lưu trên đĩa theo nội dung file và tham số
+    đọc (xem utils/sheet_cache.py); lần đọc sau trên file không đổi bỏ qua bước phân tích. Khi đọc
+    theo chunk, cache chỉ được dùng nếu đã có sẵn (không ghi cache để giữ bộ nhớ cố định).
     """
     logging.debug(f"Bắt đầu quy trình df_read với data_input: {data_input}.")
 
     # --- Hàm nội bộ để kiểm tra và đọc dữ liệu từ nguồn ---
-    def _read_source_data(source, sheet, header, cols, chunk):
+    def _read_source_data(source, sheet, header, cols, chunk, backend):
         if isinstance(source, pd.DataFrame):
-            return source[cols] if cols else source
+            return _to_backend(source[cols] if cols else source, backend)
 
         if not os.path.isfile(source):
             raise FileNotFoundError(f"File không tồn tại: {source}.")
 
         file_extension = os.path.splitext(source)[1].lower()
+        backend_options = {'dtype_backend': backend} if backend else {}
         
         try:
-            if file_extension in ['.xlsx', '.xlsm', '.xls']:
-                return pd.read_excel(source, sheet_name=sheet, header=header, usecols=cols)
+            if backend == 'pyarrow' or file_extension in COLUMNAR_EXTENSIONS:
+                _import_pyarrow()
+            if file_extension in ['.xlsx', '.xlsm', '.xls'] and chunk:
+                return iter_excel_chunks(source, sheet, header, cols, chunk, backend)
+            elif file_extension in ['.xlsx', '.xlsm', '.xls']:
+                return pd.read_excel(source, sheet_name=sheet, header=header, usecols=cols, **backend_options)
             elif file_extension == '.csv':
-                return pd.read_csv(source, sep=',', header=header, usecols=cols, on_bad_lines='skip', quoting=csv.QUOTE_MINIMAL, chunksize=chunk)
+                return pd.read_csv(source, sep=',', header=header, usecols=cols, on_bad_lines='skip', quoting=csv.QUOTE_MINIMAL, chunksize=chunk, **backend_options)
+            elif file_extension in COLUMNAR_EXTENSIONS and chunk:
+                return iter_columnar_chunks(source, cols, chunk, backend)
+            elif file_extension == '.parquet':
+                return pd.read_parquet(source, columns=cols, **backend_options)
+            elif file_extension == '.feather':
+                return pd.read_feather(source, columns=cols, **backend_options)
             else:
                 raise ValueError(f"Định dạng file không được hỗ trợ: {file_extension}.")
         except Exception as e:
             logging.error(f"Lỗi khi đọc file '{source}': {e}")
             raise
 
-    # --- Hàm nội bộ để áp dụng bộ lọc ---
-    def _apply_filter(df, filters):
-        if not filters:
+    # --- Hàm nội bộ để áp dụng bộ lọc (đã biên dịch một lần, dùng lại cho mọi chunk) ---
+    def _apply_filter(df, compiled):
+        if compiled is None:
             return df
-        
-        logging.debug(f"Bắt đầu áp dụng bộ lọc: {filters}")
-        filtered_df = df.copy()
-        for col, value, op in filters:
-            if col not in filtered_df.columns:
-                raise KeyError(f"Cột '{col}' không tồn tại trong DataFrame.")
-            
-            if op == 'exact':
-                filtered_df = filtered_df[filtered_df[col] == value]
-            elif op == 'contains':
-                filtered_df = filtered_df[filtered_df[col].astype(str).str.contains(str(value), na=False)]
-            elif op == '>':
-                filtered_df = filtered_df[pd.to_numeric(filtered_df[col], errors='coerce') > value]
-            elif op == '<':
-                filtered_df = filtered_df[pd.to_numeric(filtered_df[col], errors='coerce') < value]
-            elif op == '>=':
-                filtered_df = filtered_df[pd.to_numeric(filtered_df[col], errors='coerce') >= value]
-            elif op == '<=':
-                filtered_df = filtered_df[pd.to_numeric(filtered_df[col], errors='coerce') <= value]
-            elif op == '!=':
-                filtered_df = filtered_df[filtered_df[col] != value]
-            else:
-                raise ValueError(f"Toán tử không hợp lệ: {op}.")
-        
-        logging.info(f"DataFrame sau khi lọc có shape: {filtered_df.shape}")
+        filtered_df = compiled.apply(df)
+        logging.debug(f"DataFrame sau khi lọc có shape: {filtered_df.shape}")
         return filtered_df
 
     # --- Hàm nội bộ để xử lý đầu ra ---
@@ -84,6 +89,8 @@ def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, out
             return df.values.tolist()
         elif out_format == "dict":
             return df.to_dict(orient='records')
+        elif out_format == "numpy":
+            return df.to_numpy()
         
         # Nếu out_format là một đường dẫn file
         try:
@@ -92,6 +99,12 @@ def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, out
                 df.to_csv(out_format, index=False)
             elif output_ext in ['.xlsx', '.xls']:
                 df.to_excel(out_format, index=False)
+            elif output_ext in COLUMNAR_EXTENSIONS:
+                writer = ColumnarWriter(out_format)
+                try:
+                    writer.write(df)
+                finally:
+                    writer.close()
             else:
                 raise ValueError(f"Định dạng file output không được hỗ trợ: {output_ext}.")
             logging.info(f"Đã ghi DataFrame thành công ra file: {out_format}")
@@ -100,10 +113,68 @@ def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, out
             logging.error(f"Lỗi khi ghi output ra file '{out_format}': {e}")
             raise
 
+    # --- Hàm nội bộ để lọc và chuyển đổi lần lượt từng chunk ---
+    def _iter_chunks(chunks, filters, out_format):
+        try:
+            for chunk in chunks:
+                yield _handle_output(_apply_filter(chunk, filters), out_format)
+        except Exception as e:
+            logging.error(f"Lỗi khi đọc dữ liệu theo chunk: {e}")
+            raise
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    # --- Hàm nội bộ để ghi nối tiếp từng chunk ra file ---
+    def _write_chunks(chunks, filters, out_path):
+        output_ext = os.path.splitext(out_path)[1].lower()
+        if output_ext not in ('.csv', '.xlsx') + COLUMNAR_EXTENSIONS:
+            raise ValueError(f"Định dạng file output không được hỗ trợ khi đọc theo chunk: {output_ext}.")
+        total = 0
+        if output_ext in COLUMNAR_EXTENSIONS:
+            writer = ColumnarWriter(out_path)
+        else:
+            writer = pd.ExcelWriter(out_path) if output_ext == '.xlsx' else None
+        try:
+            for chunk in _iter_chunks(chunks, filters, None):
+                if isinstance(writer, ColumnarWriter):
+                    writer.write(chunk)
+                elif writer is not None:
+                    chunk.to_excel(writer, index=False, header=total == 0, startrow=total + 1 if total else 0)
+                else:
+                    chunk.to_csv(out_path, index=False, header=total == 0, mode='a' if total else 'w')
+                total += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        logging.info(f"Đã ghi {total} hàng (theo chunk) ra file: {out_path}")
+        return out_path
+
     # --- Luồng thực thi chính ---
     try:
-        df = _read_source_data(data_input, sheet_name, header_row, use_cols, chunksize)
-        df_filtered = _apply_filter(df, flt)
+        compiled = compile_filter(flt)
+        cache_key, df = None, None
+        if cache and not isinstance(data_input, pd.DataFrame) and os.path.isfile(data_input):
+            cache_key = sheet_cache.sheet_cache_key(data_input, kind='frame', sheet=sheet_name, header=header_row,
+                                                    columns=use_cols, dtype_backend=dtype_backend)
+            cached = sheet_cache.cache_get_frame(cache_key)
+            if cached is not None:
+                logging.info(f"Dùng dữ liệu đã phân tích từ cache cho file: {os.path.basename(data_input)}")
+                df = cached
+                if chunksize:
+                    df = (cached.iloc[start:start + chunksize] for start in range(0, len(cached), chunksize))
+        if df is None:
+            df = _read_source_data(data_input, sheet_name, header_row, use_cols, chunksize, dtype_backend)
+            if cache_key and isinstance(df, pd.DataFrame):
+                sheet_cache.cache_put_frame(cache_key, df)
+        if chunksize and not isinstance(df, pd.DataFrame):
+            if output and output not in ("list", "dict", "numpy"):
+                return _write_chunks(df, compiled, output)
+            logging.info("Trả về bộ đọc theo chunk, bộ lọc được áp dụng trên từng chunk.")
+            return _iter_chunks(df, compiled, output)
+        df_filtered = _apply_filter(df, compiled)
+        if compiled is not None:
+            logging.info(f"DataFrame sau khi lọc có shape: {df_filtered.shape}")
         result = _handle_output(df_filtered, output)
         logging.info("Hoàn tất quy trình df_read thành công.")
         return result
@@ -112,14 +183,294 @@ def df_read(data_input, sheet_name=0, header_row=0, use_cols=None, flt=None, out
         return None
 
 # ======================================================================
-# --- Nhóm 2: Đọc dữ liệu bằng các engine khác ---
+# --- Nhóm 2: Bộ lọc biên dịch (vector hóa bằng NumPy) ---
+# ======================================================================
+
+NUMERIC_OPS = {'>': np.greater, '<': np.less, '>=': np.greater_equal, '<=': np.less_equal}
+TEXT_OPS = ('contains', 'regex', 'startswith')
+FILTER_OPS = ('exact', '!=', 'in', 'not in', 'between', 'isnull', 'notnull') + tuple(NUMERIC_OPS) + TEXT_OPS
+
+def _as_mask(result):
+    """Đổi kết quả so sánh của pandas (kể cả kiểu nullable có NA) thành mảng bool NumPy."""
+    return result.to_numpy(dtype=bool, na_value=False) if hasattr(result, 'to_numpy') else np.asarray(result, dtype=bool)
+
+class CompiledFilter:
+    """
+    Danh sách điều kiện (cột, giá trị, toán tử) đã được kiểm tra và chuẩn bị sẵn (regex biên dịch,
+    tập giá trị cho 'in'), đánh giá thành MỘT mặt nạ bool rồi lọc DataFrame một lần duy nhất.
+    Trong một lần đánh giá, mỗi cột chỉ được ép kiểu số / chuyển thành chuỗi một lần dù có nhiều
+    điều kiện trên cùng cột. Dùng lại được cho nhiều chunk và nhiều file.
+
+    Toán tử: 'exact', '!=', '>', '<', '>=', '<=' (so sánh số, giá trị không phải số bị loại),
+    'in'/'not in' (giá trị là danh sách), 'between' (giá trị là (thấp, cao), tính cả hai đầu),
+    'contains' (regex như str.contains), 'regex' (re.search), 'startswith' (chuỗi hoặc tuple),
+    'isnull'/'notnull' (bỏ qua giá trị).
+    """
+    def __init__(self, filters):
+        self.conditions = []
+        for col, value, op in filters:
+            if op not in FILTER_OPS:
+                raise ValueError(f"Toán tử không hợp lệ: {op}.")
+            if op in ('in', 'not in'):
+                value = list(value)
+            elif op == 'between':
+                low, high = value
+                value = (low, high)
+            elif op == 'regex':
+                value = re.compile(value) if isinstance(value, str) else value
+            elif op == 'contains':
+                value = str(value)
+            elif op == 'startswith':
+                value = tuple(value) if isinstance(value, (list, tuple)) else str(value)
+            self.conditions.append((col, value, op))
+        self.columns = {col for col, _, _ in self.conditions}
+
+    def __repr__(self):
+        return f"CompiledFilter({self.conditions})"
+
+    def mask(self, df):
+        """Mặt nạ bool (NumPy) của các hàng thỏa mọi điều kiện; ném KeyError nếu thiếu cột."""
+        for col in self.columns:
+            if col not in df.columns:
+                raise KeyError(f"Cột '{col}' không tồn tại trong DataFrame.")
+        result = np.ones(len(df), dtype=bool)
+        numeric, text = {}, {}
+        for col, value, op in self.conditions:
+            series = df[col]
+            if op in NUMERIC_OPS or (op == 'between' and all(isinstance(v, (int, float)) for v in value)):
+                if col not in numeric:
+                    numeric[col] = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+                values = numeric[col]
+                if op == 'between':
+                    current = (values >= value[0]) & (values <= value[1])
+                else:
+                    current = NUMERIC_OPS[op](values, value)
+            elif op in TEXT_OPS:
+                if col not in text:
+                    text[col] = (series.astype(str), _as_mask(series.notna()))
+                strings, present = text[col]
+                if op in ('contains', 'regex'):
+                    current = _as_mask(strings.str.contains(value, na=False))
+                else:
+                    current = _as_mask(strings.str.startswith(value))
+                current = current & present
+            elif op == 'exact':
+                current = _as_mask(series == value)
+            elif op == '!=':
+                current = _as_mask(series != value)
+            elif op == 'in':
+                current = _as_mask(series.isin(value))
+            elif op == 'not in':
+                current = ~_as_mask(series.isin(value))
+            elif op == 'between':
+                current = _as_mask(series.between(*value))
+            elif op == 'isnull':
+                current = _as_mask(series.isna())
+            else:
+                current = _as_mask(series.notna())
+            result &= current
+            if not result.any():
+                break
+        return result
+
+    def apply(self, df):
+        """DataFrame chỉ gồm các hàng thỏa bộ lọc (một lần sao chép duy nhất)."""
+        return df[self.mask(df)]
+
+def compile_filter(filters):
+    """
+    Biên dịch danh sách (cột, giá trị, toán tử) thành CompiledFilter (xem docstring của lớp);
+    trả về nguyên bộ lọc nếu đã biên dịch, None nếu danh sách rỗng.
+    """
+    if not filters:
+        return None
+    if isinstance(filters, CompiledFilter):
+        return filters
+    return CompiledFilter(filters)
+
+# ======================================================================
+# --- Nhóm 3: Đọc Excel theo chunk (parser luồng, không nạp cả sheet) ---
+# ======================================================================
+
+def _resolve_use_cols(use_cols, names):
+    """
+    Đổi `use_cols` (như usecols của pandas: None, chuỗi 'A:C,E', danh sách chỉ số hoặc tên cột,
+    hàm nhận tên cột) thành danh sách chỉ số cột tăng dần. `names` là tên của mọi cột trên toàn
+    bộ độ rộng sheet (cột sau ô tiêu đề cuối cùng là 'Unnamed: i' như pandas).
+    """
+    if use_cols is None:
+        return list(range(len(names)))
+    if isinstance(use_cols, str):
+        columns = set()
+        for part in use_cols.replace(' ', '').split(','):
+            first, _, last = part.partition(':')
+            columns.update(range(xlsx_reader.column_index(first.upper()), xlsx_reader.column_index((last or first).upper()) + 1))
+        return sorted(columns)
+    if callable(use_cols):
+        return [i for i, name in enumerate(names) if use_cols(name)]
+    columns = set()
+    for col in use_cols:
+        if isinstance(col, int):
+            columns.add(col)
+        elif col in names:
+            columns.add(names.index(col))
+        else:
+            raise ValueError(f"Cột '{col}' không tồn tại trong hàng tiêu đề.")
+    return sorted(columns)
+
+def _rows_to_frame(rows, names, dtype_backend):
+    """
+    DataFrame của một chunk: ô trống (None) thành NaN và cột chỉ có ô trống thành float64
+    như pd.read_excel, để ghép các chunk lại ra cùng kiểu dữ liệu.
+    """
+    df = pd.DataFrame(rows, columns=names)
+    objects = [i for i, dtype in enumerate(df.dtypes) if dtype == object]
+    if objects:
+        values = df.iloc[:, objects]
+        df.isetitem(objects, values.where(values.notna(), np.nan).infer_objects())
+    return _to_backend(df, dtype_backend)
+
+def _column_names(header_values, columns):
+    """Tên cột như pandas: ô tiêu đề trống -> 'Unnamed: i', tên trùng -> 'tên.1', 'tên.2'..."""
+    if header_values is None:
+        return list(columns)
+    names, seen = [], {}
+    for column in columns:
+        value = header_values[column] if column < len(header_values) else None
+        name = f"Unnamed: {column}" if value is None else value
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(f"{name}.{count}" if count else name)
+    return names
+
+def iter_excel_chunks(file_path, sheet_name=0, header_row=0, use_cols=None, chunksize=100_000, dtype_backend=None):
+    """
+    Đọc sheet Excel theo từng DataFrame `chunksize` hàng bằng parser luồng (xlsx_reader), bộ nhớ
+    cố định theo một chunk. Kết quả ghép lại giống pd.read_excel(sheet_name, header, usecols):
+    ô ngoài `use_cols` không được giải mã, hàng trống ở giữa giữ lại dạng NaN, hàng trống cuối bị bỏ.
+    File .xls (không phải gói OOXML) được đọc bằng pd.read_excel rồi chia chunk.
+    `dtype_backend` ("numpy_nullable"/"pyarrow") được áp dụng cho từng chunk.
+    """
+    if os.path.splitext(file_path)[1].lower() == '.xls':
+        df = _to_backend(pd.read_excel(file_path, sheet_name=sheet_name, header=header_row, usecols=use_cols), dtype_backend)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+        return
+
+    with zipfile.ZipFile(file_path) as zf:
+        dimension = xlsx_reader.sheet_dimension(zf, xlsx_reader.worksheet_part(zf, sheet_name))
+    first_row = header_row + 2 if header_row is not None else 1
+    header_values = None
+    if header_row is not None or dimension is None:
+        # Đọc riêng hàng tiêu đề (dừng ngay sau hàng đó) để lấy tên cột và độ rộng
+        header_values = []
+        probe_row = first_row - 1 if header_row is not None else 1
+        for _, values in xlsx_reader.iter_sheet_rows(file_path, sheet_name, min_row=probe_row, max_row=probe_row):
+            header_values = values
+    width = max(dimension[1] if dimension else 0, len(header_values or []))
+    header = header_values if header_row is not None else None
+    # Tên trùng được đánh số trên toàn bộ hàng tiêu đề (không chỉ các cột được chọn) như pandas
+    all_names = _column_names(header, range(width))
+    columns = _resolve_use_cols(use_cols, all_names)
+    names = [all_names[c] if c < width else _column_names(header, [c])[0] for c in columns]
+
+    rows, expected = [], first_row
+    for number, values in xlsx_reader.iter_sheet_rows(file_path, sheet_name, columns, min_row=first_row):
+        # Hàng trống ở giữa chỉ được thêm khi gặp hàng có dữ liệu phía sau (hàng trống cuối bị bỏ như pandas)
+        for _ in range(number - expected):
+            rows.append([None] * len(columns))
+            if len(rows) >= chunksize:
+                yield _rows_to_frame(rows, names, dtype_backend)
+                rows = []
+        expected = number + 1
+        rows.append(values)
+        if len(rows) >= chunksize:
+            yield _rows_to_frame(rows, names, dtype_backend)
+            rows = []
+    if rows:
+        yield _rows_to_frame(rows, names, dtype_backend)
+
+# ======================================================================
+# --- Nhóm 4: Đọc/ghi dạng cột (Parquet, Feather) và kiểu dữ liệu Arrow ---
+# ======================================================================
+
+COLUMNAR_EXTENSIONS = ('.parquet', '.feather')
+
+def _import_pyarrow():
+    """Nạp pyarrow (thư viện tùy chọn) khi cần; ném ImportError kèm hướng dẫn cài đặt nếu thiếu."""
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise ImportError("Cần cài đặt thư viện 'pyarrow' để dùng Parquet/Feather hoặc kiểu dữ liệu Arrow. (pip install pyarrow)")
+
+def _to_backend(df, dtype_backend):
+    """Đổi DataFrame sang kiểu nullable/Arrow theo `dtype_backend` (None: giữ nguyên)."""
+    return df.convert_dtypes(dtype_backend=dtype_backend) if dtype_backend else df
+
+class ColumnarWriter:
+    """
+    Ghi nối tiếp nhiều DataFrame vào một file Parquet (mỗi lần ghi là một row group, nén snappy)
+    hoặc Feather v2 (Arrow IPC, mỗi lần ghi là một record batch, nén lz4) mà không giữ lại dữ liệu
+    đã ghi. Schema lấy theo DataFrame đầu tiên; các lần ghi sau được ép về schema đó.
+    """
+    def __init__(self, path):
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.schema = None
+        self._writer = None
+
+    def write(self, df):
+        pa = self.pa
+        if self._writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.schema = table.schema
+            if self.path.lower().endswith('.parquet'):
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, self.schema, compression='snappy')
+            else:
+                self._writer = pa.ipc.new_file(self.path, self.schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        else:
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def iter_columnar_chunks(file_path, columns=None, chunksize=100_000, dtype_backend=None):
+    """
+    Đọc file Parquet (theo row group, chỉ giải mã `columns`) hoặc Feather (ánh xạ bộ nhớ, theo
+    record batch) thành các DataFrame tối đa `chunksize` hàng.
+    """
+    pa = _import_pyarrow()
+    types_mapper = pd.ArrowDtype if dtype_backend == 'pyarrow' else None
+    if file_path.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(file_path))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        if columns and batch.schema.names != list(columns):
+            batch = batch.select(list(columns))
+        for start in range(0, batch.num_rows, chunksize):
+            df = batch.slice(start, chunksize).to_pandas(types_mapper=types_mapper)
+            if dtype_backend == 'numpy_nullable':
+                df = _to_backend(df, dtype_backend)
+            yield df
+
+# ======================================================================
+# --- Nhóm 5: Đọc dữ liệu bằng các engine khác ---
 # ======================================================================
 
-def read_with_openpyxl(file_path, sheet_name, read_only=True):
+def read_with_openpyxl(file_path, sheet_name, read_only=True, cache=False):
     """
     Đọc toàn bộ dữ liệu từ một sheet bằng openpyxl.
     Phương pháp này rất nhanh và không cần mở ứng dụng Excel,
     lý tưởng cho việc trích xuất dữ liệu thô.
+    `cache=True`: dùng/ghi cache sheet trên đĩa (utils/sheet_cache.py) theo nội dung file.
     """
     logging.debug(f"Bắt đầu đọc dữ liệu bằng openpyxl từ file '{file_path}', sheet '{sheet_name}'.")
     try:
@@ -127,6 +478,12 @@ def read_with_openpyxl(file_path, sheet_name, read_only=True):
             logging.error(f"Lỗi: File không tồn tại tại đường dẫn '{file_path}'.")
             return None
 
+        cache_key = sheet_cache.sheet_cache_key(file_path, kind='rows', sheet=sheet_name) if cache else None
+        data = sheet_cache.cache_get_rows(cache_key)
+        if data is not None:
+            logging.info(f"Đã đọc {len(data)} hàng dữ liệu từ cache sheet.")
+            return data
+
         workbook = opx.load_workbook(filename=file_path, read_only=read_only)
         if sheet_name not in workbook.sheetnames:
             logging.error(f"Lỗi: Không tìm thấy sheet '{sheet_name}' trong file.")
@@ -134,15 +491,62 @@ def read_with_openpyxl(file_path, sheet_name, read_only=True):
             return None
             
         sheet = workbook[sheet_name]
-        data = [[cell.value for cell in row] for row in sheet.iter_rows()]
+        data = [list(row) for row in sheet.iter_rows(values_only=True)]
         
         workbook.close()
+        if cache_key:
+            sheet_cache.cache_put_rows(cache_key, data)
         logging.info(f"Đã đọc thành công {len(data)} hàng dữ liệu bằng openpyxl.")
         return data
     except Exception as e:
         logging.error(f"Lỗi khi đọc file bằng openpyxl: {e}")
         return None
 
+def iter_with_openpyxl(file_path, sheet_name, min_row=None, max_row=None, min_col=None, max_col=None, batch_size=None):
+    """
+    Bản đọc theo luồng của read_with_openpyxl: generator trả về lần lượt từng hàng (tuple giá trị,
+    values_only) hoặc, khi có `batch_size`, từng lô tối đa `batch_size` hàng dưới dạng mảng NumPy
+    object 2 chiều (hàng ngắn được đệm None tới độ rộng của vùng đọc).
+    min_row/max_row/min_col/max_col (bắt đầu từ 1) giới hạn vùng đọc. Workbook mở ở chế độ chỉ đọc
+    nên bộ nhớ cố định theo một hàng/lô; ngừng lặp (break) sẽ đóng file mà không phân tích phần còn lại.
+    Ném FileNotFoundError/KeyError nếu không có file/sheet.
+    """
+    logging.debug(f"Bắt đầu đọc theo luồng bằng openpyxl từ file '{file_path}', sheet '{sheet_name}'.")
+    if not os.path.exists(file_path):
+        logging.error(f"Lỗi: File không tồn tại tại đường dẫn '{file_path}'.")
+        raise FileNotFoundError(f"File không tồn tại: {file_path}.")
+
+    workbook = opx.load_workbook(filename=file_path, read_only=True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            logging.error(f"Lỗi: Không tìm thấy sheet '{sheet_name}' trong file.")
+            raise KeyError(f"Không tìm thấy sheet '{sheet_name}'.")
+        rows = workbook[sheet_name].iter_rows(min_row=min_row, max_row=max_row, min_col=min_col,
+                                              max_col=max_col, values_only=True)
+        if not batch_size:
+            yield from rows
+            return
+
+        width = max_col - (min_col or 1) + 1 if max_col else None
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield _rows_to_array(batch, width)
+                batch = []
+        if batch:
+            yield _rows_to_array(batch, width)
+    finally:
+        workbook.close()
+
+def _rows_to_array(rows, width=None):
+    """Mảng NumPy object (số hàng x độ rộng) từ các tuple hàng, đệm None cho hàng ngắn."""
+    width = width or max((len(row) for row in rows), default=0)
+    array = np.full((len(rows), width), None, dtype=object)
+    for i, row in enumerate(rows):
+        array[i, :len(row)] = row[:width]
+    return array
+
 def read_with_xlwings(wb, sheet_name, as_df=False):
     """
     Đọc dữ liệu từ một workbook object của xlwings đã được mở sẵn.
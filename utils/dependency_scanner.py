@@ -0,0 +1,133 @@
+# Đường dẫn: excel_toolkit/utils/dependency_scanner.py
+# Phiên bản 1.1 - Tách vòng stream công thức ô (iter_cell_formulas) để đồ thị tham chiếu dùng chung
+# Ngày cập nhật: 2026-10-17
+
+import re
+import xml.etree.ElementTree as ET
+from openpyxl.utils.cell import range_boundaries, get_column_letter, column_index_from_string
+from utils import ooxml_package
+
+NS_MAIN = ooxml_package.NS_MAIN
+_TAG_ROW = f"{{{NS_MAIN}}}row"
+_TAG_CELL = f"{{{NS_MAIN}}}c"
+_TAG_FORMULA = f"{{{NS_MAIN}}}f"
+_TAG_SHEET_DATA = f"{{{NS_MAIN}}}sheetData"
+
+# Tokenizer tham chiếu sheet trong công thức. Chuỗi "..." được khớp trước để bỏ qua nội dung bên trong.
+#   nhóm 1: tên trong nháy đơn    'Sheet 1'!A1, 'Q1:Q4'!A1, '[1]Data'!A1
+#   nhóm 2: tên không nháy        Sheet1!A1, Sheet1:Sheet3!A1, [1]Data!A1
+_SHEET_REF_RE = re.compile(
+    r'"(?:[^"]|"")*"'
+    r"|'((?:[^']|'')+)'!"
+    r"|((?:\[\d+\])?[^\s'\"!(),;=+\-*/^&<>{}\[\]:]+(?::[^\s'\"!(),;=+\-*/^&<>{}\[\]:]+)?)!"
+)
+_EXTERNAL_PREFIX_RE = re.compile(r"^\[\d+\]")
+_CELL_COLUMN_RE = re.compile(r"^\$?([A-Za-z]+)")
+
+# ======================================================================
+# --- Nhóm 1: Tokenizer ---
+# ======================================================================
+
+def build_lookup(sheet_names):
+    """Bảng tra không phân biệt hoa/thường (như Excel): tên đã casefold -> tên gốc."""
+    return {name.casefold(): name for name in sheet_names}
+
+def referenced_sheets(formula, lookup, sheet_order=None):
+    """
+    Trả về tập tên sheet (tên gốc trong `lookup`) mà công thức tham chiếu tới.
+    Tham chiếu 3D 'A:C'!X1 bao gồm cả các sheet nằm giữa A và C nếu biết `sheet_order`.
+    Tham chiếu sang workbook ngoài ([1]Sheet!A1) được bỏ qua.
+    """
+    found = set()
+    if '!' not in formula:
+        return found
+    for match in _SHEET_REF_RE.finditer(formula):
+        quoted, bare = match.group(1), match.group(2)
+        token = quoted.replace("''", "'") if quoted is not None else bare
+        if token is None or _EXTERNAL_PREFIX_RE.match(token):
+            continue
+        first, _, last = token.partition(':')
+        names = [first, last] if last else [first]
+        if last and sheet_order:
+            folded = [n.casefold() for n in sheet_order]
+            try:
+                i, j = sorted((folded.index(first.casefold()), folded.index(last.casefold())))
+                names = sheet_order[i:j + 1]
+            except ValueError:
+                pass
+        for name in names:
+            original = lookup.get(name.casefold())
+            if original:
+                found.add(original)
+    return found
+
+def expand_range(ref):
+    """'A1:B3' -> danh sách địa chỉ từng ô."""
+    min_col, min_row, max_col, max_row = range_boundaries(ref)
+    return [f"{get_column_letter(col)}{row}" for row in range(min_row, max_row + 1)
+            for col in range(min_col, max_col + 1)]
+
+# ======================================================================
+# --- Nhóm 2: Quét một sheet ---
+# ======================================================================
+
+def iter_cell_formulas(stream, on_element=None):
+    """
+    Stream một part worksheet, trả về lần lượt (công thức, danh sách địa chỉ ô) cho từng công thức ô.
+    - Công thức dùng chung (t="shared"): ô gốc mang nội dung, các ô khác chỉ có si; mỗi nhóm si
+      được trả về một lần (sau khi đọc hết sheet) với công thức gốc và toàn bộ ô trong nhóm.
+    - Công thức mảng (t="array"): trả về toàn bộ vùng ref để có thể thay cả khối.
+    - on_element(event, elem), nếu có, được gọi cho mọi phần tử nằm ngoài <sheetData> (validation,
+      định dạng có điều kiện, extLst...) để người gọi đọc thêm trong cùng một lượt stream.
+    Mỗi <row> được xoá khỏi cây ngay sau khi đọc nên bộ nhớ không tăng theo kích thước sheet.
+    """
+    shared_formulas = {}      # si -> công thức gốc
+    shared_cells = {}         # si -> [địa chỉ ô]
+    sheet_data = None
+    in_sheet_data = False
+    row_index, col_index = 0, 0
+    cell_ref = None
+
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == _TAG_CELL:
+                cell_ref = elem.get('r')
+                if cell_ref:
+                    col_index = column_index_from_string(_CELL_COLUMN_RE.match(cell_ref).group(1).upper())
+                else:
+                    # Thuộc tính r là tùy chọn: ô không có r nằm ngay sau ô trước đó
+                    col_index += 1
+                    cell_ref = f"{get_column_letter(col_index)}{row_index}"
+            elif tag == _TAG_ROW:
+                row_index = int(elem.get('r') or row_index + 1)
+                col_index = 0
+            elif tag == _TAG_SHEET_DATA:
+                sheet_data, in_sheet_data = elem, True
+            elif not in_sheet_data and on_element is not None:
+                on_element(event, elem)
+            continue
+
+        if not in_sheet_data:
+            if on_element is not None:
+                on_element(event, elem)
+        elif tag == _TAG_FORMULA:
+            formula = elem.text or ''
+            kind = elem.get('t')
+            if kind == 'shared':
+                si = elem.get('si')
+                shared_cells.setdefault(si, []).append(cell_ref)
+                if formula:
+                    shared_formulas[si] = formula
+            elif formula:
+                if kind == 'array' and elem.get('ref'):
+                    yield formula, expand_range(elem.get('ref'))
+                else:
+                    yield formula, [cell_ref]
+        elif tag == _TAG_ROW:
+            sheet_data.remove(elem)
+        elif tag == _TAG_SHEET_DATA:
+            in_sheet_data = False
+
+    for si, formula in shared_formulas.items():
+        yield formula, shared_cells.get(si, [])
@@ -0,0 +1,111 @@
+# Đường dẫn: excel_toolkit/utils/disk_cache.py
+# Phiên bản 1.0 - Cache trên đĩa theo nội dung, giới hạn dung lượng và loại bỏ theo LRU
+# Ngày cập nhật: 2026-10-17
+
+import hashlib
+import logging
+import os
+import tempfile
+
+DEFAULT_CACHE_ROOT = os.path.join(tempfile.gettempdir(), "excel_toolkit_cache")
+
+def content_hash(*parts):
+    """Băm SHA-256 nhiều mảnh dữ liệu (bytes hoặc str) thành một khóa hex."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+class DiskCache:
+    """
+    Cache key -> bytes lưu thành file trên đĩa, dùng chung được giữa nhiều tiến trình.
+
+    - Ghi nguyên tử (file tạm + os.replace) nên các worker có thể ghi đồng thời.
+    - Thời điểm truy cập được lưu vào mtime của file; khi vượt `max_bytes`
+      các mục ít được dùng gần đây nhất bị xóa trước (LRU).
+    - Đếm số lần trúng/trượt cache (hits/misses) của tiến trình hiện tại.
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._scan_size()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    yield entry
+
+    def _scan_size(self):
+        try:
+            return sum(entry.stat().st_size for entry in self._entries())
+        except OSError:
+            return 0
+
+    def get(self, key):
+        """Trả về bytes đã lưu hoặc None; đánh dấu mục vừa được dùng."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Lưu bytes vào cache rồi loại bỏ bớt mục cũ nếu vượt giới hạn."""
+        if len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Không thể ghi cache '{key}': {e}")
+            return False
+        self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+        return True
+
+    def evict(self, target_ratio=0.9):
+        """Xóa các mục ít được dùng gần đây nhất cho tới khi còn dưới target_ratio * max_bytes."""
+        try:
+            entries = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in self._entries()))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * target_ratio
+        removed = 0
+        for _, size, path in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        self._size = total
+        if removed:
+            logging.debug(f"Đã loại bỏ {removed} mục khỏi cache '{self.directory}'.")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,349 @@
+# Đường dẫn: excel_toolkit/utils/image_encoder.py
+# Phiên bản 1.6 - Ngưỡng SSIM tính ở độ phân giải gốc (tối đa SSIM_MAX_SIDE) thay vì thumbnail 256px
+# Ngày cập nhật: 2026-10-17
+
+import io
+import logging
+import os
+import numpy as np
+from PIL import Image
+from utils.disk_cache import DiskCache, DEFAULT_CACHE_ROOT, content_hash
+
+EMU_PER_INCH = 914400
+POINTS_PER_INCH = 72
+# DPI mục tiêu khi thu nhỏ ảnh về kích thước hiển thị (đủ nét cho in ấn văn phòng).
+DEFAULT_TARGET_DPI = 150
+
+# Tăng khi thay đổi cách nén để các kết quả cũ trong cache không còn được dùng.
+ENCODER_VERSION = 3
+
+# --- Encoder thích ứng ---
+# Các mức quality được thử cách nhau QUALITY_STEP: 13 mức từ 30..90 -> tìm nhị phân trong ~4 lần encode.
+MIN_JPEG_QUALITY = 30
+MAX_JPEG_QUALITY = 90
+QUALITY_STEP = 5
+# Độ tương đồng tối thiểu (SSIM trên ảnh xám ở độ phân giải gốc) so với ảnh gốc.
+DEFAULT_MIN_SSIM = 0.92
+# Cạnh dài nhất của ảnh xám dùng để tính SSIM: đủ lớn để giữ độ phân giải gốc của ảnh đã thu về
+# kích thước hiển thị (thumbnail nhỏ làm mờ và che mất nhiễu khối JPEG); chỉ ảnh lớn hơn mới bị thu nhỏ.
+SSIM_MAX_SIDE = 2048
+# Cạnh dài nhất của thumbnail dùng để chọn định dạng.
+FORMAT_PROBE_SIDE = 256
+_SSIM_BLOCK = 8
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Số tiến trình nén ảnh song song; dưới MIN_PARALLEL_ENCODES ảnh thì nén ngay trong tiến trình hiện tại.
+DEFAULT_ENCODE_WORKERS = max(1, os.cpu_count() or 1)
+MIN_PARALLEL_ENCODES = 4
+_encode_settings = {'workers': DEFAULT_ENCODE_WORKERS}
+
+_image_cache = None
+_image_cache_settings = {'directory': os.path.join(DEFAULT_CACHE_ROOT, "images"), 'max_bytes': IMAGE_CACHE_MAX_BYTES, 'enabled': True}
+
+# ======================================================================
+# --- Nhóm 1: Kích thước hiển thị ---
+# ======================================================================
+
+def target_size_from_points(width_pt, height_pt, dpi=DEFAULT_TARGET_DPI):
+    """Số pixel cần thiết để hiển thị một vùng width_pt x height_pt (point) ở `dpi`."""
+    if not width_pt or not height_pt or not dpi:
+        return None
+    return (max(1, round(width_pt / POINTS_PER_INCH * dpi)),
+            max(1, round(height_pt / POINTS_PER_INCH * dpi)))
+
+def target_size_from_emu(cx, cy, dpi=DEFAULT_TARGET_DPI):
+    """Số pixel cần thiết để hiển thị một vùng cx x cy (EMU, đơn vị của DrawingML) ở `dpi`."""
+    if not cx or not cy or not dpi:
+        return None
+    return (max(1, round(cx / EMU_PER_INCH * dpi)),
+            max(1, round(cy / EMU_PER_INCH * dpi)))
+
+def merge_target_sizes(current, new):
+    """Gộp hai kích thước mục tiêu của cùng một ảnh (được dùng nhiều nơi): lấy lớn nhất."""
+    if current is None:
+        return new
+    return (max(current[0], new[0]), max(current[1], new[1]))
+
+# ======================================================================
+# --- Nhóm 2: Resample ---
+# ======================================================================
+
+def downscale_to_target(img, target_size):
+    """
+    Thu nhỏ ảnh để không lớn hơn mức cần cho `target_size`, giữ nguyên tỉ lệ khung hình.
+    Ảnh không bao giờ bị phóng to; trả về chính ảnh gốc nếu không cần thu nhỏ.
+    """
+    if not target_size:
+        return img
+    width, height = img.size
+    # Giữ tỉ lệ: chọn hệ số lớn hơn để cả hai chiều đều đủ độ phân giải.
+    ratio = max(target_size[0] / width, target_size[1] / height)
+    if ratio >= 1:
+        return img
+    new_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    logging.debug(f"    -> Thu nhỏ ảnh {width}x{height} -> {new_size[0]}x{new_size[1]}.")
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    return img.resize(new_size, Image.Resampling.LANCZOS)
+
+# ======================================================================
+# --- Nhóm 3: Nén ảnh ---
+# ======================================================================
+
+def _has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+def _gray_array(img, max_side=SSIM_MAX_SIDE):
+    """Ảnh xám (thu nhỏ nếu cạnh dài > max_side) dưới dạng mảng float64."""
+    gray = img.convert('L')
+    if max(gray.size) > max_side:
+        gray = gray.copy()
+        gray.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    return np.asarray(gray, dtype=np.float64)
+
+def ssim(reference, candidate):
+    """
+    SSIM trung bình trên các khối 8x8 không chồng lấn giữa hai mảng xám cùng kích thước.
+    Tính bằng NumPy trên toàn ảnh nên vẫn chỉ tốn vài chục ms ở độ phân giải gốc.
+    """
+    h, w = reference.shape
+    bh, bw = h // _SSIM_BLOCK, w // _SSIM_BLOCK
+    if bh == 0 or bw == 0:
+        # Ảnh quá nhỏ để chia khối: coi cả ảnh là một khối
+        bh, bw, block_h, block_w = 1, 1, h, w
+    else:
+        block_h = block_w = _SSIM_BLOCK
+    shape = (bh, block_h, bw, block_w)
+    x = reference[:bh * block_h, :bw * block_w].reshape(shape)
+    y = candidate[:bh * block_h, :bw * block_w].reshape(shape)
+    mu_x, mu_y = x.mean(axis=(1, 3)), y.mean(axis=(1, 3))
+    var_x, var_y = x.var(axis=(1, 3)), y.var(axis=(1, 3))
+    cov = (x * y).mean(axis=(1, 3)) - mu_x * mu_y
+    score = ((2 * mu_x * mu_y + _SSIM_C1) * (2 * cov + _SSIM_C2)) / \
+            ((mu_x ** 2 + mu_y ** 2 + _SSIM_C1) * (var_x + var_y + _SSIM_C2))
+    return float(score.mean())
+
+def _encode_jpeg(img, quality, keep_dpi=None):
+    buffer = io.BytesIO()
+    kwargs = {'dpi': (keep_dpi, keep_dpi)} if keep_dpi else {}
+    img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True, **kwargs)
+    return buffer.getvalue()
+
+def _encode_palette_png(img, keep_dpi=None):
+    """PNG 256 màu (giữ kênh alpha nếu có)."""
+    kwargs = {'dpi': (keep_dpi, keep_dpi)} if keep_dpi else {}
+    buffer = io.BytesIO()
+    try:
+        if _has_alpha(img):
+            img_q = img.convert('RGBA').quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        else:
+            img_q = img.convert('RGB').quantize(colors=256)
+        img_q.save(buffer, format='PNG', optimize=True, **kwargs)
+    except Exception:
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', optimize=True, **kwargs)
+    return buffer.getvalue()
+
+def _decoded_gray(data, max_side=SSIM_MAX_SIDE):
+    with Image.open(io.BytesIO(data)) as decoded:
+        return _gray_array(decoded, max_side)
+
+def choose_format(img, quality=MAX_JPEG_QUALITY, min_ssim=DEFAULT_MIN_SSIM):
+    """
+    Chọn 'png' hoặc 'jpeg' bằng cách nén thử một thumbnail theo cả hai cách:
+    PNG bảng màu thắng nếu nhỏ hơn JPEG mà vẫn đạt ngưỡng SSIM (ảnh chụp màn hình,
+    biểu đồ, logo nhiều mảng màu phẳng); ảnh chụp thật thường nghiêng về JPEG.
+    """
+    if _has_alpha(img):
+        return 'png'
+    probe = img.convert('RGB')
+    if max(probe.size) > FORMAT_PROBE_SIDE:
+        probe.thumbnail((FORMAT_PROBE_SIDE, FORMAT_PROBE_SIDE), Image.Resampling.BILINEAR)
+    png_data = _encode_palette_png(probe)
+    jpeg_data = _encode_jpeg(probe, quality)
+    if len(png_data) > len(jpeg_data):
+        return 'jpeg'
+    reference = _gray_array(probe)
+    return 'png' if ssim(reference, _decoded_gray(png_data)) >= min_ssim else 'jpeg'
+
+def _search_jpeg_quality(img, max_bytes=None, max_quality=MAX_JPEG_QUALITY, min_ssim=DEFAULT_MIN_SSIM, keep_dpi=None):
+    """
+    Tìm nhị phân trên các mức quality (bước QUALITY_STEP):
+    - Có ngân sách: quality cao nhất có kích thước <= max_bytes.
+    - Không có ngân sách: quality thấp nhất vẫn đạt min_ssim.
+    Ngưỡng SSIM luôn được ưu tiên hơn ngân sách byte.
+    Trả về (bytes, quality, số lần encode).
+    """
+    max_quality = max(MIN_JPEG_QUALITY, min(100, max_quality))
+    levels = list(range(MIN_JPEG_QUALITY, max_quality, QUALITY_STEP)) + [max_quality]
+    reference = _gray_array(img) if min_ssim else None
+    results = {}
+
+    def encode(index):
+        if index not in results:
+            results[index] = _encode_jpeg(img, levels[index], keep_dpi)
+        return results[index]
+
+    def passes_floor(index):
+        return reference is None or ssim(reference, _decoded_gray(encode(index))) >= min_ssim
+
+    def lowest_passing(lo, hi):
+        # Mức thấp nhất trong [lo, hi] đạt ngưỡng SSIM (hi được coi là đạt)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if passes_floor(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return hi
+
+    top = len(levels) - 1
+    if max_bytes:
+        # Mức cao nhất nằm trong ngân sách
+        lo, hi = 0, top
+        if len(encode(top)) <= max_bytes:
+            best = top
+        elif len(encode(0)) > max_bytes:
+            best = 0
+        else:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if len(encode(mid)) <= max_bytes:
+                    lo = mid
+                else:
+                    hi = mid
+            best = lo
+        if not passes_floor(best):
+            best = lowest_passing(best + 1, top) if best < top else top
+    else:
+        best = lowest_passing(0, top)
+    return encode(best), levels[best], len(results)
+
+def encode_adaptive(img, max_bytes=None, max_quality=MAX_JPEG_QUALITY, min_ssim=DEFAULT_MIN_SSIM, mode='auto', keep_dpi=None):
+    """
+    Encoder dùng chung cho các engine: trả về (bytes, 'jpeg' | 'png').
+
+    - mode 'auto' chọn định dạng bằng choose_format (thumbnail), 'jpeg'/'png' ép định dạng.
+    - JPEG: tìm nhị phân quality (<= max_quality) để vừa `max_bytes` nếu có, và không bao
+      giờ thấp hơn mức đạt SSIM >= `min_ssim` so với ảnh gốc (None để tắt ngưỡng).
+    - PNG bảng màu vượt ngân sách trên ảnh không có alpha thì chuyển sang JPEG.
+    """
+    fmt = choose_format(img, max_quality, min_ssim or 0) if mode == 'auto' else mode
+    png_data = None
+    if fmt == 'png':
+        png_data = _encode_palette_png(img, keep_dpi)
+        if not max_bytes or len(png_data) <= max_bytes or _has_alpha(img):
+            return png_data, 'png'
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    data, quality, encodes = _search_jpeg_quality(img, max_bytes, max_quality, min_ssim, keep_dpi)
+    if png_data is not None and len(png_data) <= len(data):
+        # Không định dạng nào vừa ngân sách: giữ bản nhỏ hơn
+        return png_data, 'png'
+    logging.debug(f"    -> JPEG quality={quality} sau {encodes} lần encode ({len(data) / 1024:.1f}KB).")
+    return data, 'jpeg'
+
+def encode_image(img, quality=70, mode='auto', keep_dpi=96, target_size=None, max_bytes=None, min_ssim=DEFAULT_MIN_SSIM):
+    """
+    Thu nhỏ về `target_size` rồi nén một PIL.Image bằng encode_adaptive; trả về (bytes, 'jpeg' | 'png').
+    `quality` là mức trần: encoder hạ quality chừng nào ảnh còn đạt ngưỡng SSIM (hoặc vừa `max_bytes`).
+    """
+    return encode_adaptive(downscale_to_target(img, target_size), max_bytes=max_bytes, max_quality=quality,
+                           min_ssim=min_ssim, mode=mode, keep_dpi=keep_dpi)
+
+def encode_raw_image(mode, size, raw, quality=70, img_mode='auto', keep_dpi=96, target_size=None):
+    """
+    Như encode_image nhưng nhận pixel thô (mode, size, bytes) để truyền qua tiến trình
+    một cách rẻ và an toàn (không phụ thuộc vào lớp ImageFile gốc, ví dụ ảnh từ clipboard).
+    """
+    img = Image.frombytes(mode, size, raw)
+    return encode_image(img, quality=quality, mode=img_mode, keep_dpi=keep_dpi, target_size=target_size)
+
+def configure_encode_workers(workers):
+    """
+    Đặt số tiến trình nén ảnh tối đa của tiến trình hiện tại. Worker của batch_runner gọi hàm này
+    với phần CPU chia cho mỗi worker, để N worker không mở N x cpu_count tiến trình nén.
+    """
+    _encode_settings['workers'] = max(1, int(workers or DEFAULT_ENCODE_WORKERS))
+
+def encode_worker_count():
+    """Số tiến trình nén ảnh được phép dùng (1 nghĩa là nén tuần tự ngay trong tiến trình này)."""
+    return _encode_settings['workers']
+
+# ======================================================================
+# --- Nhóm 4: Cache ảnh đã nén ---
+# ======================================================================
+
+def configure_image_cache(directory=None, max_bytes=None, enabled=True):
+    """Thay đổi vị trí/giới hạn dung lượng của cache ảnh, hoặc tắt hẳn cache."""
+    global _image_cache
+    if directory:
+        _image_cache_settings['directory'] = directory
+    if max_bytes:
+        _image_cache_settings['max_bytes'] = max_bytes
+    _image_cache_settings['enabled'] = enabled
+    _image_cache = None
+
+def get_image_cache():
+    """Trả về DiskCache dùng chung của tiến trình (khởi tạo khi cần), hoặc None nếu đã tắt."""
+    global _image_cache
+    if not _image_cache_settings['enabled']:
+        return None
+    if _image_cache is None:
+        try:
+            _image_cache = DiskCache(_image_cache_settings['directory'], _image_cache_settings['max_bytes'])
+        except OSError as e:
+            logging.warning(f"Không thể khởi tạo cache ảnh, tiếp tục không dùng cache: {e}")
+            _image_cache_settings['enabled'] = False
+            return None
+    return _image_cache
+
+def image_cache_stats():
+    """Số lần trúng/trượt cache ảnh của tiến trình hiện tại."""
+    cache = _image_cache
+    return cache.stats() if cache else {'hits': 0, 'misses': 0}
+
+def image_cache_key(source, settings):
+    """Khóa cache của một ảnh: nội dung gốc + phiên bản encoder + thông số nén."""
+    return content_hash(source, f"v{ENCODER_VERSION}", repr(sorted(settings.items())))
+
+def cache_get(key):
+    """Tra cache theo khóa; trả về (bytes, phần mở rộng) hoặc None."""
+    cache = get_image_cache()
+    if cache is None:
+        return None
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    extension, _, payload = cached.partition(b"\0")
+    return payload, extension.decode('ascii')
+
+def cache_put(key, data, extension):
+    """Lưu kết quả nén vào cache (bỏ qua nếu cache đã tắt)."""
+    cache = get_image_cache()
+    if cache is not None and data is not None:
+        cache.put(key, extension.encode('ascii') + b"\0" + data)
+
+def cached_encode(source, settings, encode):
+    """
+    Nén một ảnh có dùng cache theo nội dung.
+
+    Tham số:
+        source (bytes): Dữ liệu định danh ảnh gốc (nội dung file hoặc pixel).
+        settings (dict): Các thông số nén; là một phần của khóa cache.
+        encode (callable): Hàm không tham số, trả về (bytes đã nén, phần mở rộng).
+
+    Trả về (bytes đã nén, phần mở rộng) như encode().
+    """
+    if get_image_cache() is None:
+        return encode()
+    key = image_cache_key(source, settings)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+    data, extension = encode()
+    cache_put(key, data, extension)
+    return data, extension
@@ -0,0 +1,200 @@
+# Đường dẫn: excel_toolkit/utils/offline_cleanup_ops.py
+# Phiên bản 1.1 - Nhận diện tham chiếu workbook ngoài chặt hơn, không nhầm với tham chiếu có cấu trúc của bảng
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import unescape
+from utils import ooxml_package, offline_range_ops
+
+REL_TYPE_EXTERNAL_LINK = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/externalLink"
+CORE_PROPERTIES_PART = "docProps/core.xml"
+APP_PROPERTIES_PART = "docProps/app.xml"
+
+# Name thiết lập in (so sánh casefold); luôn được giữ lại như bản COM.
+PRINT_NAMES = ('_xlnm.print_area', '_xlnm.print_titles')
+
+# Trường "tác giả" bị làm trống khi xóa thông tin cá nhân
+CORE_AUTHOR_FIELDS = (b'creator', b'lastModifiedBy')
+APP_AUTHOR_FIELDS = (b'Company', b'Manager')
+
+_EXTERNAL_REFERENCES_RE = re.compile(rb'<externalReferences\b[^>]*?(?:/>|>.*?</externalReferences>)', re.S)
+_DEFINED_NAMES_RE = re.compile(rb'<definedNames\b[^>]*?(?:/>|>(.*?)</definedNames>)', re.S)
+_DEFINED_NAME_RE = re.compile(rb'<definedName\b([^>]*?)(?:/>|>(.*?)</definedName>)', re.S)
+_ATTR_NAME_RE = re.compile(rb'\bname="([^"]*)"')
+# Tham chiếu sang workbook ngoài trong công thức: [1]Sheet1!A1, [1]Sheet1:Sheet3!A1, '[1]Sheet 1'!A1, [1]!Name.
+# Chỉ khớp khi sau [n] là tên sheet rồi đến '!' và trước [n] không phải tên bảng/cột, để không nhầm với
+# tham chiếu có cấu trúc như Table1[2019] hay Table1[[#Data],[2019]]. Byte >= 0x80 là ký tự UTF-8 của tên sheet.
+_EXTERNAL_REF_RE = re.compile(
+    rb"(?<![\w.\]\x80-\xff])"
+    rb"(?:(?:'|&apos;)\[\d+\](?:[^'&]|''|&(?!apos;)|&apos;&apos;)*(?:'|&apos;)!"
+    rb"|\[\d+\][\w.\x80-\xff]*(?::[\w.\x80-\xff]+)?!)")
+
+def _field_re(local_name):
+    """Khớp một phần tử theo tên cục bộ, với tiền tố namespace bất kỳ (dc:creator, cp:lastModifiedBy...)."""
+    return re.compile(rb'<((?:\w+:)?)' + local_name + rb'\b[^>]*?(?:/>|>.*?</\1' + local_name + rb'>)', re.S)
+
+# ======================================================================
+# --- Nhóm 1: Lập danh sách chỉnh sửa ---
+# ======================================================================
+
+def external_link_edits(zf, edits):
+    """
+    Thêm vào `edits` các thao tác bỏ liên kết ngoài: xóa xl/externalLinks/* cùng quan hệ
+    và content type, bỏ <externalReferences> và name trỏ ra ngoài trong workbook.xml, và
+    thay các công thức tham chiếu ra ngoài bằng giá trị cache (như BreakLink của Excel).
+    Trả về số liên kết đã bỏ.
+    """
+    names = zf.NameToInfo
+    workbook_part = ooxml_package.workbook_part_name(zf)
+    links = [rel['target'] for rel in ooxml_package.read_relationships(zf, workbook_part).values()
+             if rel['type'] == REL_TYPE_EXTERNAL_LINK and not rel['external']]
+    if not links:
+        return 0
+
+    for part in links:
+        edits[part] = None
+        link_rels = ooxml_package.rels_part_name(part)
+        if link_rels in names:
+            edits[link_rels] = None
+        ooxml_package.chain_edit(edits, ooxml_package.CONTENT_TYPES_PART,
+                                 lambda data, part=part: ooxml_package.remove_override(data, part))
+    rels_name = ooxml_package.rels_part_name(workbook_part)
+    ooxml_package.chain_edit(edits, rels_name, lambda data: ooxml_package.remove_relationships(data, rels_name, links))
+
+    def strip_workbook(data):
+        data = _EXTERNAL_REFERENCES_RE.sub(b'', data)
+        return _filter_defined_names(data, lambda name, formula: not _EXTERNAL_REF_RE.search(formula))
+    ooxml_package.chain_edit(edits, workbook_part, strip_workbook)
+
+    # Công thức tham chiếu ra ngoài được tìm và cố định ngay lúc ghi gói nên mỗi sheet chỉ đọc một lần
+    for sheet in ooxml_package.workbook_sheets(zf):
+        if sheet['part'] and sheet['part'] in names:
+            ooxml_package.chain_edit(edits, sheet['part'], lambda data, sheet_name=sheet['name']:
+                                     _freeze_external_formulas(data, sheet_name))
+    offline_range_ops.calc_chain_edits(zf, edits)
+    return len(links)
+
+def _freeze_external_formulas(sheet_xml, sheet_name):
+    addresses = offline_range_ops.find_formula_cells(sheet_xml, _EXTERNAL_REF_RE)
+    if not addresses:
+        return sheet_xml
+    logging.debug(f"  -> Sheet '{sheet_name}': cố định {len(addresses)} công thức tham chiếu ra ngoài.")
+    return offline_range_ops.freeze_sheet_xml(sheet_xml, addresses)[0]
+
+def _filter_defined_names(workbook_xml, keep):
+    """Giữ lại các <definedName> thỏa keep(tên, công thức); bỏ hẳn <definedNames> nếu không còn name nào."""
+    def replace_block(block):
+        def replace_name(match):
+            name = _ATTR_NAME_RE.search(match.group(1))
+            name = unescape(name.group(1).decode('utf-8')) if name else ''
+            return match.group(0) if keep(name, match.group(2) or b'') else b''
+        inner = _DEFINED_NAME_RE.sub(replace_name, block.group(1) or b'')
+        if not _DEFINED_NAME_RE.search(inner):
+            return b''
+        return block.group(0).replace(block.group(1), inner, 1)
+    return _DEFINED_NAMES_RE.sub(replace_block, workbook_xml)
+
+def defined_name_edits(zf, edits, keep=None):
+    """
+    Thêm vào `edits` thao tác xóa defined name trong workbook.xml, trừ name thiết lập in
+    và các name trong `keep` (tên casefold, ví dụ reference_graph.used_names()).
+    Trả về (số name sẽ xóa, số name giữ lại).
+    """
+    workbook_part = ooxml_package.workbook_part_name(zf)
+
+    def should_keep(name, formula=None):
+        folded = name.casefold()
+        return folded in PRINT_NAMES or bool(keep and folded in keep)
+
+    names = [unescape(attr.group(1).decode('utf-8')) for attr in
+             (_ATTR_NAME_RE.search(m.group(1)) for m in _DEFINED_NAME_RE.finditer(zf.read(workbook_part))) if attr]
+    kept = sum(1 for name in names if should_keep(name))
+    if kept < len(names):
+        ooxml_package.chain_edit(edits, workbook_part, lambda data: _filter_defined_names(data, should_keep))
+    return len(names) - kept, kept
+
+def personal_info_edits(zf, edits):
+    """
+    Thêm vào `edits` thao tác làm trống các trường tác giả trong docProps/core.xml
+    (người tạo, người sửa cuối) và docProps/app.xml (công ty, người quản lý).
+    Trả về số part bị sửa.
+    """
+    changed = 0
+    for part, fields in ((CORE_PROPERTIES_PART, CORE_AUTHOR_FIELDS), (APP_PROPERTIES_PART, APP_AUTHOR_FIELDS)):
+        if part not in zf.NameToInfo:
+            continue
+        def blank(data, fields=fields):
+            for field in fields:
+                data = _field_re(field).sub(lambda m, field=field: b'<' + m.group(1) + field + b'/>', data)
+            return data
+        ooxml_package.chain_edit(edits, part, blank)
+        changed += 1
+    return changed
+
+# ======================================================================
+# --- Nhóm 2: Thực thi ---
+# ======================================================================
+
+def clean_package(file_path, external_links=False, defined_names=False, personal_info=False,
+                  keep_names=None, output_path=None):
+    """
+    Chạy các thao tác dọn dẹp đã chọn trong một lần ghi lại gói zip (không cần Excel).
+
+    Tham số:
+        file_path (str): File .xlsx/.xlsm (không được mở trong Excel).
+        external_links (bool): Bỏ liên kết ngoài.
+        defined_names (bool): Xóa defined name (trừ thiết lập in và `keep_names`).
+        personal_info (bool): Làm trống thông tin tác giả.
+        keep_names (set, tùy chọn): Tên name (casefold) cần giữ lại.
+        output_path (str, tùy chọn): Ghi ra file khác thay vì ghi đè.
+    """
+    logging.info(f"Bắt đầu dọn dẹp (offline) cho file: {os.path.basename(file_path)}")
+    try:
+        edits = {}
+        with zipfile.ZipFile(file_path) as zf:
+            if external_links:
+                count = external_link_edits(zf, edits)
+                logging.info(f"Đã tìm thấy {count} liên kết ngoài." if count else "Không tìm thấy liên kết ngoài nào trong workbook.")
+            if defined_names:
+                deleted, kept = defined_name_edits(zf, edits, keep_names)
+                logging.info(f"Defined Names: sẽ xóa {deleted}, giữ lại {kept}.")
+            if personal_info:
+                personal_info_edits(zf, edits)
+
+        if not edits:
+            logging.info("Không có gì cần thay đổi.")
+            return True
+        ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        logging.info(f"Hoàn tất dọn dẹp (offline) cho file: {os.path.basename(file_path)}")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn dẹp (offline) file '{file_path}': {e}")
+        return False
+
+def delete_external_links(file_path, output_path=None):
+    """Bản offline của cleanup_ops.delete_external_links."""
+    return clean_package(file_path, external_links=True, output_path=output_path)
+
+def delete_defined_names(file_path, keep=None, output_path=None):
+    """Bản offline của cleanup_ops.delete_defined_names."""
+    return clean_package(file_path, defined_names=True, keep_names=keep, output_path=output_path)
+
+def remove_personal_info(file_path, output_path=None):
+    """Bản offline của cleanup_ops.remove_personal_info."""
+    return clean_package(file_path, personal_info=True, output_path=output_path)
+
+def clean_files(file_paths, max_workers=None, **options):
+    """
+    Chạy clean_package song song trên nhiều file (mỗi file một tiến trình, không cần Excel).
+    Trả về dict: đường dẫn -> True/False.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1 or len(file_paths) <= 1:
+        return {path: clean_package(path, **options) for path in file_paths}
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(file_paths))) as executor:
+        futures = {path: executor.submit(clean_package, path, **options) for path in file_paths}
+        return {path: future.result() for path, future in futures.items()}
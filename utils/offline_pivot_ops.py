@@ -0,0 +1,207 @@
+# Đường dẫn: excel_toolkit/utils/offline_pivot_ops.py
+# Phiên bản 1.0 - Bỏ pivotCacheRecords và gộp pivot cache trùng nguồn trực tiếp trên gói OOXML
+# Ngày cập nhật: 2026-10-17
+
+import hashlib
+import logging
+import os
+import re
+import zipfile
+from utils import ooxml_package
+
+REL_TYPE_PIVOT_CACHE_DEFINITION = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/pivotCacheDefinition"
+REL_TYPE_PIVOT_CACHE_RECORDS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/pivotCacheRecords"
+PIVOT_TABLES_DIR = "xl/pivotTables/"
+# Slicer/timeline tham chiếu pivot cache theo mã riêng nên không gộp cache khi workbook có chúng
+_SLICER_DIRS = ("xl/slicerCaches/", "xl/timelineCaches/")
+
+_PIVOT_CACHE_RE = re.compile(rb'<pivotCache\b[^>]*?/>')
+_EXT_PIVOT_CACHES_RE = re.compile(rb'<\w+:pivotCaches\b')
+_ATTR_CACHE_ID_RE = re.compile(rb'\bcacheId="(\d+)"')
+_ATTR_RID_RE = re.compile(rb'\s[\w]+:id="([^"]*)"')
+_ROOT_RE = re.compile(rb'<pivotCacheDefinition\b[^>]*?>')
+_CACHE_SOURCE_RE = re.compile(rb'<cacheSource\b[^>]*?(?:/>|>.*?</cacheSource>)', re.S)
+_CACHE_FIELDS_RE = re.compile(rb'<cacheFields\b[^>]*?(?:/>|>.*?</cacheFields>)', re.S)
+_OLAP_RE = re.compile(rb'<cacheHierarchies\b')
+
+def _set_root_attr(tag, name, value):
+    """Đặt thuộc tính `name` của thẻ mở `tag` (thêm mới nếu chưa có)."""
+    pattern = rb'\s' + name + rb'="[^"]*"'
+    new = b' ' + name + b'="' + value + b'"'
+    if re.search(pattern, tag):
+        return re.sub(pattern, lambda _: new, tag, count=1)
+    end = -2 if tag.endswith(b'/>') else -1
+    return tag[:end] + new + tag[end:]
+
+def _source_signature(definition_xml):
+    """Khóa so sánh nguồn của cache (cacheSource + cacheFields); None nếu không gộp được (OLAP...)."""
+    source = _CACHE_SOURCE_RE.search(definition_xml)
+    fields = _CACHE_FIELDS_RE.search(definition_xml)
+    if not source or not fields or _OLAP_RE.search(definition_xml):
+        return None
+    normalized = re.sub(rb'>\s+<', b'><', source.group(0) + fields.group(0))
+    return hashlib.sha256(normalized).hexdigest()
+
+def _part_size(zf, part):
+    info = zf.NameToInfo.get(part)
+    return info.compress_size if info else 0
+
+# ======================================================================
+# --- Nhóm 1: Phân tích ---
+# ======================================================================
+
+def list_pivot_caches(zf):
+    """
+    Danh sách pivot cache của workbook: dict {'cache_id', 'rid', 'definition', 'records', 'records_rid',
+    'signature'}. `records` là None nếu cache không lưu bản ghi.
+    """
+    workbook_part = ooxml_package.workbook_part_name(zf)
+    rels = ooxml_package.read_relationships(zf, workbook_part)
+    caches = []
+    for tag in _PIVOT_CACHE_RE.findall(zf.read(workbook_part)):
+        cache_id, rid = _ATTR_CACHE_ID_RE.search(tag), _ATTR_RID_RE.search(tag)
+        rel = rels.get(rid.group(1).decode('utf-8')) if rid else None
+        if not cache_id or not rel or rel['type'] != REL_TYPE_PIVOT_CACHE_DEFINITION or rel['target'] not in zf.NameToInfo:
+            continue
+        definition = rel['target']
+        records, records_rid = None, None
+        for record_rid, record_rel in ooxml_package.read_relationships(zf, definition).items():
+            if record_rel['type'] == REL_TYPE_PIVOT_CACHE_RECORDS and not record_rel['external']:
+                records, records_rid = record_rel['target'], record_rid
+        caches.append({
+            'cache_id': cache_id.group(1).decode('ascii'),
+            'rid': rid.group(1).decode('utf-8'),
+            'definition': definition,
+            'records': records if records in zf.NameToInfo else None,
+            'records_rid': records_rid,
+            'signature': _source_signature(zf.read(definition)),
+        })
+    return caches
+
+def pivot_tables_by_cache(zf):
+    """Ánh xạ part pivotCacheDefinition -> danh sách part pivotTable dùng nó."""
+    result = {}
+    for part in zf.namelist():
+        if part.startswith(PIVOT_TABLES_DIR) and part.endswith('.xml'):
+            for rel in ooxml_package.read_relationships(zf, part).values():
+                if rel['type'] == REL_TYPE_PIVOT_CACHE_DEFINITION and not rel['external']:
+                    result.setdefault(rel['target'], []).append(part)
+    return result
+
+# ======================================================================
+# --- Nhóm 2: Lập danh sách chỉnh sửa ---
+# ======================================================================
+
+def plan_pivot_caches(zf, edits, merge=True):
+    """
+    Thêm vào `edits` các thao tác:
+        - xóa pivotCacheRecords của mọi cache, bỏ quan hệ/content type tương ứng,
+          đặt saveData="0" và refreshOnLoad="1" trên cacheDefinition (Excel dựng lại khi mở file);
+        - (merge=True) gộp các cache có cùng nguồn và cùng danh sách trường: pivot table của
+          cache trùng được trỏ sang cache giữ lại, cache trùng bị xóa khỏi workbook.
+    Trả về danh sách {'cache_id', 'definition', 'merged_into', 'bytes'} (bytes: dung lượng nén giải phóng).
+    """
+    caches = list_pivot_caches(zf)
+    if not caches:
+        return []
+    workbook_part = ooxml_package.workbook_part_name(zf)
+    workbook_rels = ooxml_package.rels_part_name(workbook_part)
+
+    merged = {}
+    if merge:
+        blocked = any(name.startswith(_SLICER_DIRS) for name in zf.namelist()) or \
+                  _EXT_PIVOT_CACHES_RE.search(zf.read(workbook_part))
+        if blocked:
+            logging.info("Workbook có slicer/timeline hoặc pivot cache mở rộng: bỏ qua bước gộp cache.")
+        else:
+            first = {}
+            for cache in caches:
+                keeper = first.setdefault(cache['signature'], cache) if cache['signature'] else cache
+                if keeper is not cache:
+                    merged[cache['definition']] = keeper
+
+    report = []
+    tables = pivot_tables_by_cache(zf)
+    removed_ids = set()
+    for cache in caches:
+        definition = cache['definition']
+        keeper = merged.get(definition)
+        removed = [cache['records']] if cache['records'] else []
+        if keeper:
+            removed += [definition, ooxml_package.rels_part_name(definition)]
+            removed_ids.add(cache['cache_id'])
+            for table in tables.get(definition, []):
+                table_rels = ooxml_package.rels_part_name(table)
+                ooxml_package.chain_edit(edits, table_rels, lambda data, name=table_rels, mapping={definition: keeper['definition']}:
+                                         ooxml_package.rewrite_relationship_targets(data, name, mapping))
+                ooxml_package.chain_edit(edits, table, lambda data, cache_id=keeper['cache_id'].encode('ascii'):
+                                         _ATTR_CACHE_ID_RE.sub(b'cacheId="' + cache_id + b'"', data, count=1))
+            ooxml_package.chain_edit(edits, workbook_rels, lambda data, definition=definition:
+                                     ooxml_package.remove_relationships(data, workbook_rels, [definition]))
+        elif cache['records']:
+            definition_rels = ooxml_package.rels_part_name(definition)
+            ooxml_package.chain_edit(edits, definition_rels, lambda data, name=definition_rels, records=cache['records']:
+                                     ooxml_package.remove_relationships(data, name, [records]))
+        if not keeper:
+            ooxml_package.chain_edit(edits, definition, lambda data, rid=cache['records_rid']: _strip_definition(data, rid))
+
+        removed = [part for part in removed if part in zf.NameToInfo]
+        for part in removed:
+            edits[part] = None
+            ooxml_package.chain_edit(edits, ooxml_package.CONTENT_TYPES_PART,
+                                     lambda data, part=part: ooxml_package.remove_override(data, part))
+        report.append({'cache_id': cache['cache_id'], 'definition': definition,
+                       'merged_into': keeper['cache_id'] if keeper else None,
+                       'bytes': sum(_part_size(zf, part) for part in removed)})
+
+    if removed_ids:
+        def drop_caches(data):
+            def replace(match):
+                cache_id = _ATTR_CACHE_ID_RE.search(match.group(0))
+                return b'' if cache_id and cache_id.group(1).decode('ascii') in removed_ids else match.group(0)
+            return _PIVOT_CACHE_RE.sub(replace, data)
+        ooxml_package.chain_edit(edits, workbook_part, drop_caches)
+    return report
+
+def _strip_definition(definition_xml, records_rid):
+    """Bỏ r:id trỏ tới records và đặt saveData="0", refreshOnLoad="1" trên thẻ gốc."""
+    def replace(match):
+        tag = match.group(0)
+        if records_rid:
+            tag = _ATTR_RID_RE.sub(lambda m: b'' if m.group(1).decode('utf-8') == records_rid else m.group(0), tag)
+        tag = _set_root_attr(tag, b'saveData', b'0')
+        return _set_root_attr(tag, b'refreshOnLoad', b'1')
+    return _ROOT_RE.sub(replace, definition_xml, count=1)
+
+def log_pivot_report(report):
+    """Ghi log dung lượng giải phóng theo từng cache."""
+    if not report:
+        logging.info("Không tìm thấy Pivot Table cache nào trong workbook.")
+        return
+    for entry in report:
+        merged = f", gộp vào cache {entry['merged_into']}" if entry['merged_into'] else ""
+        logging.info(f"  -> Cache {entry['cache_id']} ({os.path.basename(entry['definition'])}){merged}: "
+                     f"giải phóng {entry['bytes'] / 1024:.1f} KB.")
+    logging.info(f"Tổng cộng giải phóng {sum(e['bytes'] for e in report) / 1024:.1f} KB từ {len(report)} pivot cache.")
+
+# ======================================================================
+# --- Nhóm 3: Thực thi ---
+# ======================================================================
+
+def clean_pivot_caches(file_path, merge=True, output_path=None):
+    """
+    Bản offline của cleanup_ops.refresh_and_clean_pivot_caches: không làm mới qua COM mà
+    bỏ bản ghi cache và đánh dấu làm mới khi mở file (xem plan_pivot_caches).
+    """
+    logging.info(f"Bắt đầu dọn dẹp Pivot Table caches (offline) cho file: {os.path.basename(file_path)}")
+    try:
+        edits = {}
+        with zipfile.ZipFile(file_path) as zf:
+            report = plan_pivot_caches(zf, edits, merge)
+        if edits:
+            ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        log_pivot_report(report)
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi dọn dẹp Pivot Table caches (offline) cho file '{file_path}': {e}")
+        return False
@@ -0,0 +1,157 @@
+# Đường dẫn: excel_toolkit/utils/offline_range_ops.py
+# Phiên bản 1.1 - Thêm find_formula_cells và calc_chain_edits dùng chung cho các thao tác offline
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import re
+import zipfile
+from utils import ooxml_package
+
+CALC_CHAIN_PART = "xl/calcChain.xml"
+
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(/>|>(.*?)</c>)', re.S)
+_ATTR_R_RE = re.compile(rb'\br="([^"]+)"')
+_ATTR_T_RE = re.compile(rb'\bt="([^"]*)"')
+_FORMULA_RE = re.compile(rb'<f\b[^>]*?(?:/>|>.*?</f>)', re.S)
+_FORMULA_ATTRS_RE = re.compile(rb'<f\b([^>]*?)(?:/>|>)')
+_ATTR_SI_RE = re.compile(rb'\bsi="([^"]*)"')
+_VALUE_RE = re.compile(rb'<v>(.*?)</v>', re.S)
+_FORMULA_TEXT_RE = re.compile(rb'<f\b[^>]*?(?<!/)>(.*?)</f>', re.S)
+
+# ======================================================================
+# --- Nhóm 1: Cố định công thức ---
+# ======================================================================
+
+def _shared_groups(sheet_xml, addresses):
+    """Các si của nhóm công thức dùng chung có ít nhất một ô nằm trong `addresses`."""
+    groups = set()
+    for match in _CELL_RE.finditer(sheet_xml):
+        r = _ATTR_R_RE.search(match.group(1))
+        body = match.group(3)
+        if not r or not body or r.group(1).replace(b'$', b'') not in addresses:
+            continue
+        f_attrs = _FORMULA_ATTRS_RE.search(body)
+        if f_attrs and b't="shared"' in f_attrs.group(1):
+            si = _ATTR_SI_RE.search(f_attrs.group(1))
+            if si:
+                groups.add(si.group(1))
+    return groups
+
+def freeze_sheet_xml(sheet_xml, addresses):
+    """
+    Bỏ phần tử <f> của các ô trong `addresses` (bytes, ví dụ b'A1'), giữ lại giá trị cache <v>.
+    Nếu một ô thuộc nhóm công thức dùng chung thì cả nhóm được cố định, vì các ô còn lại
+    của nhóm chỉ trỏ về công thức gốc qua si.
+    Ô kiểu t="str" (chuỗi kết quả công thức) được chuyển thành chuỗi inline.
+    Trả về (xml mới, số ô đã cố định, số ô không có giá trị cache).
+    """
+    groups = _shared_groups(sheet_xml, addresses)
+    frozen, missing = 0, 0
+
+    def replace(match):
+        nonlocal frozen, missing
+        attrs, body = match.group(1), match.group(3)
+        if not body or b'<f' not in body:
+            return match.group(0)
+        r = _ATTR_R_RE.search(attrs)
+        in_set = r is not None and r.group(1).replace(b'$', b'') in addresses
+        if not in_set and groups:
+            f_attrs = _FORMULA_ATTRS_RE.search(body)
+            si = _ATTR_SI_RE.search(f_attrs.group(1)) if f_attrs and b't="shared"' in f_attrs.group(1) else None
+            in_set = si is not None and si.group(1) in groups
+        if not in_set:
+            return match.group(0)
+
+        frozen += 1
+        body = _FORMULA_RE.sub(b'', body, count=1)
+        value = _VALUE_RE.search(body)
+        if value is None:
+            missing += 1
+        t = _ATTR_T_RE.search(attrs)
+        if t and t.group(1) == b'str':
+            # t="str" chỉ hợp lệ cho ô có công thức -> chuyển sang inlineStr
+            attrs = _ATTR_T_RE.sub(b't="inlineStr"', attrs, count=1)
+            text = value.group(1) if value else b''
+            body = _VALUE_RE.sub(lambda _: b'<is><t xml:space="preserve">' + text + b'</t></is>', body, count=1)
+        if not body.strip():
+            return b'<c' + attrs + b'/>'
+        return b'<c' + attrs + b'>' + body + b'</c>'
+
+    return _CELL_RE.sub(replace, sheet_xml), frozen, missing
+
+def find_formula_cells(sheet_xml, pattern):
+    """
+    Địa chỉ (bytes, không có '$') của các ô có nội dung công thức khớp `pattern` (regex bytes).
+    Với công thức dùng chung chỉ ô gốc mang nội dung; freeze_sheet_xml tự mở rộng ra cả nhóm.
+    """
+    found = set()
+    for match in _CELL_RE.finditer(sheet_xml):
+        body = match.group(3)
+        if not body or b'<f' not in body:
+            continue
+        formula = _FORMULA_TEXT_RE.search(body)
+        r = _ATTR_R_RE.search(match.group(1))
+        if formula and r and pattern.search(formula.group(1)):
+            found.add(r.group(1).replace(b'$', b''))
+    return found
+
+def calc_chain_edits(zf, edits):
+    """
+    Thêm vào `edits` các thao tác bỏ xl/calcChain.xml (part, quan hệ và content type).
+    Cần làm mỗi khi công thức bị bỏ vì calcChain liệt kê các ô công thức cũ; Excel tự tạo lại.
+    """
+    names = zf.NameToInfo
+    if CALC_CHAIN_PART not in names:
+        return
+    edits[CALC_CHAIN_PART] = None
+    rels_name = ooxml_package.rels_part_name(ooxml_package.workbook_part_name(zf))
+    if rels_name in names:
+        ooxml_package.chain_edit(edits, rels_name, lambda data: ooxml_package.remove_relationships(
+            data, rels_name, [CALC_CHAIN_PART]))
+    ooxml_package.chain_edit(edits, ooxml_package.CONTENT_TYPES_PART,
+                             lambda data: ooxml_package.remove_override(data, CALC_CHAIN_PART))
+
+def freeze_formulas(file_path, dependencies, output_path=None):
+    """
+    Bản offline của range_ops.freeze_formulas: ghi thẳng vào XML của sheet.
+
+    Tham số:
+        file_path (str): File .xlsx/.xlsm (không được mở trong Excel).
+        dependencies (dict): Tên sheet -> danh sách địa chỉ ô cần cố định.
+        output_path (str, tùy chọn): Ghi ra file khác thay vì ghi đè.
+
+    xl/calcChain.xml bị loại bỏ (Excel tự tạo lại) vì nó liệt kê các ô công thức cũ.
+    """
+    logging.info(f"Bắt đầu cố định công thức (offline) cho {sum(len(v) for v in dependencies.values())} ô.")
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            parts = {s['name']: s['part'] for s in ooxml_package.workbook_sheets(zf)}
+            names = set(zf.namelist())
+            edits, total, missing_total = {}, 0, 0
+            for sheet_name, addresses in dependencies.items():
+                part = parts.get(sheet_name)
+                if not part or part not in names:
+                    logging.warning(f"Không tìm thấy sheet '{sheet_name}' trong gói. Bỏ qua.")
+                    continue
+                wanted = {a.replace('$', '').upper().encode('ascii') for a in addresses}
+                new_xml, frozen, missing = freeze_sheet_xml(zf.read(part), wanted)
+                if frozen:
+                    edits[part] = new_xml
+                    total += frozen
+                    missing_total += missing
+                    logging.debug(f"  -> Sheet '{sheet_name}': đã cố định {frozen} ô.")
+
+            if not edits:
+                logging.info("Không có công thức nào cần cố định.")
+                return True
+
+            calc_chain_edits(zf, edits)
+
+        ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        if missing_total:
+            logging.warning(f"{missing_total} ô không có giá trị cache (file chưa từng được tính toán) nên sẽ trống.")
+        logging.info(f"Hoàn tất cố định công thức (offline): {total} ô.")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi cố định công thức (offline) cho file '{file_path}': {e}")
+        return False
@@ -0,0 +1,136 @@
+# Đường dẫn: excel_toolkit/utils/offline_repack_ops.py
+# Phiên bản 1.0 - Đóng gói lại file: bỏ part tái tạo được, nén lại mọi part ở mức cao nhất, kiểm tra trước khi thay
+# Ngày cập nhật: 2026-10-17
+
+import fnmatch
+import logging
+import os
+import re
+import zipfile
+import openpyxl
+from utils import ooxml_package
+
+# Part Excel tự tạo lại được (hoặc không cần cho nội dung); mẫu fnmatch trên tên part
+DEFAULT_DROP_PATTERNS = (
+    "docProps/thumbnail.*",
+    "xl/calcChain.xml",
+    "customXml/*",
+    "xl/printerSettings/*",
+)
+BEST_COMPRESSLEVEL = 9
+
+def _matches(part, patterns):
+    return any(fnmatch.fnmatchcase(part, pattern) for pattern in patterns)
+
+def _strip_rids(rids):
+    """Biến đổi bỏ thuộc tính r:id trỏ tới các rId đã xóa (vd. <pageSetup r:id=...>); chỉ nhìn trong từng thẻ."""
+    pattern = re.compile(rb'(<[^<>]*?)\s[\w]+:id="(?:' + b'|'.join(re.escape(r.encode('utf-8')) for r in rids) + rb')"')
+    return lambda data: pattern.sub(rb'\1', data)
+
+# ======================================================================
+# --- Nhóm 1: Lập danh sách chỉnh sửa ---
+# ======================================================================
+
+def plan_repack(zf, edits, drop_patterns=DEFAULT_DROP_PATTERNS):
+    """
+    Thêm vào `edits` thao tác xóa các part khớp `drop_patterns`, kèm quan hệ trỏ tới chúng,
+    content type override và thuộc tính r:id còn tham chiếu trong part nguồn (xử lý theo luồng).
+    Trả về danh sách part sẽ xóa.
+    """
+    dropped = [name for name in zf.namelist() if _matches(name, drop_patterns)
+               and name != ooxml_package.CONTENT_TYPES_PART and not name.endswith('.rels')]
+    if not dropped:
+        return []
+    targets = set(dropped)
+    for name in dropped:
+        edits[name] = None
+        rels_name = ooxml_package.rels_part_name(name)
+        if rels_name in zf.NameToInfo:
+            edits[rels_name] = None
+        ooxml_package.chain_edit(edits, ooxml_package.CONTENT_TYPES_PART,
+                                 lambda data, name=name: ooxml_package.remove_override(data, name))
+
+    for rels_name in zf.namelist():
+        if not rels_name.endswith('.rels') or rels_name in edits:
+            continue
+        source = ooxml_package.source_part_name(rels_name)
+        rids = [rid for rid, rel in ooxml_package.read_relationships(zf, source).items()
+                if not rel['external'] and rel['target'] in targets]
+        if not rids:
+            continue
+        ooxml_package.chain_edit(edits, rels_name, lambda data, name=rels_name:
+                                 ooxml_package.remove_relationships(data, name, targets))
+        if source in zf.NameToInfo and source not in edits:
+            edits[source] = ooxml_package.StreamEdit(_strip_rids(rids))
+    return dropped
+
+# ======================================================================
+# --- Nhóm 2: Kiểm tra ---
+# ======================================================================
+
+def _open_error(file_path):
+    """None nếu openpyxl mở được file (chế độ chỉ đọc), ngược lại là lỗi gặp phải."""
+    try:
+        # Mở qua file object vì openpyxl kiểm tra phần mở rộng (file tạm có đuôi .tmp)
+        with open(file_path, 'rb') as f:
+            openpyxl.load_workbook(f, read_only=True).close()
+        return None
+    except Exception as e:
+        return e
+
+def verify_package(file_path, dropped=(), original_path=None):
+    """
+    Kiểm tra file sau khi đóng gói lại: CRC mọi part, [Content_Types].xml và workbook đọc được,
+    không còn quan hệ nào trỏ tới part đã xóa, và openpyxl mở lại được (nếu file gốc mở được).
+    """
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            broken = zf.testzip()
+            if broken:
+                logging.error(f"Part bị hỏng sau khi đóng gói lại: {broken}")
+                return False
+            ooxml_package.parse_content_types(zf.read(ooxml_package.CONTENT_TYPES_PART))
+            ooxml_package.workbook_sheets(zf)
+            dropped = set(dropped)
+            for rels_name in (n for n in zf.namelist() if n.endswith('.rels')):
+                source = ooxml_package.source_part_name(rels_name)
+                for rel in ooxml_package.read_relationships(zf, source).values():
+                    if not rel['external'] and rel['target'] in dropped:
+                        logging.error(f"'{rels_name}' vẫn trỏ tới part đã xóa: {rel['target']}")
+                        return False
+    except Exception as e:
+        logging.error(f"Không đọc lại được gói sau khi đóng gói lại: {e}")
+        return False
+
+    error = _open_error(file_path)
+    if error is not None and (original_path is None or _open_error(original_path) is None):
+        logging.error(f"Không mở lại được file sau khi đóng gói lại: {error}")
+        return False
+    return True
+
+# ======================================================================
+# --- Nhóm 3: Thực thi ---
+# ======================================================================
+
+def repack(file_path, drop_patterns=DEFAULT_DROP_PATTERNS, output_path=None, compresslevel=BEST_COMPRESSLEVEL):
+    """
+    Đóng gói lại file .xlsx/.xlsm: bỏ các part tái tạo được (`drop_patterns`), nén lại mọi part
+    ở `compresslevel`, chép/biến đổi part theo luồng để giới hạn bộ nhớ. File đích chỉ bị thay
+    khi bản mới vượt qua verify_package. File không được mở trong Excel.
+    """
+    logging.info(f"Bắt đầu đóng gói lại file: {os.path.basename(file_path)}")
+    try:
+        size_before = os.path.getsize(file_path)
+        edits = {}
+        with zipfile.ZipFile(file_path) as zf:
+            dropped = plan_repack(zf, edits, drop_patterns)
+        for part in dropped:
+            logging.debug(f"  -> Bỏ part: {part}")
+        ooxml_package.rewrite_package(file_path, edits, output_path=output_path, compresslevel=compresslevel,
+                                      verify=lambda path: verify_package(path, dropped, file_path))
+        size_after = os.path.getsize(output_path or file_path)
+        logging.info(f"Đã đóng gói lại (bỏ {len(dropped)} part): {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB.")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi đóng gói lại file '{file_path}': {e}")
+        return False
@@ -0,0 +1,162 @@
+# Đường dẫn: excel_toolkit/utils/offline_shared_strings_ops.py
+# Phiên bản 1.0 - Thu gọn bảng shared strings: bỏ chuỗi không dùng, gộp chuỗi trùng, đánh lại chỉ số
+# Ngày cập nhật: 2026-10-17
+
+import hashlib
+import logging
+import os
+import re
+import zipfile
+from array import array
+from utils import ooxml_package
+
+REL_TYPE_SHARED_STRINGS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+
+# Ô dùng shared string: <c ... t="s" ...><v>chỉ số</v></c>
+_SST_CELL_RE = re.compile(rb'(<c\b[^>]*?\bt="s"[^>]*>\s*<v>)(\d+)(</v>)')
+_SI_RE = re.compile(rb'<si\b[^>]*?(?:/>|>.*?</si>)', re.S)
+_SST_HEADER_RE = re.compile(rb'<sst\b[^>]*>')
+
+def shared_strings_part_name(zf):
+    """Tên part shared strings của workbook, hoặc None nếu workbook không có."""
+    for rel in ooxml_package.read_relationships(zf, ooxml_package.workbook_part_name(zf)).values():
+        if rel['type'] == REL_TYPE_SHARED_STRINGS and not rel['external'] and rel['target'] in zf.NameToInfo:
+            return rel['target']
+    return None
+
+def _set_count(tag, name, value):
+    pattern = rb'\s' + name + rb'="\d*"'
+    new = b' ' + name + b'="' + str(value).encode('ascii') + b'"'
+    if re.search(pattern, tag):
+        return re.sub(pattern, lambda _: new, tag, count=1)
+    return tag[:-1] + new + b'>'
+
+# ======================================================================
+# --- Nhóm 1: Phân tích (đọc theo luồng, bộ nhớ cố định theo số chuỗi) ---
+# ======================================================================
+
+def _scan_used(zf, sheet_parts):
+    """
+    Đọc lần lượt các sheet theo luồng và đánh dấu chỉ số shared string đang dùng.
+    Trả về (bytearray đánh dấu theo chỉ số, tổng số ô kiểu shared string).
+    """
+    used = bytearray()
+    cells = 0
+    for part in sheet_parts:
+        with zf.open(part) as f:
+            for segment in ooxml_package.iter_segments(f, b'</c>'):
+                for match in _SST_CELL_RE.finditer(segment):
+                    index = int(match.group(2))
+                    if index >= len(used):
+                        used.extend(bytes(index + 1 - len(used)))
+                    used[index] = 1
+                    cells += 1
+    return used, cells
+
+def _build_remap(zf, sst_part, used):
+    """
+    Đọc bảng shared strings theo luồng, gộp các <si> giống hệt nhau (so sánh theo băm) trong số
+    các chuỗi đang dùng. Trả về (remap: chỉ số cũ -> mới, keep: đánh dấu <si> được giữ,
+    số chuỗi sau khi thu gọn, số chuỗi ban đầu).
+    """
+    remap = array('l', [-1]) * len(used)
+    keep = bytearray(len(used))
+    seen = {}
+    index = 0
+    with zf.open(sst_part) as f:
+        for segment in ooxml_package.iter_segments(f, b'</si>'):
+            for match in _SI_RE.finditer(segment):
+                if index < len(used) and used[index]:
+                    key = hashlib.blake2b(match.group(0), digest_size=16).digest()
+                    new_index = seen.get(key)
+                    if new_index is None:
+                        new_index = seen[key] = len(seen)
+                        keep[index] = 1
+                    remap[index] = new_index
+                index += 1
+    return remap, keep, len(seen), index
+
+# ======================================================================
+# --- Nhóm 2: Lập danh sách chỉnh sửa ---
+# ======================================================================
+
+def _sst_writer(keep, cells, unique_count):
+    """Biến đổi theo luồng cho sharedStrings.xml: chỉ giữ <si> được đánh dấu, cập nhật count/uniqueCount."""
+    position = [0]
+
+    def transform(segment):
+        def replace(match):
+            index = position[0]
+            position[0] += 1
+            return match.group(0) if index < len(keep) and keep[index] else b''
+        segment = _SI_RE.sub(replace, segment)
+        return _SST_HEADER_RE.sub(lambda m: _set_count(_set_count(m.group(0), b'count', cells),
+                                                       b'uniqueCount', unique_count), segment, count=1)
+    return transform
+
+def _cell_remapper(remap):
+    """Biến đổi theo luồng cho sheet: đổi <v> của ô t="s" theo bảng `remap`."""
+    def transform(segment):
+        return _SST_CELL_RE.sub(lambda m: m.group(1) + str(remap[int(m.group(2))]).encode('ascii') + m.group(3), segment)
+    return transform
+
+def _add_stream_edit(edits, part, transform, end_tag):
+    if part in edits:
+        ooxml_package.chain_edit(edits, part, transform)
+    else:
+        edits[part] = ooxml_package.StreamEdit(transform, end_tag)
+
+def plan_compact_shared_strings(zf, edits):
+    """
+    Thêm vào `edits` thao tác thu gọn xl/sharedStrings.xml: bỏ chuỗi không ô nào dùng, gộp các
+    chuỗi trùng (kể cả định dạng rich text) và đánh lại chỉ số trong mọi ô t="s".
+    Mọi part được đọc/ghi theo luồng; bảng dịch chỉ số là mảng số nguyên (array), không tạo
+    đối tượng Python cho từng ô.
+    Trả về dict {'before', 'after', 'unused', 'duplicates'} hoặc None nếu không có gì để làm.
+    """
+    sst_part = shared_strings_part_name(zf)
+    if not sst_part:
+        return None
+    sheet_parts = [s['part'] for s in ooxml_package.workbook_sheets(zf) if s['part'] and s['part'] in zf.NameToInfo]
+    used, cells = _scan_used(zf, sheet_parts)
+    remap, keep, unique_count, total = _build_remap(zf, sst_part, used)
+    if len(used) > total:
+        logging.warning(f"Có ô tham chiếu shared string không tồn tại (chỉ số {len(used) - 1}/{total}), bỏ qua thu gọn.")
+        return None
+    used_count = sum(used)
+    stats = {'before': total, 'after': unique_count, 'unused': total - used_count, 'duplicates': used_count - unique_count}
+    if unique_count == total:
+        return stats
+
+    _add_stream_edit(edits, sst_part, _sst_writer(keep, cells, unique_count), b'</si>')
+    # Kể cả khi chỉ bỏ chuỗi không dùng, các chuỗi phía sau bị dồn lên nên mọi sheet cần đánh lại chỉ số
+    for part in sheet_parts:
+        _add_stream_edit(edits, part, _cell_remapper(remap), b'</c>')
+    return stats
+
+def log_shared_strings_stats(stats):
+    """Ghi log tổng kết của plan_compact_shared_strings."""
+    if not stats:
+        logging.info("Không có bảng shared strings cần thu gọn.")
+        return
+    logging.info(f"Shared strings: {stats['before']} -> {stats['after']} "
+                 f"(bỏ {stats['unused']} chuỗi không dùng, gộp {stats['duplicates']} chuỗi trùng).")
+
+# ======================================================================
+# --- Nhóm 3: Thực thi ---
+# ======================================================================
+
+def compact_shared_strings(file_path, output_path=None):
+    """Thu gọn bảng shared strings của file (xem plan_compact_shared_strings). File không được mở trong Excel."""
+    logging.info(f"Bắt đầu thu gọn shared strings (offline) cho file: {os.path.basename(file_path)}")
+    try:
+        edits = {}
+        with zipfile.ZipFile(file_path) as zf:
+            stats = plan_compact_shared_strings(zf, edits)
+        if edits:
+            ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        log_shared_strings_stats(stats)
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi thu gọn shared strings (offline) cho file '{file_path}': {e}")
+        return False
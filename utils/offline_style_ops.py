@@ -0,0 +1,343 @@
+# Đường dẫn: excel_toolkit/utils/offline_style_ops.py
+# Phiên bản 1.0 - Cắt định dạng thừa ngoài vùng dữ liệu và thu gọn styles.xml trực tiếp trên gói OOXML
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import os
+import re
+import zipfile
+from openpyxl.utils.cell import get_column_letter, column_index_from_string
+from utils import ooxml_package
+
+REL_TYPE_STYLES = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+DEFAULT_STYLES_PART = "xl/styles.xml"
+
+# Phần tử gốc luôn được giữ ở đầu danh sách (Excel yêu cầu): font/border 0, fill 0 (none) và 1 (gray125)
+_RESERVED = {'font': 1, 'fill': 2, 'border': 1, 'xf': 1}
+
+_ROW_RE = re.compile(rb'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_COLS_RE = re.compile(rb'<cols>(.*?)</cols>', re.S)
+_COL_RE = re.compile(rb'<col\b([^>]*?)/>')
+_DIMENSION_RE = re.compile(rb'<dimension\b[^>]*?/>')
+_MERGE_REF_RE = re.compile(rb'<mergeCell\b[^>]*?\bref="([^"]+)"')
+_ATTR_R_RE = re.compile(rb'\br="([^"]+)"')
+_ATTR_S_RE = re.compile(rb'\s\bs="(\d+)"')
+_ATTR_STYLE_RE = re.compile(rb'\s\bstyle="(\d+)"')
+_ATTR_MIN_RE = re.compile(rb'\bmin="(\d+)"')
+_CUSTOM_FORMAT_RE = re.compile(rb'\s\bcustomFormat="[^"]*"')
+_CELL_REF_RE = re.compile(rb'^\$?([A-Za-z]+)\$?(\d+)$')
+_DATA_RE = re.compile(rb'<(?:v|f|is)\b')
+# Thuộc tính làm hàng/cột vẫn có ý nghĩa khi không còn định dạng (chiều cao/rộng, ẩn, outline)
+_ROW_KEEP_RE = re.compile(rb'\b(?:customHeight|hidden|outlineLevel|collapsed|thickTop|thickBot)="(?:1|true)"')
+_COL_KEEP_RE = re.compile(rb'\b(?:customWidth|hidden|outlineLevel|collapsed)="(?:1|true)"')
+
+def _cell_position(ref):
+    match = _CELL_REF_RE.match(ref)
+    if not match:
+        return None
+    return int(match.group(2)), column_index_from_string(match.group(1).decode('ascii').upper())
+
+# ======================================================================
+# --- Nhóm 1: Vùng dữ liệu thật & cắt định dạng thừa ---
+# ======================================================================
+
+def data_extent(sheet_xml):
+    """
+    Vùng dữ liệu thật của sheet: (hàng đầu, cột đầu, hàng cuối, cột cuối) của các ô có giá trị,
+    công thức hoặc chuỗi inline (kể cả vùng gộp ô); None nếu sheet không có dữ liệu.
+    Trả về False nếu có ô/hàng không có thuộc tính r (không xác định được vị trí chắc chắn).
+    """
+    bounds = None
+
+    def extend(row, col):
+        nonlocal bounds
+        if bounds is None:
+            bounds = [row, col, row, col]
+        else:
+            bounds[0], bounds[1] = min(bounds[0], row), min(bounds[1], col)
+            bounds[2], bounds[3] = max(bounds[2], row), max(bounds[3], col)
+
+    for row in _ROW_RE.finditer(sheet_xml):
+        if not row.group(2):
+            continue
+        if not _ATTR_R_RE.search(row.group(1)):
+            return False
+        for cell in _CELL_RE.finditer(row.group(2)):
+            if not cell.group(2) or not _DATA_RE.search(cell.group(2)):
+                continue
+            r = _ATTR_R_RE.search(cell.group(1))
+            position = _cell_position(r.group(1)) if r else None
+            if position is None:
+                return False
+            extend(*position)
+    for merge in _MERGE_REF_RE.finditer(sheet_xml):
+        for corner in merge.group(1).split(b':'):
+            position = _cell_position(corner)
+            if position:
+                extend(*position)
+    return tuple(bounds) if bounds else None
+
+def trim_sheet_xml(sheet_xml, style_map=None):
+    """
+    Bỏ định dạng thừa nằm ngoài vùng dữ liệu thật và (tùy chọn) đổi chỉ số style theo `style_map`.
+    - Ô không có dữ liệu nằm ngoài vùng bị xóa; hàng ngoài vùng không còn ô nào mất định dạng hàng
+      và bị xóa hẳn nếu không có chiều cao tùy chỉnh/ẩn/outline.
+    - Cột nằm hoàn toàn ngoài vùng mất định dạng cột (giữ độ rộng tùy chỉnh).
+    - <dimension> được ghi lại theo vùng dữ liệu thật.
+    Trả về (xml mới, tập chỉ số style còn dùng (trước khi đổi), số ô đã xóa, số hàng đã xóa).
+    """
+    extent = data_extent(sheet_xml)
+    trim = extent is not False
+    last_row, last_col = (extent[2], extent[3]) if extent else (0, 0)
+    used = set()
+    removed_cells, removed_rows = 0, 0
+
+    def restyle(attrs, pattern, name):
+        match = pattern.search(attrs)
+        if not match:
+            return attrs
+        index = int(match.group(1))
+        used.add(index)
+        if style_map is None:
+            return attrs
+        return attrs[:match.start()] + b' ' + name + b'="' + str(style_map.get(index, 0)).encode('ascii') + b'"' + attrs[match.end():]
+
+    def replace_cell(match, row_index):
+        nonlocal removed_cells
+        attrs, body = match.group(1), match.group(2)
+        if trim and not (body and _DATA_RE.search(body)):
+            r = _ATTR_R_RE.search(attrs)
+            position = _cell_position(r.group(1)) if r else None
+            if position and (position[0] > last_row or position[1] > last_col):
+                removed_cells += 1
+                return b''
+        attrs = restyle(attrs, _ATTR_S_RE, b's')
+        return b'<c' + attrs + (b'>' + body + b'</c>' if body else b'/>')
+
+    def replace_row(match):
+        nonlocal removed_rows
+        attrs, body = match.group(1), match.group(2) or b''
+        r = _ATTR_R_RE.search(attrs)
+        row_index = int(r.group(1)) if r else None
+        if body:
+            body = _CELL_RE.sub(lambda m: replace_cell(m, row_index), body)
+        if trim and row_index is not None and row_index > last_row and not _CELL_RE.search(body):
+            attrs = _CUSTOM_FORMAT_RE.sub(b'', _ATTR_S_RE.sub(b'', attrs))
+            if not _ROW_KEEP_RE.search(attrs):
+                removed_rows += 1
+                return b''
+        attrs = restyle(attrs, _ATTR_S_RE, b's')
+        return b'<row' + attrs + (b'>' + body + b'</row>' if body.strip() else b'/>')
+
+    def replace_col(match):
+        attrs = match.group(1)
+        col_min = _ATTR_MIN_RE.search(attrs)
+        if trim and col_min and int(col_min.group(1)) > last_col:
+            attrs = _ATTR_STYLE_RE.sub(b'', attrs)
+            if not _COL_KEEP_RE.search(attrs):
+                return b''
+        attrs = restyle(attrs, _ATTR_STYLE_RE, b'style')
+        return b'<col' + attrs + b'/>'
+
+    def replace_cols(match):
+        inner = _COL_RE.sub(replace_col, match.group(1))
+        return b'<cols>' + inner + b'</cols>' if _COL_RE.search(inner) else b''
+
+    sheet_xml = _ROW_RE.sub(replace_row, sheet_xml)
+    sheet_xml = _COLS_RE.sub(replace_cols, sheet_xml)
+    if trim:
+        ref = b'A1'
+        if extent:
+            first = f"{get_column_letter(extent[1])}{extent[0]}"
+            last = f"{get_column_letter(extent[3])}{extent[2]}"
+            ref = (first if first == last else f"{first}:{last}").encode('ascii')
+        sheet_xml = _DIMENSION_RE.sub(lambda _: b'<dimension ref="' + ref + b'"/>', sheet_xml, count=1)
+    return sheet_xml, used, removed_cells, removed_rows
+
+# ======================================================================
+# --- Nhóm 2: Thu gọn styles.xml ---
+# ======================================================================
+
+def _section(styles_xml, tag):
+    """Trả về (match của phần tử `tag`, danh sách phần tử con dạng bytes) hoặc (None, [])."""
+    match = re.search(rb'<' + tag + rb'\b([^>]*?)(?:/>|>(.*?)</' + tag + rb'>)', styles_xml, re.S)
+    if not match:
+        return None, []
+    child = {b'fonts': b'font', b'fills': b'fill', b'borders': b'border', b'cellStyleXfs': b'xf',
+             b'cellXfs': b'xf', b'cellStyles': b'cellStyle'}[tag]
+    items = [m.group(0) for m in re.finditer(rb'<' + child + rb'\b[^>]*?(?:/>|>.*?</' + child + rb'>)',
+                                             match.group(2) or b'', re.S)]
+    return match, items
+
+def _replace_section(styles_xml, tag, items):
+    match, _ = _section(styles_xml, tag)
+    if match is None:
+        return styles_xml
+    attrs = re.sub(rb'\bcount="\d+"', b'count="' + str(len(items)).encode('ascii') + b'"', match.group(1))
+    return styles_xml[:match.start()] + b'<' + tag + attrs + b'>' + b''.join(items) + b'</' + tag + b'>' + styles_xml[match.end():]
+
+def _get_attr(element, name):
+    match = re.search(rb'^<\w+\b[^>]*?\b' + name + rb'="(\d+)"', element)
+    return int(match.group(1)) if match else None
+
+def _set_attr(element, name, value):
+    """Đổi thuộc tính số `name` trong thẻ mở của phần tử (không đụng tới phần tử con)."""
+    end = element.index(b'>')
+    head = re.sub(rb'\b' + name + rb'="\d+"', name + b'="' + str(value).encode('ascii') + b'"', element[:end], count=1)
+    return head + element[end:]
+
+def _key(element):
+    """Khóa so sánh: bỏ khoảng trắng giữa thẻ và sắp xếp thuộc tính của thẻ mở."""
+    element = re.sub(rb'>\s+<', b'><', element.strip())
+    end = element.index(b'>')
+    head, rest = element[:end], element[end:]
+    tag, _, attrs = head.partition(b' ')
+    attrs = attrs.rstrip(b'/').strip()
+    return tag + b' ' + b' '.join(sorted(re.findall(rb'[\w:]+="[^"]*"', attrs))) + rest
+
+def _dedupe(items, reserved=0):
+    """Gộp phần tử trùng: trả về (danh sách mới, bảng chỉ số cũ -> mới). Giữ nguyên `reserved` phần tử đầu."""
+    result, mapping, seen = [], {}, {}
+    for index, item in enumerate(items):
+        key = _key(item)
+        if index >= reserved and key in seen:
+            mapping[index] = seen[key]
+            continue
+        seen.setdefault(key, len(result))
+        mapping[index] = len(result)
+        result.append(item)
+    return result, mapping
+
+def _compact(items, keep, reserved=0):
+    """Chỉ giữ phần tử có chỉ số trong `keep` (và `reserved` phần tử đầu); trả về (danh sách, bảng chỉ số)."""
+    result, mapping = [], {}
+    for index, item in enumerate(items):
+        if index < reserved or index in keep:
+            mapping[index] = len(result)
+            result.append(item)
+    return result, mapping
+
+def _remap_xfs(xfs, maps):
+    """Đổi fontId/fillId/borderId/xfId của danh sách xf theo `maps` (tên thuộc tính -> bảng chỉ số)."""
+    result = []
+    for xf in xfs:
+        for name, mapping in maps.items():
+            value = _get_attr(xf, name)
+            if value is not None:
+                xf = _set_attr(xf, name, mapping.get(value, 0))
+        result.append(xf)
+    return result
+
+def optimize_styles_xml(styles_xml, used_styles):
+    """
+    Gộp font/fill/border/cellStyleXfs/cellXfs trùng lặp và bỏ các style không dùng.
+    `used_styles`: tập chỉ số cellXfs (chỉ số gốc) đang được ô/hàng/cột tham chiếu.
+    Trả về (xml mới, bảng chỉ số cellXfs cũ -> mới, thống kê {tên: (trước, sau)}).
+    """
+    _, fonts = _section(styles_xml, b'fonts')
+    _, fills = _section(styles_xml, b'fills')
+    _, borders = _section(styles_xml, b'borders')
+    _, style_xfs = _section(styles_xml, b'cellStyleXfs')
+    _, cell_xfs = _section(styles_xml, b'cellXfs')
+    _, cell_styles = _section(styles_xml, b'cellStyles')
+    if not cell_xfs:
+        return styles_xml, {}, {}
+    before = {'fonts': len(fonts), 'fills': len(fills), 'borders': len(borders),
+              'cellStyleXfs': len(style_xfs), 'cellXfs': len(cell_xfs), 'cellStyles': len(cell_styles)}
+
+    # 1. Gộp trùng từ dưới lên: font/fill/border -> cellStyleXfs -> cellXfs
+    fonts, font_map = _dedupe(fonts, _RESERVED['font'])
+    fills, fill_map = _dedupe(fills, _RESERVED['fill'])
+    borders, border_map = _dedupe(borders, _RESERVED['border'])
+    component_maps = {b'fontId': font_map, b'fillId': fill_map, b'borderId': border_map}
+    style_xfs, style_xf_map = _dedupe(_remap_xfs(style_xfs, component_maps), _RESERVED['xf'])
+    cell_xfs, cell_xf_map = _dedupe(_remap_xfs(cell_xfs, {**component_maps, b'xfId': style_xf_map}), _RESERVED['xf'])
+    cell_styles = _remap_xfs(cell_styles, {b'xfId': style_xf_map})
+
+    # 2. Bỏ cellXfs không được ô/hàng/cột nào dùng
+    cell_xfs, compact_map = _compact(cell_xfs, {cell_xf_map[i] for i in used_styles if i in cell_xf_map}, _RESERVED['xf'])
+    style_map = {old: compact_map[new] for old, new in cell_xf_map.items() if new in compact_map}
+
+    # 3. Bỏ named style không dùng (trừ style có sẵn của Excel) và cellStyleXfs mồ côi
+    used_style_xfs = {_get_attr(xf, b'xfId') for xf in cell_xfs} - {None}
+    cell_styles = [cs for cs in cell_styles if b'builtinId=' in cs or _get_attr(cs, b'xfId') in used_style_xfs]
+    used_style_xfs |= {_get_attr(cs, b'xfId') for cs in cell_styles} - {None}
+    style_xfs, style_xf_compact = _compact(style_xfs, used_style_xfs, _RESERVED['xf'])
+    cell_xfs = _remap_xfs(cell_xfs, {b'xfId': style_xf_compact})
+    cell_styles = _remap_xfs(cell_styles, {b'xfId': style_xf_compact})
+
+    # 4. Bỏ font/fill/border không còn xf nào dùng
+    def used_ids(name):
+        return {_get_attr(xf, name) for xf in style_xfs + cell_xfs} - {None}
+    fonts, font_compact = _compact(fonts, used_ids(b'fontId'), _RESERVED['font'])
+    fills, fill_compact = _compact(fills, used_ids(b'fillId'), _RESERVED['fill'])
+    borders, border_compact = _compact(borders, used_ids(b'borderId'), _RESERVED['border'])
+    compact_maps = {b'fontId': font_compact, b'fillId': fill_compact, b'borderId': border_compact}
+    style_xfs = _remap_xfs(style_xfs, compact_maps)
+    cell_xfs = _remap_xfs(cell_xfs, compact_maps)
+
+    for tag, items in ((b'fonts', fonts), (b'fills', fills), (b'borders', borders), (b'cellStyleXfs', style_xfs),
+                       (b'cellXfs', cell_xfs), (b'cellStyles', cell_styles)):
+        styles_xml = _replace_section(styles_xml, tag, items)
+    after = {'fonts': len(fonts), 'fills': len(fills), 'borders': len(borders),
+             'cellStyleXfs': len(style_xfs), 'cellXfs': len(cell_xfs), 'cellStyles': len(cell_styles)}
+    return styles_xml, style_map, {name: (before[name], after[name]) for name in before}
+
+# ======================================================================
+# --- Nhóm 3: Gói ---
+# ======================================================================
+
+def styles_part_name(zf):
+    """Tên part styles của workbook (thường là 'xl/styles.xml')."""
+    for rel in ooxml_package.read_relationships(zf, ooxml_package.workbook_part_name(zf)).values():
+        if rel['type'] == REL_TYPE_STYLES and not rel['external']:
+            return rel['target']
+    return DEFAULT_STYLES_PART if DEFAULT_STYLES_PART in zf.NameToInfo else None
+
+def plan_optimize_styles(zf, edits):
+    """
+    Thêm vào `edits` thao tác cắt định dạng thừa của mọi sheet và thu gọn styles.xml.
+    Chỉ số style được đổi qua một bảng dịch tính sẵn, áp dụng khi ghi từng sheet.
+    Trả về dict thống kê {'cells', 'rows', 'styles': {tên: (trước, sau)}}.
+    """
+    stats = {'cells': 0, 'rows': 0, 'styles': {}}
+    parts = [s['part'] for s in ooxml_package.workbook_sheets(zf) if s['part'] and s['part'] in zf.NameToInfo]
+    used = {0}
+    for part in parts:
+        _, sheet_used, cells, rows = trim_sheet_xml(zf.read(part))
+        used |= sheet_used
+        stats['cells'] += cells
+        stats['rows'] += rows
+
+    styles_part = styles_part_name(zf)
+    style_map = None
+    if styles_part:
+        _, style_map, stats['styles'] = optimize_styles_xml(zf.read(styles_part), used)
+        ooxml_package.chain_edit(edits, styles_part, lambda data: optimize_styles_xml(data, used)[0])
+    for part in parts:
+        ooxml_package.chain_edit(edits, part, lambda data: trim_sheet_xml(data, style_map)[0])
+    return stats
+
+def log_style_stats(stats):
+    """Ghi log tổng kết của plan_optimize_styles."""
+    changes = ", ".join(f"{name} {old}->{new}" for name, (old, new) in stats['styles'].items() if old != new)
+    logging.info(f"Đã bỏ {stats['cells']} ô và {stats['rows']} hàng chỉ có định dạng ngoài vùng dữ liệu. "
+                 f"Styles: {changes or 'không thay đổi'}.")
+
+def optimize_styles(file_path, output_path=None):
+    """
+    Bản offline của cleanup_ops.clear_excess_cell_formatting, kèm thu gọn styles.xml
+    (xem plan_optimize_styles). File không được mở trong Excel.
+    """
+    logging.info(f"Bắt đầu tối ưu định dạng (offline) cho file: {os.path.basename(file_path)}")
+    try:
+        edits = {}
+        with zipfile.ZipFile(file_path) as zf:
+            stats = plan_optimize_styles(zf, edits)
+        ooxml_package.rewrite_package(file_path, edits, output_path=output_path)
+        log_style_stats(stats)
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi tối ưu định dạng (offline) cho file '{file_path}': {e}")
+        return False
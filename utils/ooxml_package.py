@@ -0,0 +1,321 @@
+# Đường dẫn: excel_toolkit/utils/ooxml_package.py
+# Phiên bản 1.6 - StreamEdit/iter_segments cắt đoạn theo thẻ đóng của phần tử (end_tag)
+# Ngày cập nhật: 2026-10-17
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_CT = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+REL_TYPE_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+DEFAULT_WORKBOOK_PART = "xl/workbook.xml"
+
+# Kích thước mỗi đoạn đọc khi chép/biến đổi part theo luồng
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+IMAGE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'tif': 'image/tiff',
+    'tiff': 'image/tiff',
+    'emf': 'image/x-emf',
+    'wmf': 'image/x-wmf',
+}
+
+_RELATIONSHIP_TAG_RE = re.compile(rb'<Relationship\b[^>]*?/?>', re.S)
+_ATTR_RE = re.compile(rb'([\w:]+)\s*=\s*"([^"]*)"')
+
+# ======================================================================
+# --- Nhóm 1: Đường dẫn & Quan hệ (relationships) ---
+# ======================================================================
+
+def rels_part_name(part_name):
+    """Trả về tên part .rels tương ứng, ví dụ 'xl/drawings/_rels/drawing1.xml.rels'."""
+    directory, base = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", f"{base}.rels")
+
+def source_part_name(rels_name):
+    """Ngược lại với rels_part_name: 'xl/_rels/workbook.xml.rels' -> 'xl/workbook.xml'."""
+    directory, base = posixpath.split(rels_name)
+    return posixpath.join(posixpath.dirname(directory), base[:-len(".rels")])
+
+def resolve_target(source_part, target):
+    """Chuyển Target (tương đối hoặc tuyệt đối) của một quan hệ thành tên part trong zip."""
+    if target.startswith("/"):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+def relative_target(source_part, part_name):
+    """Tạo Target tương đối từ source_part đến part_name."""
+    return posixpath.relpath(part_name, posixpath.dirname(source_part) or ".")
+
+def parse_relationships(data):
+    """
+    Đọc một part .rels, trả về danh sách dict {'id', 'type', 'target', 'external'}.
+    """
+    rels = []
+    if not data:
+        return rels
+    root = ET.fromstring(data)
+    for rel in root.findall(f"{{{NS_PKG_REL}}}Relationship"):
+        rels.append({
+            'id': rel.get('Id'),
+            'type': rel.get('Type', ''),
+            'target': rel.get('Target', ''),
+            'external': rel.get('TargetMode') == 'External',
+        })
+    return rels
+
+def read_relationships(zf, part_name):
+    """Đọc quan hệ của một part; trả về dict rId -> {'type', 'target' (đã resolve), 'external'}."""
+    rels_name = rels_part_name(part_name)
+    if rels_name not in zf.NameToInfo:
+        return {}
+    result = {}
+    for rel in parse_relationships(zf.read(rels_name)):
+        target = rel['target'] if rel['external'] else resolve_target(part_name, rel['target'])
+        result[rel['id']] = {'type': rel['type'], 'target': target, 'external': rel['external']}
+    return result
+
+def rewrite_relationship_targets(rels_data, rels_name, mapping):
+    """
+    Đổi Target của các quan hệ trỏ tới part cũ sang part mới theo `mapping`
+    (tên part cũ -> tên part mới). Chỉ sửa đúng thuộc tính Target, giữ nguyên phần còn lại.
+    """
+    source = source_part_name(rels_name)
+
+    def replace(match):
+        tag = match.group(0)
+        attrs = dict(_ATTR_RE.findall(tag))
+        if attrs.get(b'TargetMode') == b'External' or b'Target' not in attrs:
+            return tag
+        old_part = resolve_target(source, attrs[b'Target'].decode('utf-8'))
+        new_part = mapping.get(old_part)
+        if not new_part:
+            return tag
+        new_target = escape(relative_target(source, new_part), {'"': '&quot;'}).encode('utf-8')
+        return re.sub(rb'\bTarget\s*=\s*"[^"]*"', lambda _: b'Target="' + new_target + b'"', tag, count=1)
+
+    return _RELATIONSHIP_TAG_RE.sub(replace, rels_data)
+
+def remove_relationships(rels_data, rels_name, part_names):
+    """
+    Xóa các <Relationship> (nội bộ) trỏ tới một trong `part_names`; giữ nguyên phần còn lại.
+    """
+    source = source_part_name(rels_name)
+    targets = set(part_names)
+
+    def replace(match):
+        tag = match.group(0)
+        attrs = dict(_ATTR_RE.findall(tag))
+        if attrs.get(b'TargetMode') == b'External' or b'Target' not in attrs:
+            return tag
+        if resolve_target(source, attrs[b'Target'].decode('utf-8')) in targets:
+            return b''
+        return tag
+
+    return _RELATIONSHIP_TAG_RE.sub(replace, rels_data)
+
+# ======================================================================
+# --- Nhóm 2: Content Types ---
+# ======================================================================
+
+def parse_content_types(data):
+    """Trả về (defaults: phần mở rộng -> content type, overrides: tên part -> content type)."""
+    root = ET.fromstring(data)
+    defaults = {d.get('Extension', '').lower(): d.get('ContentType') for d in root.findall(f"{{{NS_CT}}}Default")}
+    overrides = {o.get('PartName', '').lstrip('/'): o.get('ContentType') for o in root.findall(f"{{{NS_CT}}}Override")}
+    return defaults, overrides
+
+def ensure_default_content_type(ct_data, extension, content_type):
+    """Thêm <Default Extension=... /> nếu phần mở rộng chưa được khai báo."""
+    defaults, _ = parse_content_types(ct_data)
+    if extension.lower() in defaults:
+        return ct_data
+    tag = f'<Default Extension="{extension}" ContentType="{content_type}"/>'.encode('utf-8')
+    return ct_data.replace(b'</Types>', tag + b'</Types>', 1)
+
+def remove_override(ct_data, part_name):
+    """Xóa <Override PartName="/part_name" .../> khỏi [Content_Types].xml."""
+    pattern = rb'<Override\b[^>]*\bPartName\s*=\s*"/' + re.escape(part_name.encode('utf-8')) + rb'"[^>]*/>'
+    return re.sub(pattern, b'', ct_data)
+
+# ======================================================================
+# --- Nhóm 3: Workbook ---
+# ======================================================================
+
+def workbook_part_name(zf):
+    """Tên part workbook chính (thường là 'xl/workbook.xml'), đọc từ _rels/.rels."""
+    for rel in read_relationships(zf, "").values():
+        if rel['type'] == REL_TYPE_OFFICE_DOCUMENT and not rel['external']:
+            return rel['target']
+    return DEFAULT_WORKBOOK_PART
+
+def workbook_sheets(zf):
+    """
+    Danh sách sheet theo thứ tự trong workbook: dict {'name', 'sheet_id', 'state', 'rid', 'part'}.
+    state là 'visible', 'hidden' hoặc 'veryHidden'; part là None nếu không resolve được.
+    """
+    workbook_part = workbook_part_name(zf)
+    rels = read_relationships(zf, workbook_part)
+    root = ET.fromstring(zf.read(workbook_part))
+    sheets = []
+    for sheet in root.iter(f"{{{NS_MAIN}}}sheet"):
+        rid = sheet.get(f"{{{NS_REL}}}id")
+        rel = rels.get(rid)
+        sheets.append({
+            'name': sheet.get('name'),
+            'sheet_id': sheet.get('sheetId'),
+            'state': sheet.get('state', 'visible'),
+            'rid': rid,
+            'part': rel['target'] if rel and not rel['external'] else None,
+        })
+    return sheets
+
+def package_fingerprint(zf):
+    """
+    Dấu vân tay nội dung của gói: băm tên, CRC-32 và kích thước của mọi part trong central
+    directory. Không cần giải nén nên gần như tức thời kể cả với file hàng trăm MB.
+    """
+    digest = hashlib.sha256()
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        digest.update(f"{info.filename}\0{info.CRC:08x}\0{info.file_size}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+# ======================================================================
+# --- Nhóm 4: Ghi lại gói ---
+# ======================================================================
+
+class StreamEdit:
+    """
+    Biến đổi một part theo luồng: `transform(bytes) -> bytes` được gọi lần lượt trên từng đoạn
+    của iter_segments(..., end_tag). Dùng cho part lớn (sheet XML hàng trăm MB) khi biến đổi chỉ
+    cần nhìn từng thẻ (end_tag=None) hoặc từng phần tử (vd. end_tag=b'</c>'), để giới hạn bộ nhớ.
+    """
+    def __init__(self, transform, end_tag=None):
+        self.transform = transform
+        self.end_tag = end_tag
+
+def iter_segments(src, end_tag=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Đọc file object `src` theo từng khối và trả về các đoạn liên tiếp (nối lại đúng bằng nội dung gốc):
+        - end_tag=None: cắt ngay trước dấu '<' cuối cùng, mỗi thẻ XML nằm trọn trong một đoạn;
+        - end_tag (bytes): cắt ngay sau lần xuất hiện cuối cùng của end_tag, mỗi phần tử
+          kết thúc bằng end_tag (không lồng nhau) nằm trọn trong một đoạn.
+    """
+    pending = b''
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        if end_tag is None:
+            cut = pending.rfind(b'<')
+        else:
+            cut = pending.rfind(end_tag)
+            cut = cut + len(end_tag) if cut >= 0 else -1
+        if cut > 0:
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
+
+def rewrite_package(file_path, edits, output_path=None, compresslevel=None, verify=None):
+    """
+    Ghi lại gói zip theo dạng stream: các part không có trong `edits` được chép
+    nguyên nội dung, các part có trong `edits` được xử lý như sau:
+        - bytes: thay bằng nội dung mới (hoặc thêm mới nếu part chưa tồn tại)
+        - None: xóa part
+        - callable(bytes) -> bytes | None: biến đổi nội dung part
+        - StreamEdit: biến đổi nội dung part theo luồng
+
+    File tạm được tạo cùng thư mục đích rồi os.replace để thao tác là nguyên tử.
+    `verify(đường dẫn file tạm) -> bool` (tùy chọn) được gọi trước khi thay file; trả về
+    False thì file đích giữ nguyên và hàm ném ValueError.
+    """
+    output_path = output_path or file_path
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix="~ooxml_", dir=out_dir)
+    os.close(fd)
+    written = set()
+    try:
+        with zipfile.ZipFile(file_path, 'r') as zin, \
+             zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zout:
+            for info in zin.infolist():
+                name = info.filename
+                if isinstance(edits.get(name), StreamEdit):
+                    with zin.open(info) as src, zout.open(_new_zipinfo(name, info, compresslevel), 'w') as dst:
+                        for segment in iter_segments(src, edits[name].end_tag):
+                            dst.write(edits[name].transform(segment))
+                elif name in edits:
+                    edit = edits[name]
+                    if callable(edit):
+                        edit = edit(zin.read(name))
+                    if edit is None:
+                        logging.debug(f"  -> Đã xóa part '{name}'.")
+                        continue
+                    zout.writestr(_new_zipinfo(name, info, compresslevel), edit)
+                else:
+                    with zin.open(info) as src, zout.open(_new_zipinfo(name, info, compresslevel), 'w') as dst:
+                        shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
+                written.add(name)
+
+            for name, edit in edits.items():
+                if name not in written and isinstance(edit, (bytes, bytearray)):
+                    zout.writestr(_new_zipinfo(name, compresslevel=compresslevel), edit)
+                    logging.debug(f"  -> Đã thêm part '{name}'.")
+        if verify is not None and not verify(tmp_path):
+            raise ValueError(f"File ghi lại không vượt qua bước kiểm tra, giữ nguyên: {os.path.basename(output_path)}")
+        os.replace(tmp_path, output_path)
+        return True
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def chain_edit(edits, part_name, transform):
+    """
+    Gắn thêm một biến đổi callable(bytes) -> bytes | None cho `part_name` trong `edits`
+    (định dạng của rewrite_package). Nếu part đã có biến đổi, hai biến đổi được nối tiếp;
+    part đã bị đánh dấu xóa (None) thì giữ nguyên.
+    """
+    if part_name not in edits:
+        edits[part_name] = transform
+        return
+    previous = edits[part_name]
+    if previous is None:
+        return
+    if isinstance(previous, StreamEdit):
+        previous = previous.transform
+    if callable(previous):
+        def chained(data):
+            data = previous(data)
+            return None if data is None else transform(data)
+        edits[part_name] = chained
+    else:
+        edits[part_name] = transform(previous)
+
+def _new_zipinfo(name, original=None, compresslevel=None):
+    info = zipfile.ZipInfo(name, date_time=original.date_time if original else (1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = original.external_attr if original else 0o600 << 16
+    if compresslevel is not None:
+        # zout.open(..., 'w') không nhận compresslevel nên phải gắn vào ZipInfo.
+        info._compresslevel = compresslevel
+    return info
@@ -1,6 +1,6 @@
 # Đường dẫn: excel_toolkit/utils/print_ops.py
-# Phiên bản 2.1 - Khắc phục lỗi `xlwings.utils.col_str`
-# Ngày cập nhật: 2025-09-15
+# Phiên bản 2.2 - Tách apply_smart_print_settings để chạy theo từng sheet
+# Ngày cập nhật: 2026-10-17
 
 import logging
 import xlwings as xw
@@ -201,6 +201,25 @@ def toggle_print_options(wb, sheet_name, gridlines=False, headings=False, black_
 # --- Nhóm 5: Quy trình Tự động ---
 # ======================================================================
 
+def apply_smart_print_settings(wb, sheet_name):
+    """
+    Áp dụng cài đặt in thông minh (A3, Ngang, co giãn theo chiều rộng) cho một sheet.
+    """
+    try:
+        logging.debug(f"  -> Áp dụng cho sheet: '{sheet_name}'")
+        sheet = wb.sheets[sheet_name]
+        page_setup = sheet.api.PageSetup
+
+        page_setup.PaperSize = A3_PAPER
+        page_setup.Orientation = xw.constants.PageOrientation.xlLandscape
+        page_setup.PrintArea = sheet.used_range.address
+        page_setup.FitToPagesWide = 1
+        page_setup.FitToPagesTall = False
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi áp dụng cài đặt in cho sheet '{sheet_name}': {e}")
+        return False
+
 def set_smart_print_settings(wb):
     """
     Áp dụng một bộ cài đặt in thông minh (A3, Ngang, co giãn theo chiều rộng)
@@ -208,22 +227,13 @@ def set_smart_print_settings(wb):
     """
     logging.debug(f"Bắt đầu áp dụng cài đặt in thông minh cho workbook '{wb.name}'.")
     try:
-        visible_sheets, _ = xw.apps.active.books.active.sheets, [] # Tạm thời, sẽ thay bằng hàm visibility
-        # Cần một hàm để lấy sheet hiển thị, giả sử ta đã có nó
-        from . import worksheet_ops 
+        from . import worksheet_ops
         visible_sheets, _ = worksheet_ops.get_sheets_visibility(wb)
 
         for sheet_name in visible_sheets:
-            logging.debug(f"  -> Áp dụng cho sheet: '{sheet_name}'")
-            sheet = wb.sheets[sheet_name]
-            page_setup = sheet.api.PageSetup
-            
-            page_setup.PaperSize = A3_PAPER
-            page_setup.Orientation = xw.constants.PageOrientation.xlLandscape
-            page_setup.PrintArea = sheet.used_range.address
-            page_setup.FitToPagesWide = 1
-            page_setup.FitToPagesTall = False
-        
+            if not apply_smart_print_settings(wb, sheet_name):
+                return False
+
         logging.info(f"Đã áp dụng cài đặt in thông minh cho {len(visible_sheets)} sheet thành công.")
         return True
     except Exception as e:
@@ -1,10 +1,13 @@
 # Đường dẫn: excel_toolkit/utils/range_ops.py
-# Phiên bản 2.0 - Hoàn thiện các hàm thao tác dữ liệu và định dạng
-# Ngày cập nhật: 2025-09-12
+# Phiên bản 2.1 - Thêm freeze_formulas: thay công thức bằng giá trị theo từng khối chữ nhật
+# Ngày cập nhật: 2026-10-17
 
 import logging
+import re
 import xlwings as xw
 
+_CELL_ADDRESS_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+
 # ======================================================================
 # --- Nhóm 1: Đọc & Ghi Dữ liệu ---
 # ======================================================================
@@ -80,6 +83,87 @@ def get_last_row(wb, sheet_name, column=1):
         logging.error(f"Lỗi khi tìm hàng cuối cùng: {e}")
         return 0
 
+def _column_index(letters):
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + ord(ch) - 64
+    return index
+
+def _column_letter(index):
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def merge_cell_blocks(addresses):
+    """
+    Gộp danh sách địa chỉ ô ('A1', '$B$2', ...) thành các khối chữ nhật, chỉ phủ đúng các ô đã cho.
+    Mỗi hàng được tách thành các đoạn cột liên tiếp; các hàng liền nhau có cùng đoạn cột được nối dọc.
+    Trả về danh sách địa chỉ vùng ('A1:C20', 'E5', ...).
+    """
+    columns_by_row = {}
+    for address in addresses:
+        match = _CELL_ADDRESS_RE.match(address.strip())
+        if not match:
+            logging.warning(f"Bỏ qua địa chỉ ô không hợp lệ: '{address}'")
+            continue
+        columns_by_row.setdefault(int(match.group(2)), set()).add(_column_index(match.group(1)))
+
+    blocks, open_blocks = [], {}   # open_blocks: (cột đầu, cột cuối) -> [hàng đầu, hàng cuối]
+    for row in sorted(columns_by_row):
+        runs, cols = [], sorted(columns_by_row[row])
+        start = prev = cols[0]
+        for col in cols[1:]:
+            if col != prev + 1:
+                runs.append((start, prev))
+                start = col
+            prev = col
+        runs.append((start, prev))
+
+        still_open = {}
+        for run in runs:
+            block = open_blocks.pop(run, None)
+            if block and block[1] == row - 1:
+                block[1] = row
+            else:
+                if block:
+                    blocks.append((run, block))
+                block = [row, row]
+            still_open[run] = block
+        blocks.extend(open_blocks.items())
+        open_blocks = still_open
+    blocks.extend(open_blocks.items())
+
+    result = []
+    for (first_col, last_col), (first_row, last_row) in blocks:
+        top_left = f"{_column_letter(first_col)}{first_row}"
+        bottom_right = f"{_column_letter(last_col)}{last_row}"
+        result.append(top_left if top_left == bottom_right else f"{top_left}:{bottom_right}")
+    return result
+
+def freeze_formulas(wb, sheet_name, addresses):
+    """
+    Thay công thức bằng giá trị hiện tại cho các ô trong `addresses`.
+    Các ô được gộp thành khối chữ nhật; mỗi khối chỉ tốn một lần đọc và một lần ghi qua COM.
+    """
+    logging.debug(f"Bắt đầu cố định giá trị {len(addresses)} ô trên sheet '{sheet_name}'.")
+    try:
+        sheet = wb.sheets[sheet_name]
+        blocks = merge_cell_blocks(addresses)
+        for block in blocks:
+            rng = sheet.range(block)
+            rng.value = rng.options(ndim=2).value
+            logging.debug(f"  -> Đã cố định giá trị vùng '{block}'.")
+        logging.info(f"Đã thay công thức bằng giá trị cho {len(addresses)} ô ({len(blocks)} khối) trên sheet '{sheet_name}'.")
+        return True
+    except KeyError:
+        logging.error(f"Lỗi: Không tìm thấy sheet '{sheet_name}'.")
+        return False
+    except Exception as e:
+        logging.error(f"Lỗi khi thay công thức bằng giá trị trên sheet '{sheet_name}': {e}")
+        return False
+
 # ======================================================================
 # --- Nhóm 2: Định dạng & Bố cục ---
 # ======================================================================
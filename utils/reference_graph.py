@@ -0,0 +1,329 @@
+# Đường dẫn: excel_toolkit/utils/reference_graph.py
+# Phiên bản 1.1 - Dùng chung vòng stream công thức của dependency_scanner; quét song song worksheet với file lớn
+# Ngày cập nhật: 2026-10-17
+
+import json
+import logging
+import os
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from utils import ooxml_package, dependency_scanner
+from utils.disk_cache import DiskCache, DEFAULT_CACHE_ROOT
+
+# Tăng khi thay đổi cấu trúc dữ liệu để bỏ qua các đồ thị cũ trong cache.
+GRAPH_VERSION = 1
+GRAPH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# File lớn hơn ngưỡng này được quét song song theo từng worksheet.
+PARALLEL_SCAN_MIN_BYTES = 50 * 1024 * 1024
+MIN_PARALLEL_SHEETS = 2
+
+# Loại nơi tham chiếu
+KIND_CELL = 'cell'
+KIND_NAME = 'name'
+KIND_CHART = 'chart'
+KIND_VALIDATION = 'validation'
+KIND_CONDITIONAL_FORMAT = 'conditional_format'
+KIND_PIVOT_CACHE = 'pivot_cache'
+
+# Name có sẵn của Excel cho thiết lập in; luôn được giữ lại.
+PRINT_NAMES = ('_xlnm.print_area', '_xlnm.print_titles')
+
+NS_MAIN = ooxml_package.NS_MAIN
+NS_CHART = "http://schemas.openxmlformats.org/drawingml/2006/chart"
+_TAG_CHART_FORMULA = f"{{{NS_CHART}}}f"
+
+# Phần tử chứa công thức bên trong validation/định dạng có điều kiện (kể cả bản x14 trong extLst: <xm:f>)
+_RULE_FORMULA_TAGS = {'formula', 'formula1', 'formula2', 'f'}
+_CONTEXT_TAGS = {'dataValidation': KIND_VALIDATION, 'conditionalFormatting': KIND_CONDITIONAL_FORMAT}
+
+_IDENTIFIER_RE = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')+\'|([A-Za-z_\\\u00C0-\uFFFF][\w.\\?\u00C0-\uFFFF]*)')
+
+_graph_cache = None
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+# ======================================================================
+# --- Nhóm 1: Đồ thị ---
+# ======================================================================
+
+class ReferenceGraph:
+    """
+    Chỉ mục ngược "ai phụ thuộc vào X" cho sheet và defined name.
+
+    Mỗi nơi tham chiếu (referrer) là dict {'kind', 'sheet', 'ref'}:
+        - cell: sheet chứa ô, ref = danh sách địa chỉ ô
+        - name: sheet phạm vi của name (None nếu toàn workbook), ref = tên name
+        - chart: sheet chứa chart (nếu xác định được), ref = tên part chart
+        - validation / conditional_format: sheet chứa quy tắc, ref = sqref
+        - pivot_cache: sheet = None, ref = tên part pivot cache
+    Tra cứu theo tên sheet/name không phân biệt hoa/thường, O(1) mỗi truy vấn.
+    """
+    def __init__(self, sheets, names, sheet_refs, name_refs):
+        self.sheets = sheets          # [{'name', 'state'}] theo thứ tự workbook
+        self.names = names            # [{'name', 'scope', 'formula'}]
+        self._sheet_refs = sheet_refs  # tên sheet (casefold) -> [referrer]
+        self._name_refs = name_refs    # tên name (casefold) -> [referrer]
+
+    def dependents_of_sheet(self, sheet_name):
+        """Mọi nơi tham chiếu tới sheet `sheet_name`."""
+        return self._sheet_refs.get(sheet_name.casefold(), [])
+
+    def dependents_of_name(self, name):
+        """Mọi nơi tham chiếu tới defined name `name` (không phân biệt phạm vi)."""
+        return self._name_refs.get(name.casefold(), [])
+
+    def cell_dependents(self, sheet_name, source_sheets=None):
+        """Tên sheet -> danh sách ô có công thức tham chiếu tới `sheet_name`."""
+        wanted = None if source_sheets is None else {s.casefold() for s in source_sheets}
+        result = {}
+        for ref in self.dependents_of_sheet(sheet_name):
+            if ref['kind'] == KIND_CELL and (wanted is None or ref['sheet'].casefold() in wanted):
+                result.setdefault(ref['sheet'], []).extend(ref['ref'])
+        return result
+
+    def indirect_dependents_of_sheet(self, sheet_name):
+        """
+        Mọi nơi tham chiếu (không phải name) tới `sheet_name`, trực tiếp hoặc gián tiếp
+        qua chuỗi defined name (ví dụ ô dùng =MyRange với MyRange -> Hidden!A1:A9).
+        """
+        result, seen_names = [], set()
+        pending = [self.dependents_of_sheet(sheet_name)]
+        while pending:
+            for ref in pending.pop():
+                if ref['kind'] != KIND_NAME:
+                    result.append(ref)
+                elif ref['ref'].casefold() not in seen_names:
+                    seen_names.add(ref['ref'].casefold())
+                    pending.append(self.dependents_of_name(ref['ref']))
+        return result
+
+    def used_names(self):
+        """
+        Tập tên name (casefold) đang được dùng: được tham chiếu từ ô, chart, validation,
+        định dạng có điều kiện, pivot, hoặc từ một name khác đang được dùng (bắc cầu).
+        Name thiết lập in (PRINT_NAMES) luôn được tính là đang dùng.
+        """
+        used = {n['name'].casefold() for n in self.names if n['name'].casefold() in PRINT_NAMES}
+        pending = list(used)
+        for key, refs in self._name_refs.items():
+            if key not in used and any(ref['kind'] != KIND_NAME for ref in refs):
+                used.add(key)
+                pending.append(key)
+        # Name chỉ được name khác dùng: lan truyền từ các name đã chắc chắn được dùng
+        referenced_by = {}
+        for key, refs in self._name_refs.items():
+            for ref in refs:
+                if ref['kind'] == KIND_NAME:
+                    referenced_by.setdefault(ref['ref'].casefold(), []).append(key)
+        while pending:
+            for key in referenced_by.get(pending.pop(), []):
+                if key not in used:
+                    used.add(key)
+                    pending.append(key)
+        return used
+
+    def to_dict(self):
+        return {'version': GRAPH_VERSION, 'sheets': self.sheets, 'names': self.names,
+                'sheet_refs': self._sheet_refs, 'name_refs': self._name_refs}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['sheets'], data['names'], data['sheet_refs'], data['name_refs'])
+
+# ======================================================================
+# --- Nhóm 2: Quét các part ---
+# ======================================================================
+
+class _Builder:
+    def __init__(self, sheet_names, defined_names):
+        self.sheet_lookup = dependency_scanner.build_lookup(sheet_names)
+        self.sheet_order = list(sheet_names)
+        self.name_lookup = {name.casefold(): name for name in defined_names}
+        self.sheet_refs = {}
+        self.name_refs = {}
+
+    def referenced(self, formula):
+        """(tập sheet, tập name) mà công thức tham chiếu tới."""
+        sheets = dependency_scanner.referenced_sheets(formula, self.sheet_lookup, self.sheet_order)
+        names = set()
+        if self.name_lookup:
+            for match in _IDENTIFIER_RE.finditer(formula):
+                token = match.group(1)
+                if not token:
+                    continue
+                end = match.end()
+                if end < len(formula) and formula[end] == '(':
+                    continue  # tên hàm
+                original = self.name_lookup.get(token.casefold())
+                if original:
+                    names.add(original)
+        return sheets, names
+
+    def add(self, formula, kind, sheet, ref):
+        sheets, names = self.referenced(formula)
+        referrer = {'kind': kind, 'sheet': sheet, 'ref': ref}
+        for target in sheets:
+            self.sheet_refs.setdefault(target.casefold(), []).append(referrer)
+        for target in names:
+            self.name_refs.setdefault(target.casefold(), []).append(referrer)
+
+    def scan_worksheet(self, stream, sheet_name):
+        """
+        Stream một worksheet bằng dependency_scanner.iter_cell_formulas: công thức ô (gộp theo
+        sheet đích), cùng validation và định dạng có điều kiện (kể cả phiên bản x14 trong extLst).
+        """
+        cells_by_target = {}   # (loại đích, tên đích casefold) -> [địa chỉ ô]
+        state = {'context': None, 'ref': None, 'formulas': []}
+
+        def on_element(event, elem):
+            local = _local(elem.tag)
+            if event == 'start':
+                if state['context'] is None and local in _CONTEXT_TAGS:
+                    state.update(context=_CONTEXT_TAGS[local], ref=elem.get('sqref'), formulas=[])
+            elif state['context'] is not None:
+                if local in _RULE_FORMULA_TAGS and elem.text:
+                    state['formulas'].append(elem.text)
+                elif local == 'sqref' and elem.text and state['ref'] is None:
+                    # x14: sqref nằm trong phần tử con <xm:sqref> (sau các công thức) thay vì thuộc tính
+                    state['ref'] = elem.text
+                elif local in _CONTEXT_TAGS:
+                    for formula in state['formulas']:
+                        self.add(formula, state['context'], sheet_name, state['ref'])
+                    state.update(context=None, ref=None, formulas=[])
+
+        for formula, addresses in dependency_scanner.iter_cell_formulas(stream, on_element):
+            if '!' not in formula and not self.name_lookup:
+                continue
+            sheets, names = self.referenced(formula)
+            for target in sheets:
+                cells_by_target.setdefault(('sheet', target.casefold()), []).extend(addresses)
+            for target in names:
+                cells_by_target.setdefault(('name', target.casefold()), []).extend(addresses)
+
+        for (target_kind, target), addresses in cells_by_target.items():
+            referrer = {'kind': KIND_CELL, 'sheet': sheet_name, 'ref': addresses}
+            index = self.sheet_refs if target_kind == 'sheet' else self.name_refs
+            index.setdefault(target, []).append(referrer)
+
+    def merge(self, sheet_refs, name_refs):
+        """Gộp chỉ mục do một _Builder khác dựng (quét worksheet trong tiến trình con)."""
+        for target, refs in sheet_refs.items():
+            self.sheet_refs.setdefault(target, []).extend(refs)
+        for target, refs in name_refs.items():
+            self.name_refs.setdefault(target, []).extend(refs)
+
+    def scan_chart(self, data, part, host_sheet):
+        for elem in ET.fromstring(data).iter(_TAG_CHART_FORMULA):
+            if elem.text:
+                self.add(elem.text, KIND_CHART, host_sheet, part)
+
+    def scan_pivot_cache(self, data, part):
+        for source in ET.fromstring(data).iter(f"{{{NS_MAIN}}}worksheetSource"):
+            referrer = {'kind': KIND_PIVOT_CACHE, 'sheet': None, 'ref': part}
+            if source.get('sheet'):
+                self.sheet_refs.setdefault(source.get('sheet').casefold(), []).append(referrer)
+            if source.get('name') and source.get('name').casefold() in self.name_lookup:
+                self.name_refs.setdefault(source.get('name').casefold(), []).append(referrer)
+
+def _chart_hosts(zf, sheets):
+    """Part chart -> tên sheet chứa nó (sheet -> drawing -> chart)."""
+    hosts = {}
+    for sheet in sheets:
+        if not sheet['part']:
+            continue
+        for rel in ooxml_package.read_relationships(zf, sheet['part']).values():
+            if rel['external'] or not rel['type'].endswith('/drawing'):
+                continue
+            for drawing_rel in ooxml_package.read_relationships(zf, rel['target']).values():
+                if not drawing_rel['external'] and drawing_rel['type'].endswith('/chart'):
+                    hosts[drawing_rel['target']] = sheet['name']
+    return hosts
+
+def _scan_worksheet_part(file_path, part, sheet_name, sheet_names, defined_names):
+    """Quét một worksheet trong tiến trình con; trả về (sheet_refs, name_refs) để gộp lại."""
+    builder = _Builder(sheet_names, defined_names)
+    with zipfile.ZipFile(file_path) as zf, zf.open(part) as stream:
+        builder.scan_worksheet(stream, sheet_name)
+    return builder.sheet_refs, builder.name_refs
+
+def _build(zf, file_path, max_workers=None):
+    sheets = ooxml_package.workbook_sheets(zf)
+    workbook_part = ooxml_package.workbook_part_name(zf)
+    workbook = ET.fromstring(zf.read(workbook_part))
+    defined = []
+    for elem in workbook.iter(f"{{{NS_MAIN}}}definedName"):
+        scope = elem.get('localSheetId')
+        scope_name = sheets[int(scope)]['name'] if scope is not None and int(scope) < len(sheets) else None
+        defined.append({'name': elem.get('name'), 'scope': scope_name, 'formula': elem.text or ''})
+
+    builder = _Builder([s['name'] for s in sheets], [d['name'] for d in defined])
+    for name in defined:
+        builder.add(name['formula'], KIND_NAME, name['scope'], name['name'])
+
+    names = set(zf.namelist())
+    worksheets = [(sheet['name'], sheet['part']) for sheet in sheets if sheet['part'] in names]
+    if max_workers and max_workers > 1 and len(worksheets) >= MIN_PARALLEL_SHEETS:
+        sheet_names, defined_names = [s['name'] for s in sheets], [d['name'] for d in defined]
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(worksheets))) as executor:
+            futures = [executor.submit(_scan_worksheet_part, file_path, part, name, sheet_names, defined_names)
+                       for name, part in worksheets]
+            for future in futures:
+                builder.merge(*future.result())
+    else:
+        for name, part in worksheets:
+            with zf.open(part) as stream:
+                builder.scan_worksheet(stream, name)
+
+    hosts = _chart_hosts(zf, sheets)
+    for part in sorted(names):
+        directory, base = posixpath.split(part)
+        if directory == 'xl/charts' and base.startswith('chart') and base.endswith('.xml'):
+            builder.scan_chart(zf.read(part), part, hosts.get(part))
+        elif directory == 'xl/pivotCache' and base.startswith('pivotCacheDefinition') and base.endswith('.xml'):
+            builder.scan_pivot_cache(zf.read(part), part)
+
+    return ReferenceGraph([{'name': s['name'], 'state': s['state']} for s in sheets], defined,
+                          builder.sheet_refs, builder.name_refs)
+
+# ======================================================================
+# --- Nhóm 3: Dựng đồ thị (có cache) ---
+# ======================================================================
+
+def _get_cache():
+    global _graph_cache
+    if _graph_cache is None:
+        try:
+            _graph_cache = DiskCache(os.path.join(DEFAULT_CACHE_ROOT, "reference_graph"), GRAPH_CACHE_MAX_BYTES)
+        except OSError as e:
+            logging.warning(f"Không thể khởi tạo cache đồ thị tham chiếu: {e}")
+            return None
+    return _graph_cache
+
+def build_reference_graph(file_path, use_cache=True):
+    """
+    Dựng đồ thị tham chiếu của file trong một lượt stream qua gói (file .xlsx/.xlsm; người gọi
+    tự kiểm tra zipfile.is_zipfile với định dạng khác).
+    Kết quả được cache theo dấu vân tay nội dung gói nên các tác vụ sau trên cùng file
+    (ví dụ xóa sheet ẩn rồi xóa name) không phải quét lại.
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        cache = _get_cache() if use_cache else None
+        key = f"g{GRAPH_VERSION}-{ooxml_package.package_fingerprint(zf)}" if cache else None
+        if cache:
+            cached = cache.get(key)
+            if cached is not None:
+                logging.debug("Dùng đồ thị tham chiếu từ cache.")
+                return ReferenceGraph.from_dict(json.loads(cached))
+
+        logging.info(f"Đang dựng đồ thị tham chiếu cho file: {os.path.basename(file_path)}")
+        # File lớn: quét các worksheet song song (mỗi tiến trình tự mở lại file zip)
+        max_workers = os.cpu_count() if os.path.getsize(file_path) >= PARALLEL_SCAN_MIN_BYTES else None
+        graph = _build(zf, file_path, max_workers)
+
+    if cache:
+        cache.put(key, json.dumps(graph.to_dict()).encode('utf-8'))
+    return graph
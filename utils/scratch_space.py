@@ -0,0 +1,103 @@
+# Đường dẫn: excel_toolkit/utils/scratch_space.py
+# Phiên bản 1.0 - Thư mục tạm dùng lại cho mỗi tiến trình, chỉ ghi file khi API bắt buộc cần đường dẫn
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import multiprocessing.util
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+import psutil
+
+# Ưu tiên vùng nhớ RAM (/dev/shm) nếu hệ điều hành có, ngược lại dùng thư mục tạm của OS.
+_RAM_ROOT = "/dev/shm"
+SCRATCH_ROOT = os.path.join(_RAM_ROOT if os.path.isdir(_RAM_ROOT) else tempfile.gettempdir(), "excel_toolkit_scratch")
+
+_scratch_dir = None
+_lock = threading.Lock()
+
+def _owner_pid(dir_name):
+    try:
+        return int(dir_name.split("-", 1)[0])
+    except ValueError:
+        return None
+
+def sweep_stale_dirs(root=SCRATCH_ROOT):
+    """
+    Xóa thư mục tạm của các tiến trình đã chết (ví dụ worker bị crash, Excel treo bị kill)
+    mà không kịp dọn dẹp. Tên thư mục có dạng '<pid>-<token>'.
+    """
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    removed = 0
+    for entry in entries:
+        pid = _owner_pid(entry.name)
+        if not entry.is_dir() or pid is None or pid == os.getpid() or psutil.pid_exists(pid):
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    if removed:
+        logging.info(f"Đã dọn {removed} thư mục tạm còn sót từ lần chạy trước.")
+    return removed
+
+def get_scratch_dir():
+    """
+    Trả về thư mục tạm riêng của tiến trình hiện tại (tạo khi cần, dùng lại cho mọi file).
+    Thư mục được xóa khi tiến trình kết thúc, kể cả worker của multiprocessing.
+    """
+    global _scratch_dir
+    with _lock:
+        if _scratch_dir is None or not os.path.isdir(_scratch_dir):
+            sweep_stale_dirs()
+            _scratch_dir = os.path.join(SCRATCH_ROOT, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+            os.makedirs(_scratch_dir, exist_ok=True)
+            # Finalize (không phải atexit) vì worker của multiprocessing thoát bằng os._exit.
+            multiprocessing.util.Finalize(None, cleanup_scratch_dir, exitpriority=5)
+        return _scratch_dir
+
+def cleanup_scratch_dir():
+    """Xóa thư mục tạm của tiến trình hiện tại."""
+    global _scratch_dir
+    with _lock:
+        path, _scratch_dir = _scratch_dir, None
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def spill(data, extension):
+    """
+    Ghi tạm `data` ra file trong thư mục tạm của tiến trình cho các API chỉ nhận đường dẫn
+    (ví dụ Shapes.AddPicture); file bị xóa ngay khi ra khỏi khối with.
+    """
+    path = os.path.join(get_scratch_dir(), f"{uuid.uuid4().hex}.{extension}")
+    with open(path, 'wb') as f:
+        f.write(data)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Không thể xóa file tạm '{path}': {e}")
+
+@contextmanager
+def scratch_path(extension):
+    """
+    Cấp một đường dẫn trong thư mục tạm cho các API chỉ ghi ra file (ví dụ Picture.Save);
+    file (nếu được tạo) bị xóa khi ra khỏi khối with.
+    """
+    path = os.path.join(get_scratch_dir(), f"{uuid.uuid4().hex}.{extension}")
+    try:
+        yield path
+    finally:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Không thể xóa file tạm '{path}': {e}")
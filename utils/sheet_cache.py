@@ -0,0 +1,236 @@
+# Đường dẫn: excel_toolkit/utils/sheet_cache.py
+# Phiên bản 1.0 - Cache sheet đã phân tích trên đĩa (Arrow IPC dạng cột), khóa theo kích thước/mtime/băm nội dung file
+# Ngày cập nhật: 2026-10-17
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import zipfile
+import pandas as pd
+from utils import ooxml_package
+from utils.disk_cache import DiskCache, DEFAULT_CACHE_ROOT, content_hash
+
+# Tăng khi đổi cách phân tích sheet hoặc định dạng lưu để bỏ qua các mục cache cũ
+SHEET_CACHE_VERSION = 1
+SHEET_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+_META_KEY = b'excel_toolkit'
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+_sheet_cache_settings = {
+    'directory': os.path.join(DEFAULT_CACHE_ROOT, "sheets"),
+    'max_bytes': SHEET_CACHE_MAX_BYTES,
+    'enabled': True,
+}
+_sheet_cache = None
+
+def configure_sheet_cache(directory=None, max_bytes=None, enabled=True):
+    """Thay đổi vị trí/giới hạn dung lượng của cache sheet, hoặc tắt hẳn cache."""
+    global _sheet_cache
+    if directory:
+        _sheet_cache_settings['directory'] = directory
+    if max_bytes:
+        _sheet_cache_settings['max_bytes'] = max_bytes
+    _sheet_cache_settings['enabled'] = enabled
+    _sheet_cache = None
+
+def _get_cache():
+    """DiskCache dùng chung của tiến trình, hoặc None nếu cache bị tắt / thiếu pyarrow."""
+    global _sheet_cache
+    if not _sheet_cache_settings['enabled']:
+        return None
+    if _sheet_cache is None:
+        try:
+            import pyarrow  # noqa: F401 - định dạng lưu là Arrow IPC
+            _sheet_cache = DiskCache(_sheet_cache_settings['directory'], _sheet_cache_settings['max_bytes'])
+        except ImportError:
+            logging.warning("Cần cài đặt thư viện 'pyarrow' để dùng cache sheet (pip install pyarrow); tiếp tục không dùng cache.")
+            _sheet_cache_settings['enabled'] = False
+            return None
+        except OSError as e:
+            logging.warning(f"Không thể khởi tạo cache sheet, tiếp tục không dùng cache: {e}")
+            _sheet_cache_settings['enabled'] = False
+            return None
+    return _sheet_cache
+
+def sheet_cache_stats():
+    """Số lần trúng/trượt cache sheet của tiến trình hiện tại."""
+    cache = _sheet_cache
+    return cache.stats() if cache else {'hits': 0, 'misses': 0}
+
+# ======================================================================
+# --- Nhóm 1: Khóa cache ---
+# ======================================================================
+
+def source_fingerprint(file_path):
+    """
+    (kích thước, mtime_ns, băm nội dung) của file nguồn. Với gói OOXML (.xlsx/.xlsm) băm nội dung
+    là package_fingerprint (CRC-32 của mọi part, đọc từ central directory nên gần như tức thời);
+    file khác được băm SHA-256 toàn bộ nội dung.
+    """
+    stat = os.stat(file_path)
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as zf:
+            digest = ooxml_package.package_fingerprint(zf)
+    else:
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+    return stat.st_size, stat.st_mtime_ns, digest
+
+def sheet_cache_key(file_path, **params):
+    """
+    Khóa cache của một lần đọc sheet: kích thước, mtime, băm nội dung của file và các
+    tham số đọc (sheet, hàng tiêu đề, cột...). None nếu cache tắt hoặc tham số không biểu diễn ổn
+    định được (vd. use_cols là hàm).
+    """
+    if _get_cache() is None or any(callable(value) for value in params.values()):
+        return None
+    try:
+        size, mtime, digest = source_fingerprint(file_path)
+    except OSError as e:
+        logging.debug(f"Không lấy được dấu vân tay của '{file_path}', bỏ qua cache: {e}")
+        return None
+    return content_hash(f"sheet-v{SHEET_CACHE_VERSION}", str(size), str(mtime), digest, repr(sorted(params.items())))
+
+# ======================================================================
+# --- Nhóm 2: Lưu dạng cột (Arrow IPC) ---
+# ======================================================================
+
+def _values_array(pa, values):
+    """
+    Mảng Arrow giữ nguyên giá trị Python của một cột: một kiểu -> mảng thường, nhiều kiểu (vd. chuỗi
+    tiêu đề lẫn số) -> dense union theo từng kiểu, nên đọc lại bằng to_pylist() ra đúng giá trị cũ.
+    """
+    kinds = sorted({type(value) for value in values if value is not None}, key=lambda kind: kind.__name__)
+    if len(kinds) <= 1:
+        return pa.array(values)
+    codes = {kind: i for i, kind in enumerate(kinds)}
+    children = [[] for _ in kinds]
+    type_ids, offsets = [], []
+    for value in values:
+        code = codes[type(value)] if value is not None else 0
+        type_ids.append(code)
+        offsets.append(len(children[code]))
+        children[code].append(value)
+    return pa.UnionArray.from_dense(pa.array(type_ids, pa.int8()), pa.array(offsets, pa.int32()),
+                                    [pa.array(child) for child in children], [kind.__name__ for kind in kinds])
+
+def _to_ipc_bytes(pa, table, meta):
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _META_KEY: json.dumps(meta).encode('utf-8')})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='lz4')) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _from_ipc_bytes(pa, data):
+    table = pa.ipc.open_file(pa.BufferReader(data)).read_all()
+    return table, json.loads(table.schema.metadata[_META_KEY])
+
+def frame_to_bytes(df):
+    """
+    Đóng gói DataFrame thành Arrow IPC (nén lz4). Cột có kiểu cụ thể đi qua Table.from_pandas (giữ
+    dtype, kể cả nullable/Arrow); cột object được lưu theo giá trị Python (xem _values_array).
+    Trả về None nếu tên cột không lưu được dưới dạng JSON (vd. tiêu đề là ngày tháng).
+    """
+    import pyarrow as pa
+    names = list(df.columns)
+    if not all(type(name) in (str, int, float, bool) for name in names):
+        return None
+    frame = df.set_axis([str(i) for i in range(len(names))], axis=1).reset_index(drop=True)
+    values_columns = [column for column in frame.columns if frame[column].dtype == object]
+    arrow_columns = [column for column in frame.columns if isinstance(frame[column].dtype, pd.ArrowDtype)]
+    table = pa.Table.from_pandas(frame.drop(columns=values_columns), preserve_index=False)
+    for column in values_columns:
+        table = table.append_column(column, _values_array(pa, frame[column].tolist()))
+    return _to_ipc_bytes(pa, table, {'names': names, 'values': values_columns, 'arrow': arrow_columns})
+
+def frame_from_bytes(data):
+    """Ngược lại của frame_to_bytes."""
+    import pyarrow as pa
+    table, meta = _from_ipc_bytes(pa, data)
+    values_columns = meta['values']
+    df = table.drop_columns(values_columns).to_pandas()
+    for column in values_columns:
+        df[column] = pd.Series(table.column(column).to_pylist(), dtype=object)
+    # Cột kiểu Arrow (dtype_backend="pyarrow") được gắn lại nguyên mảng Arrow, không chuyển đổi
+    for column in meta.get('arrow', []):
+        df[column] = pd.Series(pd.arrays.ArrowExtensionArray(table.column(column)), index=df.index)
+    df = df[[str(i) for i in range(len(meta['names']))]]
+    df.columns = meta['names']
+    return df
+
+def rows_to_bytes(rows):
+    """
+    Đóng gói danh sách hàng (list of lists) thành Arrow IPC theo từng cột. Hàng ngắn hơn (openpyxl
+    chế độ chỉ đọc có thể trả về hàng dài ngắn khác nhau) được đệm None và độ dài gốc được lưu kèm.
+    """
+    import pyarrow as pa
+    columns = [_values_array(pa, list(column)) for column in itertools.zip_longest(*rows)]
+    names = [str(i) for i in range(len(columns))]
+    lengths = [len(row) for row in rows]
+    ragged = any(length != len(columns) for length in lengths)
+    if ragged:
+        columns.append(pa.array(lengths, pa.int32()))
+        names.append('lengths')
+    table = pa.Table.from_arrays(columns, names=names)
+    return _to_ipc_bytes(pa, table, {'rows': len(rows), 'ragged': ragged})
+
+def rows_from_bytes(data):
+    """Ngược lại của rows_to_bytes."""
+    import pyarrow as pa
+    table, meta = _from_ipc_bytes(pa, data)
+    lengths = table.column('lengths').to_pylist() if meta['ragged'] else None
+    if lengths is not None:
+        table = table.drop_columns(['lengths'])
+    if not table.num_columns:
+        return [[] for _ in range(meta['rows'])]
+    rows = [list(row) for row in zip(*(column.to_pylist() for column in table.columns))]
+    if lengths is not None:
+        rows = [row[:length] for row, length in zip(rows, lengths)]
+    return rows
+
+# ======================================================================
+# --- Nhóm 3: Tra/ghi cache ---
+# ======================================================================
+
+def _cache_get(key, decode):
+    cache = _get_cache() if key else None
+    data = cache.get(key) if cache else None
+    if data is None:
+        return None
+    try:
+        return decode(data)
+    except Exception as e:
+        logging.warning(f"Mục cache sheet bị hỏng, đọc lại từ file: {e}")
+        return None
+
+def _cache_put(key, value, encode):
+    cache = _get_cache() if key else None
+    if cache is None:
+        return False
+    try:
+        data = encode(value)
+    except Exception as e:
+        logging.debug(f"Không lưu được sheet vào cache (dữ liệu không biểu diễn được dạng cột): {e}")
+        return False
+    return data is not None and cache.put(key, data)
+
+def cache_get_frame(key):
+    """DataFrame đã lưu theo `key` (xem sheet_cache_key) hoặc None."""
+    return _cache_get(key, frame_from_bytes)
+
+def cache_put_frame(key, df):
+    """Lưu DataFrame vào cache (bỏ qua nếu cache tắt hoặc không biểu diễn được)."""
+    return _cache_put(key, df, frame_to_bytes)
+
+def cache_get_rows(key):
+    """Danh sách hàng đã lưu theo `key` hoặc None."""
+    return _cache_get(key, rows_from_bytes)
+
+def cache_put_rows(key, rows):
+    """Lưu danh sách hàng vào cache (bỏ qua nếu cache tắt hoặc không biểu diễn được)."""
+    return _cache_put(key, rows, rows_to_bytes)
@@ -0,0 +1,291 @@
+# Đường dẫn: excel_toolkit/utils/size_profiler.py
+# Phiên bản 1.3 - Đếm mọi ảnh (kể cả gif/emf/wmf) và mọi pivot cache khi xác định tác vụ không có gì để làm
+# Ngày cập nhật: 2026-10-17
+
+import csv
+import fnmatch
+import json
+import logging
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from utils import ooxml_package, offline_repack_ops, offline_shared_strings_ops, offline_style_ops, file_system_ops
+
+EXCEL_EXTENSIONS = ['.xlsx', '.xlsm']
+
+# Nhóm part theo mẫu fnmatch; nhóm đầu tiên khớp được chọn, không khớp nhóm nào là 'other'
+CATEGORY_RULES = (
+    ('media', ('xl/media/*',)),
+    ('sheets', ('xl/worksheets/*.xml', 'xl/chartsheets/*.xml')),
+    ('shared_strings', ('xl/sharedStrings.xml',)),
+    ('styles', ('xl/styles.xml',)),
+    ('pivot_records', ('xl/pivotCache/pivotCacheRecords*.xml',)),
+    ('pivot', ('xl/pivotCache/*', 'xl/pivotTables/*')),
+    ('external_links', ('xl/externalLinks/*',)),
+    ('vba', ('xl/vbaProject.bin',)),
+    ('drawings', ('xl/drawings/*', 'xl/charts/*')),
+    ('regenerable', offline_repack_ops.DEFAULT_DROP_PATTERNS),
+)
+CATEGORIES = tuple(name for name, _ in CATEGORY_RULES) + ('other',)
+
+# Tác vụ được ước tính; 'repack' là tác vụ đóng gói lại (processes/repack, bước gói cuối của batch)
+ESTIMATED_TASKS = ('compress_all_images', 'refresh_and_clean_pivot_caches', 'delete_external_links',
+                   'delete_defined_names', 'delete_hidden_sheets', 'clear_excess_cell_formatting',
+                   'compact_shared_strings', 'repack')
+
+# --- Tham số ước tính (lấy mẫu để mỗi file chỉ tốn vài mili giây) ---
+SAMPLE_BYTES = 64 * 1024            # Số byte giải nén để lấy mẫu một part XML
+MAX_IMAGE_SAMPLES = 32              # Số ảnh tối đa được đọc header để lấy kích thước pixel
+JPEG_BYTES_PER_PIXEL = 0.3          # Kích thước xấp xỉ của JPEG chất lượng ~70 trên mỗi pixel
+_COMPRESSIBLE_IMAGES = ('.png', '.jpeg', '.jpg', '.bmp', '.tif', '.tiff')
+
+_EMPTY_STYLED_CELL_RE = re.compile(rb'<c\b[^>]*?\bs="\d+"[^>]*?/>')
+_PICTURE_RE = re.compile(rb'<(?:\w+:)?pic\b|<v:imagedata\b')
+_DEFINED_NAMES_RE = re.compile(rb'<definedNames\b.*?</definedNames>', re.S)
+_DEFINED_NAME_RE = re.compile(rb'<definedName\b')
+_SI_RE = re.compile(rb'<si\b[^>]*?(?:/>|>.*?</si>)', re.S)
+_STYLE_ENTRY_RES = tuple(re.compile(rb'<%s\b[^>]*?(?:/>|>.*?</%s>)' % (tag, tag), re.S)
+                         for tag in (b'font', b'fill', b'border', b'xf'))
+
+def categorize(part):
+    """Nhóm của một part (xem CATEGORY_RULES)."""
+    for name, patterns in CATEGORY_RULES:
+        if any(fnmatch.fnmatchcase(part, pattern) for pattern in patterns):
+            return name
+    return 'other'
+
+def _ratio(info):
+    return info.compress_size / info.file_size if info.file_size else 1.0
+
+def _sample(zf, info, size=SAMPLE_BYTES):
+    with zf.open(info) as f:
+        return f.read(size)
+
+# ======================================================================
+# --- Nhóm 1: Ước tính theo tác vụ ---
+# Mỗi hàm trả về (byte nén ước tính tiết kiệm được, số mục cần xử lý).
+# Số mục = 0 nghĩa là chắc chắn không có gì để làm (dùng để bỏ qua tác vụ).
+# ======================================================================
+
+def _estimate_images(zf, infos):
+    """
+    Tiết kiệm chỉ ước tính trên ảnh nén lại được (png/jpeg/bmp/tif), nhưng số mục đếm mọi ảnh trong
+    xl/media (gif/emf/wmf... vẫn được engine COM/Spire xử lý). Không có part media thì chỉ trả 0 khi
+    không drawing nào chứa ảnh (ảnh liên kết ngoài), ngược lại None (không xác định).
+    """
+    pictures = [i for i in infos if categorize(i.filename) == 'media']
+    if not pictures:
+        drawings = [i for i in infos if i.filename.startswith('xl/drawings/')
+                    and not i.filename.endswith('.rels')]
+        return 0, (None if any(_PICTURE_RE.search(zf.read(i)) for i in drawings) else 0)
+    media = [i for i in pictures if i.filename.lower().endswith(_COMPRESSIBLE_IMAGES)]
+    saved, seen, unique = 0, set(), []
+    for info in media:
+        key = (info.CRC, info.file_size)
+        if key in seen:
+            saved += info.compress_size  # Ảnh trùng: được gộp về một bản
+        else:
+            seen.add(key)
+            unique.append(info)
+    sampled_before, sampled_after = 0, 0
+    for info in sorted(unique, key=lambda i: i.compress_size, reverse=True)[:MAX_IMAGE_SAMPLES]:
+        try:
+            with zf.open(info) as f, Image.open(f) as img:
+                width, height = img.size  # Chỉ đọc header
+        except Exception:
+            continue
+        sampled_before += info.compress_size
+        sampled_after += min(info.compress_size, int(width * height * JPEG_BYTES_PER_PIXEL))
+    if sampled_before:
+        saved += int(sum(i.compress_size for i in unique) * (1 - sampled_after / sampled_before))
+    return saved, len(pictures)
+
+def _estimate_pivot(zf, infos):
+    """Tiết kiệm là phần records; số mục là số pivot cache (làm mới qua Excel không cần records)."""
+    records = [i for i in infos if categorize(i.filename) == 'pivot_records']
+    definitions = [i for i in infos if fnmatch.fnmatchcase(i.filename, 'xl/pivotCache/pivotCacheDefinition*.xml')]
+    return sum(i.compress_size for i in records), len(definitions)
+
+def _estimate_external_links(zf, infos):
+    links = [i for i in infos if categorize(i.filename) == 'external_links']
+    return sum(i.compress_size for i in links), sum(1 for i in links if not i.filename.endswith('.rels'))
+
+def _estimate_defined_names(zf, infos):
+    workbook_part = ooxml_package.workbook_part_name(zf)
+    data = zf.read(workbook_part)
+    block = _DEFINED_NAMES_RE.search(data)
+    if not block:
+        return 0, 0
+    return int(len(block.group(0)) * _ratio(zf.getinfo(workbook_part))), len(_DEFINED_NAME_RE.findall(block.group(0)))
+
+def _estimate_hidden_sheets(zf, infos):
+    hidden = [s['part'] for s in ooxml_package.workbook_sheets(zf) if s['state'] != 'visible' and s['part'] in zf.NameToInfo]
+    return sum(zf.getinfo(part).compress_size for part in hidden), len(hidden)
+
+def _estimate_excess_formatting(zf, infos):
+    """
+    Tỉ lệ ô rỗng chỉ có style trong mẫu đầu mỗi sheet, cộng phần styles.xml là font/fill/border/xf
+    trùng y hệt nhau (một lượt regex, không dựng lại styles.xml; style không dùng không được tính).
+    """
+    saved = 0
+    for info in infos:
+        if categorize(info.filename) != 'sheets' or not info.file_size:
+            continue
+        sample = _sample(zf, info)
+        empty = sum(len(m) for m in _EMPTY_STYLED_CELL_RE.findall(sample))
+        saved += int(info.compress_size * empty / len(sample)) if sample else 0
+    styles_part = offline_style_ops.styles_part_name(zf)
+    if styles_part:
+        info = zf.getinfo(styles_part)
+        data = zf.read(styles_part)
+        duplicate_bytes = 0
+        for entry_re in _STYLE_ENTRY_RES:
+            seen = set()
+            for entry in entry_re.findall(data):
+                if entry in seen:
+                    duplicate_bytes += len(entry)
+                seen.add(entry)
+        saved += int(duplicate_bytes * _ratio(info))
+    # Không thể khẳng định "không có gì để làm" chỉ từ mẫu
+    return saved, None
+
+def _estimate_shared_strings(zf, infos):
+    """Tỉ lệ chuỗi trùng trong mẫu đầu bảng shared strings (chuỗi không dùng không ước tính được từ mẫu)."""
+    sst_part = offline_shared_strings_ops.shared_strings_part_name(zf)
+    if not sst_part:
+        return 0, 0
+    info = zf.getinfo(sst_part)
+    entries = _SI_RE.findall(_sample(zf, info))
+    if not entries:
+        return 0, None
+    duplicates = len(entries) - len(set(entries))
+    return int(info.compress_size * duplicates / len(entries)), None
+
+def _estimate_repack(zf, infos):
+    saved = 0
+    for info in infos:
+        if categorize(info.filename) == 'regenerable':
+            saved += info.compress_size
+        elif info.compress_type == zipfile.ZIP_STORED and info.file_size > 0:
+            # Part lưu không nén: ước tính tỉ lệ nén từ một mẫu
+            sample = _sample(zf, info)
+            ratio = len(zlib.compress(sample, offline_repack_ops.BEST_COMPRESSLEVEL)) / len(sample)
+            saved += int(info.file_size * max(0.0, 1 - ratio))
+    # Nén lại ở mức cao nhất hầu như luôn giảm được một ít, nên repack không bị bỏ qua
+    return saved, None
+
+_ESTIMATORS = {
+    'compress_all_images': _estimate_images,
+    'refresh_and_clean_pivot_caches': _estimate_pivot,
+    'delete_external_links': _estimate_external_links,
+    'delete_defined_names': _estimate_defined_names,
+    'delete_hidden_sheets': _estimate_hidden_sheets,
+    'clear_excess_cell_formatting': _estimate_excess_formatting,
+    'compact_shared_strings': _estimate_shared_strings,
+    'repack': _estimate_repack,
+}
+
+# ======================================================================
+# --- Nhóm 2: Phân tích một file ---
+# ======================================================================
+
+def profile_package(file_path, include_parts=True):
+    """
+    Phân tích một file .xlsx/.xlsm chỉ từ metadata zip và giải nén lấy mẫu.
+
+    Trả về dict (tuần tự hóa JSON được) hoặc None nếu không đọc được file:
+        'file', 'size',
+        'parts': [{'name', 'category', 'compressed', 'uncompressed'}] (nếu include_parts),
+        'categories': {nhóm: {'compressed', 'uncompressed', 'count'}},
+        'savings': {tác vụ: byte ước tính tiết kiệm},
+        'work': {tác vụ: số mục cần xử lý, None nếu không xác định}.
+    """
+    if not zipfile.is_zipfile(file_path):
+        logging.warning(f"Bỏ qua phân tích dung lượng: '{file_path}' không phải gói .xlsx/.xlsm.")
+        return None
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            infos = [i for i in zf.infolist() if not i.is_dir()]
+            categories = {name: {'compressed': 0, 'uncompressed': 0, 'count': 0} for name in CATEGORIES}
+            parts = []
+            for info in infos:
+                category = categorize(info.filename)
+                totals = categories[category]
+                totals['compressed'] += info.compress_size
+                totals['uncompressed'] += info.file_size
+                totals['count'] += 1
+                if include_parts:
+                    parts.append({'name': info.filename, 'category': category,
+                                  'compressed': info.compress_size, 'uncompressed': info.file_size})
+            savings, work = {}, {}
+            for task_id, estimator in _ESTIMATORS.items():
+                try:
+                    savings[task_id], work[task_id] = estimator(zf, infos)
+                except Exception as e:
+                    logging.warning(f"Không ước tính được '{task_id}' cho {os.path.basename(file_path)}: {e}")
+                    savings[task_id], work[task_id] = 0, None
+        profile = {'file': file_path, 'size': os.path.getsize(file_path),
+                   'categories': categories, 'savings': savings, 'work': work}
+        if include_parts:
+            profile['parts'] = sorted(parts, key=lambda p: p['compressed'], reverse=True)
+        return profile
+    except Exception as e:
+        logging.error(f"Lỗi khi phân tích dung lượng file '{file_path}': {e}")
+        return None
+
+def noop_tasks(profile, tasks):
+    """
+    Các tác vụ trong `tasks` chắc chắn không có gì để làm trên file (số mục cần xử lý = 0).
+    Không có profile (phân tích thất bại) thì không bỏ qua tác vụ nào.
+    """
+    if not profile:
+        logging.warning("Không có kết quả phân tích dung lượng: chạy đủ mọi tác vụ, không bỏ qua tác vụ nào.")
+        return []
+    return [task_id for task_id in tasks if profile['work'].get(task_id) == 0]
+
+# ======================================================================
+# --- Nhóm 3: Phân tích thư mục & báo cáo ---
+# ======================================================================
+
+def _profile_summary(file_path):
+    return profile_package(file_path, include_parts=False)
+
+def profile_folder(folder_path, max_workers=None, include_subfolders=True):
+    """Phân tích song song mọi file .xlsx/.xlsm trong thư mục; trả về danh sách profile (bỏ file lỗi)."""
+    files = file_system_ops.get_files_path(folder_path, file_extensions=EXCEL_EXTENSIONS,
+                                           include_subfolders=include_subfolders)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1 or len(files) <= 1:
+        profiles = [_profile_summary(path) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+            profiles = list(executor.map(_profile_summary, files, chunksize=16))
+    return [profile for profile in profiles if profile]
+
+def write_report(profiles, output_path):
+    """
+    Ghi báo cáo: JSON (đầy đủ) nếu `output_path` có đuôi .json, ngược lại CSV
+    (mỗi file một dòng: dung lượng nén theo nhóm và tiết kiệm ước tính theo tác vụ).
+    """
+    try:
+        if output_path.lower().endswith('.json'):
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(profiles, f, ensure_ascii=False, indent=2)
+        else:
+            fields = ['file', 'size'] + [f"{name}_bytes" for name in CATEGORIES] + [f"save_{task}" for task in ESTIMATED_TASKS]
+            with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                for profile in profiles:
+                    row = {'file': profile['file'], 'size': profile['size']}
+                    row.update({f"{name}_bytes": profile['categories'][name]['compressed'] for name in CATEGORIES})
+                    row.update({f"save_{task}": profile['savings'].get(task, 0) for task in ESTIMATED_TASKS})
+                    writer.writerow(row)
+        logging.info(f"Đã ghi báo cáo dung lượng cho {len(profiles)} file: {output_path}")
+        return True
+    except Exception as e:
+        logging.error(f"Lỗi khi ghi báo cáo dung lượng '{output_path}': {e}")
+        return False
@@ -0,0 +1,133 @@
+# Đường dẫn: excel_toolkit/utils/task_fusion.py
+# Phiên bản 1.2 - Pha cuối cho bước gói chạy sau Excel (đóng gói lại); mức nén và kiểm tra theo tác vụ
+# Ngày cập nhật: 2026-10-17
+
+import logging
+import os
+import zipfile
+from utils import ooxml_package
+
+# --- Loại bước trong kế hoạch ---
+KIND_PACKAGE = "package"    # Sửa trực tiếp gói OOXML, không cần Excel; mọi tác vụ ghi chung một lần
+KIND_SHEETS = "sheets"      # Tác vụ COM theo từng sheet; mọi tác vụ dùng chung một vòng qua các sheet
+KIND_WORKBOOK = "workbook"  # Tác vụ COM trên toàn workbook, chạy riêng
+
+# --- Pha: các tác vụ được sắp xếp (ổn định) theo pha trước khi gộp ---
+# Thứ tự chọn của người dùng chỉ được giữ giữa các tác vụ cùng pha; thứ tự giữa các pha là cố định
+# (xóa sheet trước khi dọn gói, dọn gói trước khi mở Excel) vì các bước sau dựa trên kết quả bước trước.
+PHASE_STRUCTURE = 0   # Thay đổi cấu trúc workbook (xóa sheet...), phải chạy trước
+PHASE_PACKAGE = 1     # Dọn dẹp/tối ưu trên gói OOXML
+PHASE_SHEETS = 2      # Thao tác trên từng sheet qua COM
+PHASE_WORKBOOK = 3    # Thao tác COM còn lại trên toàn workbook
+PHASE_FINAL = 4       # Sửa gói sau khi Excel đã lưu file lần cuối (đóng gói lại)
+
+class TaskStage:
+    """
+    Mô tả cách một tác vụ tham gia kế hoạch gộp. Chỉ cần một trong các hook:
+        plan_package(zf, edits, file_path, options): thêm thao tác vào `edits` (ooxml_package.rewrite_package);
+            trả về False/None nếu không có gì cần làm.
+        run_sheet(controller, sheet_name, options): xử lý một sheet hiển thị qua COM.
+        run: None -> dùng hàm run(controller, file_path, ...) của process như trước.
+    `requires_ooxml`: tác vụ chỉ có nghĩa với gói .xlsx/.xlsm (bị bỏ qua với file .xls).
+    `compresslevel`: mức nén deflate khi ghi gói (mức cao nhất trong bước được dùng; None: mặc định).
+    `verify(đường dẫn file tạm, đường dẫn gốc) -> bool`: kiểm tra gói mới trước khi thay file.
+    """
+    def __init__(self, task_id, phase=PHASE_WORKBOOK, plan_package=None, run_sheet=None, requires_ooxml=False,
+                 compresslevel=None, verify=None):
+        self.task_id = task_id
+        self.phase = phase
+        self.plan_package = plan_package
+        self.run_sheet = run_sheet
+        self.requires_ooxml = requires_ooxml
+        self.compresslevel = compresslevel
+        self.verify = verify
+
+    def kind_for(self, package=True):
+        """Loại bước của tác vụ; `package=False` (file .xls) thì bước gói chạy bằng hàm run qua Excel."""
+        if self.plan_package is not None:
+            return KIND_PACKAGE if package else KIND_WORKBOOK
+        if self.run_sheet is not None:
+            return KIND_SHEETS
+        return KIND_WORKBOOK
+
+    @property
+    def kind(self):
+        return self.kind_for(True)
+
+# ======================================================================
+# --- Nhóm 1: Lập kế hoạch ---
+# ======================================================================
+
+def build_stages(tasks, stage_factories, options):
+    """
+    Tạo TaskStage cho từng tác vụ. `stage_factories`: task_id -> hàm fusion_stage(options)
+    của process (trả về TaskStage hoặc None). Tác vụ không có factory chạy như tác vụ workbook.
+    """
+    stages = {}
+    for task_id in tasks:
+        factory = (stage_factories or {}).get(task_id)
+        stage = factory(options) if factory else None
+        stages[task_id] = stage or TaskStage(task_id)
+    return stages
+
+def plan(tasks, stages, package=True):
+    """
+    Sắp xếp ổn định các tác vụ theo pha (xem PHASE_*) rồi gộp các tác vụ liền kề cùng loại
+    (package hoặc sheets) thành một bước. Trả về danh sách {'kind', 'tasks'}.
+    `package=False` cho file không phải gói OOXML: mọi bước gói thành tác vụ workbook qua Excel.
+    """
+    ordered = sorted(tasks, key=lambda task_id: stages[task_id].phase)
+    steps = []
+    for task_id in ordered:
+        kind = stages[task_id].kind_for(package)
+        if steps and kind != KIND_WORKBOOK and steps[-1]['kind'] == kind:
+            steps[-1]['tasks'].append(task_id)
+        else:
+            steps.append({'kind': kind, 'tasks': [task_id]})
+    return steps
+
+def planned_tasks(steps):
+    """Các tác vụ theo đúng thứ tự sẽ chạy trong kế hoạch."""
+    return [task_id for step in steps for task_id in step['tasks']]
+
+def needs_excel(steps):
+    """True nếu kế hoạch có ít nhất một bước cần Excel (COM)."""
+    return any(step['kind'] != KIND_PACKAGE for step in steps)
+
+def describe(steps):
+    """Mô tả ngắn gọn kế hoạch để ghi log, ví dụ 'package[a+b] -> sheets[c+d] -> workbook[e]'."""
+    return " -> ".join(f"{step['kind']}[{'+'.join(step['tasks'])}]" for step in steps)
+
+# ======================================================================
+# --- Nhóm 2: Thực thi ---
+# ======================================================================
+
+def apply_package_step(file_path, task_ids, stages, options):
+    """
+    Mở gói một lần, cho từng tác vụ thêm thao tác của mình vào cùng một `edits`
+    (thao tác trên cùng part được nối tiếp bằng ooxml_package.chain_edit), rồi ghi gói một lần.
+    Tác vụ có `compresslevel` (đóng gói lại) buộc ghi lại gói kể cả khi không có thao tác nào.
+    """
+    edits = {}
+    with zipfile.ZipFile(file_path) as zf:
+        for task_id in task_ids:
+            logging.debug(f"  -> Lập thao tác cho tác vụ '{task_id}'.")
+            stages[task_id].plan_package(zf, edits, file_path, options)
+    levels = [stages[task_id].compresslevel for task_id in task_ids if stages[task_id].compresslevel is not None]
+    checks = [stages[task_id].verify for task_id in task_ids if stages[task_id].verify is not None]
+    if not edits and not levels:
+        logging.info(f"Không có thay đổi nào cho file: {os.path.basename(file_path)}")
+        return True
+    verify = (lambda path: all(check(path, file_path) for check in checks)) if checks else None
+    ooxml_package.rewrite_package(file_path, edits, compresslevel=max(levels) if levels else None, verify=verify)
+    logging.info(f"Đã ghi gói một lần cho {len(task_ids)} tác vụ ({len(edits)} part thay đổi): {os.path.basename(file_path)}")
+    return True
+
+def run_sheet_step(controller, task_ids, stages, options):
+    """Duyệt các sheet hiển thị một lần; trên mỗi sheet chạy lần lượt mọi tác vụ của bước."""
+    visible_sheets, _ = controller.get_sheets_visibility()
+    for sheet_name in visible_sheets:
+        logging.debug(f"Đang xử lý sheet: '{sheet_name}'")
+        for task_id in task_ids:
+            stages[task_id].run_sheet(controller, sheet_name, options)
+    logging.info(f"Đã chạy {len(task_ids)} tác vụ trong một vòng qua {len(visible_sheets)} sheet.")
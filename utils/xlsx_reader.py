@@ -0,0 +1,200 @@
+# Đường dẫn: excel_toolkit/utils/xlsx_reader.py
+# Phiên bản 1.0 - Đọc sheet .xlsx/.xlsm theo luồng (iterparse), chỉ giải mã các cột được yêu cầu
+# Ngày cập nhật: 2026-10-17
+
+import zipfile
+import xml.etree.ElementTree as ET
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601
+from utils import ooxml_package, offline_shared_strings_ops, offline_style_ops
+
+_NS = f"{{{ooxml_package.NS_MAIN}}}"
+_ROW, _CELL, _VALUE, _SHEET_DATA = f"{_NS}row", f"{_NS}c", f"{_NS}v", f"{_NS}sheetData"
+_TEXT, _RUN, _INLINE = f"{_NS}t", f"{_NS}r", f"{_NS}is"
+
+def column_index(ref):
+    """Chỉ số cột (bắt đầu từ 0) của tham chiếu ô dạng 'AB12' hoặc tên cột 'AB'."""
+    index = 0
+    for ch in ref:
+        code = ord(ch)
+        if code < 65:
+            break
+        index = index * 26 + (code & 31)
+    return index - 1
+
+def _rich_text(element):
+    """Nối văn bản của <si>/<is>: <t> trực tiếp và <t> trong các run <r>, bỏ phiên âm <rPh>."""
+    parts = []
+    for child in element:
+        if child.tag == _TEXT:
+            parts.append(child.text or '')
+        elif child.tag == _RUN:
+            text = child.find(_TEXT)
+            if text is not None:
+                parts.append(text.text or '')
+    return ''.join(parts)
+
+# ======================================================================
+# --- Nhóm 1: Thông tin chung của workbook ---
+# ======================================================================
+
+def read_shared_strings(zf):
+    """Danh sách chuỗi trong bảng shared strings (đọc theo luồng), rỗng nếu workbook không có."""
+    part = offline_shared_strings_ops.shared_strings_part_name(zf)
+    if not part:
+        return []
+    strings = []
+    with zf.open(part) as f:
+        for _, element in ET.iterparse(f):
+            if element.tag == f"{_NS}si":
+                strings.append(_rich_text(element))
+                element.clear()
+    return strings
+
+def date_styles(zf):
+    """
+    Trả về (date_styles, timedelta_styles): tập chỉ số cellXfs có định dạng số là ngày/giờ
+    hoặc khoảng thời gian ([h]:mm...), để đổi số serial sang datetime như openpyxl/pandas.
+    """
+    part = offline_style_ops.styles_part_name(zf)
+    if not part:
+        return set(), set()
+    root = ET.fromstring(zf.read(part))
+    formats = dict(BUILTIN_FORMATS)
+    for fmt in root.iter(f"{_NS}numFmt"):
+        formats[int(fmt.get('numFmtId', -1))] = fmt.get('formatCode', '')
+    dates, durations = set(), set()
+    cell_xfs = root.find(f"{_NS}cellXfs")
+    for index, xf in enumerate(cell_xfs if cell_xfs is not None else ()):
+        code = formats.get(int(xf.get('numFmtId', 0)))
+        if code and is_date_format(code):
+            dates.add(index)
+            if is_timedelta_format(code):
+                durations.add(index)
+    return dates, durations
+
+def workbook_epoch(zf):
+    """Mốc ngày của workbook: 1904 nếu <workbookPr date1904="1">, ngược lại 1900."""
+    root = ET.fromstring(zf.read(ooxml_package.workbook_part_name(zf)))
+    pr = root.find(f"{_NS}workbookPr")
+    date1904 = pr is not None and pr.get('date1904', '0').lower() in ('1', 'true')
+    return CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+def worksheet_part(zf, sheet=0):
+    """
+    Part XML của worksheet theo tên hoặc theo thứ tự (0 là worksheet đầu tiên, bỏ qua chartsheet
+    như pandas/openpyxl). Ném KeyError nếu không tìm thấy.
+    """
+    worksheets = [s for s in ooxml_package.workbook_sheets(zf)
+                  if s['part'] and s['part'] in zf.NameToInfo and '/worksheets/' in s['part']]
+    if isinstance(sheet, int):
+        if 0 <= sheet < len(worksheets):
+            return worksheets[sheet]['part']
+        raise KeyError(f"Không có worksheet thứ {sheet}.")
+    for entry in worksheets:
+        if entry['name'] == sheet:
+            return entry['part']
+    raise KeyError(f"Không tìm thấy sheet '{sheet}'.")
+
+def sheet_dimension(zf, part):
+    """(số hàng, số cột) theo <dimension ref> ở đầu sheet; None nếu sheet không khai báo."""
+    with zf.open(part) as f:
+        for event, element in ET.iterparse(f, events=('start',)):
+            if element.tag == f"{_NS}dimension":
+                last = element.get('ref', '').split(':')[-1]
+                digits = last.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz$').replace('$', '')
+                if not digits.isdigit():
+                    return None
+                return int(digits), column_index(last.replace('$', '')) + 1
+            if element.tag == _SHEET_DATA:
+                return None
+    return None
+
+# ======================================================================
+# --- Nhóm 2: Đọc hàng theo luồng ---
+# ======================================================================
+
+class _CellDecoder:
+    """Giải mã giá trị <c> giống openpyxl: shared string, bool, lỗi -> None, số serial ngày -> datetime."""
+    def __init__(self, zf):
+        self.strings = read_shared_strings(zf)
+        self.dates, self.durations = date_styles(zf)
+        self.epoch = workbook_epoch(zf)
+
+    def decode(self, cell):
+        kind = cell.get('t', 'n')
+        if kind == 'inlineStr':
+            inline = cell.find(_INLINE)
+            return _rich_text(inline) if inline is not None else None
+        value = cell.find(_VALUE)
+        text = value.text if value is not None else None
+        if text is None:
+            return None
+        if kind == 'n':
+            number = int(text) if text.lstrip('-').isdigit() else float(text)
+            style = cell.get('s')
+            if style is not None and self.dates and int(style) in self.dates:
+                try:
+                    return from_excel(number, self.epoch, timedelta=int(style) in self.durations)
+                except (OverflowError, ValueError):
+                    return number
+            return number
+        if kind == 's':
+            return self.strings[int(text)]
+        if kind == 'b':
+            return text == '1' or text.lower() == 'true'
+        if kind == 'e':
+            return None
+        if kind == 'd':
+            return from_ISO8601(text)
+        return text
+
+def iter_sheet_rows(file_path, sheet=0, columns=None, min_row=1, max_row=None):
+    """
+    Đọc sheet theo luồng và trả về lần lượt (số hàng bắt đầu từ 1, danh sách giá trị) cho các hàng
+    có ít nhất một ô chứa giá trị ở bất kỳ cột nào (hàng trống hoặc chỉ có định dạng bị bỏ qua,
+    người gọi tự điền nếu cần).
+        - columns: danh sách chỉ số cột (từ 0); chỉ các ô thuộc cột này được giải mã, giá trị trả về
+          theo đúng thứ tự `columns`. None: mọi cột, danh sách dài tới ô cuối cùng có trong hàng.
+        - min_row/max_row: giới hạn số hàng; dừng đọc ngay khi vượt max_row.
+    Bộ nhớ cố định theo một hàng (cộng bảng shared strings); phần tử XML được giải phóng sau mỗi hàng.
+    """
+    with zipfile.ZipFile(file_path) as zf:
+        part = worksheet_part(zf, sheet)
+        decoder = _CellDecoder(zf)
+        positions = {column: i for i, column in enumerate(columns)} if columns is not None else None
+        width = len(columns) if columns is not None else 0
+        with zf.open(part) as f:
+            sheet_data = None
+            row_number = 0
+            for event, element in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == _SHEET_DATA:
+                        sheet_data = element
+                    continue
+                if element.tag != _ROW:
+                    continue
+                row_number = int(element.get('r', row_number + 1))
+                if max_row is not None and row_number > max_row:
+                    break
+                if row_number >= min_row:
+                    values = [None] * width
+                    column = -1
+                    has_value = False
+                    for cell in element.iter(_CELL):
+                        ref = cell.get('r')
+                        column = column_index(ref) if ref else column + 1
+                        if len(cell):
+                            has_value = True
+                        if positions is None:
+                            if column >= len(values):
+                                values.extend([None] * (column + 1 - len(values)))
+                            values[column] = decoder.decode(cell)
+                        else:
+                            position = positions.get(column)
+                            if position is not None:
+                                values[position] = decoder.decode(cell)
+                    if has_value:
+                        yield row_number, values
+                if sheet_data is not None:
+                    sheet_data.clear()